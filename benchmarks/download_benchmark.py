@@ -0,0 +1,90 @@
+"""
+A benchmark script measuring the throughput of core_api.download with different numbers of workers.
+Partitions are served by a local bandwidth-limited stand-in for the hub.
+
+usage: python benchmarks/download_benchmark.py [-n 16] [-s 4] [-b 4] [-w 1 2 4 8] [-g 1]
+rlsn 2024
+"""
+import os, sys
+sys.path.append(os.getcwd())
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pygestor
+from pygestor import core_api
+from pygestor.metastore import MetaStore
+from pygestor.dataset_wrapper import BaseDataset, Dataset, dataset_struct, subset_struct, partition_struct
+from pygestor.downloader import download_file
+from pygestor.utils import joinpath
+sys.path.append(os.path.dirname(__file__))
+from hub_standin import HubStandin
+
+@Dataset.register("benchmark/hub_standin")
+class StandinDataset(BaseDataset):
+    namespace = "benchmark/hub_standin"
+    abstract = False
+    data_dir = None
+    n_segments = 1
+
+    @classmethod
+    def download(cls, datapath, plan=None):
+        source = core_api.get_meta(datapath[0])["source"]
+        part_info = core_api.get_meta(*datapath)
+        download_path = joinpath(cls.data_dir, part_info["path"])
+        return download_file(f"{source}/{part_info['hf_path']}", download_path, size=part_info["size"], 
+                             n_segments=cls.n_segments, min_segment_size=2**20)
+
+def make_partitions(root, n, size):
+    rng = np.random.default_rng(0)
+    n_rows = max(1, size//1024)
+    for i in range(n):
+        col = pa.array([rng.bytes(1024) for _ in range(n_rows)], type=pa.binary())
+        pq.write_table(pa.table({"blob":col}), os.path.join(root, f"part-{i:05d}.parquet"), compression="none")
+
+def run(n_partitions, size, bandwidth, workers_list, n_segments):
+    tmp = tempfile.mkdtemp()
+    hub_dir = os.path.join(tmp, "hub")
+    os.makedirs(hub_dir)
+    make_partitions(hub_dir, n_partitions, size)
+    total = sum(os.path.getsize(os.path.join(hub_dir, f)) for f in os.listdir(hub_dir))
+
+    core_api.DATA_DIR = StandinDataset.data_dir = os.path.join(tmp, "data")
+    StandinDataset.n_segments = n_segments
+    core_api.CACHE_DIR = os.path.join(tmp, "cache")
+    store = MetaStore.get("journal")(os.path.join(tmp, "metadata.json"), limit=1e6)
+
+    with HubStandin(hub_dir, bandwidth=bandwidth) as hub:
+        meta = core_api.initialize_root()
+        ds = meta["datasets"][StandinDataset.namespace] = dataset_struct(
+            path=StandinDataset.namespace, source=hub.url, dataset_class=StandinDataset.namespace)
+        subs = ds["subsets"]["data"] = subset_struct(path=joinpath(StandinDataset.namespace, "data"))
+        for f in sorted(os.listdir(hub_dir)):
+            subs["partitions"][f] = partition_struct(path=joinpath(subs["path"], f), 
+                                                     size=os.path.getsize(os.path.join(hub_dir, f)), hf_path=f)
+        store.commit(meta)
+        core_api.load_meta(store)
+
+        print(f"{'workers':^10}|{'time(s)':^10}|{'throughput(MB/s)':^18}")
+        for workers in workers_list:
+            t = time.time()
+            failed = pygestor.download(StandinDataset.namespace, "data", 
+                                       force_redownload=True, verbose=False, max_workers=workers)
+            elapsed = time.time()-t
+            assert len(failed)==0, failed
+            print(f"{workers:^10}|{elapsed:^10.2f}|{total/elapsed/1e6:^18.2f}")
+    store.close()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--n_partitions', type=int, default=16, help="number of partitions")
+    parser.add_argument('-s', '--size_mb', type=float, default=4, help="size of each partition in MB")
+    parser.add_argument('-b', '--bandwidth_mb', type=float, default=4, help="bandwidth of a single stream in MB/s")
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1, 2, 4, 8], help="numbers of workers to benchmark")
+    parser.add_argument('-g', '--segments', type=int, default=1, help="number of parallel byte ranges per partition")
+    args = parser.parse_args()
+    run(args.n_partitions, int(args.size_mb*1e6), args.bandwidth_mb*1e6, args.workers, args.segments)
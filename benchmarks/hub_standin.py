@@ -0,0 +1,90 @@
+"""
+A local HTTP stand-in for the dataset hub used by benchmarks. 
+Files under a root directory are served with a per-connection bandwidth limit and latency,
+which mimics the behavior of a single download stream from a remote host. 
+Single byte-range requests are supported.
+rlsn 2024
+"""
+import os
+import time
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from pygestor.utils import Mutable
+
+class ThrottledHandler(SimpleHTTPRequestHandler):
+    bandwidth = 4e6     # bytes per second per connection
+    latency = 0.05      # seconds before the first byte
+    chunk_size = 64*1024
+    drop_after = None   # bytes sent before the connection is dropped, to simulate interruptions
+    drops = None        # Mutable counter of connections left to drop
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        self._range = None
+        path = self.translate_path(self.path)
+        spec = self.headers.get("Range")
+        if spec is None or not os.path.isfile(path):
+            return super().send_head()
+        # single range requests, i.e. bytes=start-[end]
+        size = os.path.getsize(path)
+        start, end = spec.split("=")[-1].split("-")
+        start, end = int(start), (int(end)+1 if end else size)
+        if start>=size:
+            self.send_error(416)
+            return None
+        end = min(end, size)
+        f = open(path, "rb")
+        f.seek(start)
+        self._range = end-start
+        self.send_response(206)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Range", f"bytes {start}-{end-1}/{size}")
+        self.send_header("Content-Length", str(end-start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        return f
+
+    def copyfile(self, source, outputfile):
+        time.sleep(self.latency)
+        remaining = self._range
+        drop = self.drop_after is not None and self.drops.get()>0
+        if drop:
+            self.drops.set(self.drops.get()-1)
+        sent = 0
+        while remaining is None or remaining>0:
+            t = time.time()
+            buf = source.read(self.chunk_size if remaining is None else min(self.chunk_size, remaining))
+            if not buf:
+                break
+            if drop and sent+len(buf)>self.drop_after:
+                outputfile.write(buf[:self.drop_after-sent])
+                self.close_connection = True
+                return
+            outputfile.write(buf)
+            sent += len(buf)
+            if remaining is not None:
+                remaining -= len(buf)
+            time.sleep(max(0, len(buf)/self.bandwidth-(time.time()-t)))
+
+class HubStandin(object):
+    def __init__(self, root:str, bandwidth:float=4e6, latency:float=0.05, drop_after:int=None, drops:int=0):
+        handler = type("Handler", (ThrottledHandler,), dict(bandwidth=bandwidth, latency=latency, 
+                                                          drop_after=drop_after, drops=Mutable(drops)))
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=root))
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self)->str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,67 @@
+"""
+A benchmark script comparing the row-by-row and the columnar conversion of batches in process_samples,
+on synthetic batches of text and numeric columns, and optionally a column of small png images.
+
+usage: python benchmarks/process_samples_benchmark.py [-r 1024] [-c 4 16 64] [-n 10] [--images]
+rlsn 2024
+"""
+import os, sys
+sys.path.append(os.getcwd())
+import io
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from PIL import Image
+from pygestor.utils import AttrDict, samples_to_columns
+from pygestor.datasets.wit_base import decode_image
+
+def rowwise(samples, decoders=None):
+    # the conversion process_samples did before the columnar path
+    decoders = decoders or dict()
+    data = AttrDict([(col,[]) for col in samples.columns])
+    for row in samples.itertuples():
+        for col in samples.columns:
+            value = getattr(row, col)
+            data[col].append(decoders[col](value) if col in decoders else value)
+    return data
+
+def make_batch(n_rows, n_cols, images=False):
+    rng = np.random.default_rng(0)
+    columns = dict()
+    for c in range(n_cols):
+        if c%2==0:
+            columns[f"text_{c}"] = [f"sample {i} of column {c}" for i in range(n_rows)]
+        else:
+            columns[f"value_{c}"] = rng.standard_normal(n_rows)
+    if images:
+        with io.BytesIO() as b:
+            Image.fromarray(rng.integers(0, 255, (32, 32, 3), dtype=np.uint8)).save(b, format="png")
+            png = b.getvalue()
+        columns["image"] = [dict(bytes=png, path=None) for _ in range(n_rows)]
+    return pd.DataFrame(columns)
+
+def timeit(fn, n):
+    t = time.time()
+    for _ in range(n):
+        fn()
+    return (time.time()-t)/n
+
+def run(n_rows, cols_list, n_repeats, images):
+    decoders = dict(image=decode_image) if images else None
+    print(f"{'columns':^10}|{'row-wise(ms)':^14}|{'columnar(ms)':^14}|{'speedup':^10}")
+    for n_cols in cols_list:
+        batch = make_batch(n_rows, n_cols, images)
+        assert rowwise(batch).keys()==samples_to_columns(batch).keys()
+        slow = timeit(lambda: rowwise(batch, decoders), n_repeats)
+        fast = timeit(lambda: samples_to_columns(batch, decoders), n_repeats)
+        print(f"{n_cols:^10}|{slow*1e3:^14.2f}|{fast*1e3:^14.2f}|{slow/fast:^10.1f}")
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--rows', type=int, default=1024, help="rows per batch")
+    parser.add_argument('-c', '--columns', type=int, nargs='+', default=[4, 16, 64], help="numbers of columns to benchmark")
+    parser.add_argument('-n', '--repeats', type=int, default=10, help="number of conversions timed")
+    parser.add_argument('--images', action='store_true', help="add a column of png images decoded per item")
+    args = parser.parse_args()
+    run(args.rows, args.columns, args.repeats, args.images)
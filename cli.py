@@ -17,6 +17,7 @@ if __name__=="__main__":
     parser.add_argument('-s', '--subset_name', type=str, help="specify subset", default=None)
     parser.add_argument('-r', '--remove', action='store_true', help="remove downloaded data as specified (using -d and -s)")
     parser.add_argument('-u', '--download', action='store_true', help="download the specified subset of a dataset (using -d and -s)")
+    parser.add_argument('-migrate', '--migrate_meta', type=str, help="migrate a json metadata file into the configured metadata backend", default=None)
 
     args = parser.parse_args()
 
@@ -38,3 +39,6 @@ if __name__=="__main__":
 
     elif args.remove:
         pygestor.remove(args.dataset_name, args.subset_name)
+
+    elif args.migrate_meta is not None:
+        pygestor.migrate_meta(args.migrate_meta)
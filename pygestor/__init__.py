@@ -2,6 +2,7 @@
 This script contains global configurations of the module
 rlsn 2024
 """
+import os
 from .core_api import *
 from .utils import AttrDict
 
@@ -9,5 +10,22 @@ sys_config = AttrDict.from_json("./confs/system.conf")
 CACHE_DIR = sys_config.cache_dir
 DATA_DIR = sys_config.data_dir
 META_PATH = sys_config.meta_path
+META_BACKEND = sys_config.meta_backend
+META_JOURNAL_LIMIT = int(sys_config.meta_journal_limit_mb*1e6)
+# next to the download cache by default, hidden so that it is not taken for a cache entry
+FOOTER_CACHE_PATH = sys_config.footer_cache_path or os.path.join(CACHE_DIR, ".footers.db")
+FOOTER_CACHE_MAX_ENTRIES = sys_config.footer_cache_max_entries
 AUTO_CLEAR_CACHE = sys_config.auto_clear_cache
+CACHE_BUDGET = int(sys_config.cache_budget_mb*1e6) if sys_config.cache_budget_mb is not None else None
+MAX_DOWNLOAD_WORKERS = sys_config.max_download_workers
+RESUMABLE_DOWNLOAD = sys_config.resumable_download
+DOWNLOAD_SEGMENTS = sys_config.download_segments
+DOWNLOAD_SEGMENT_SIZE = int(sys_config.download_segment_mb*1e6)
+CACHE_DECODED = sys_config.cache_decoded
+DECODED_CACHE_DIR = sys_config.decoded_cache_dir
+DECODED_CACHE_BUDGET = int(sys_config.decoded_cache_budget_mb*1e6) if sys_config.decoded_cache_budget_mb is not None else None
+LOCAL_TIER = sys_config.local_tier
+LOCAL_TIER_DIR = sys_config.local_tier_dir
+LOCAL_TIER_BUDGET = int(sys_config.local_tier_budget_mb*1e6) if sys_config.local_tier_budget_mb is not None else None
+STATS_COLUMNS = sys_config.stats_columns
 DEFAULT_SUBSET_NAME = sys_config.default_subset_name
\ No newline at end of file
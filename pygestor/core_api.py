@@ -3,15 +3,28 @@ This script contains core functional APIs of the module
 rlsn 2024
 """
 import os, shutil
-import json
 import pandas as pd
+import pyarrow as pa
 import time
-from typing import Generator
+import threading
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from .dataset_wrapper import BaseDataset, Dataset
-from .__init__ import DATA_DIR, META_PATH, CACHE_DIR, DEFAULT_SUBSET_NAME
-from .utils import AttrDict, compute_nsamples, load_parquets, load_parquets_in_batch, compute_subset_download, compute_subset_size, joinpath
+from .metastore import MetaStore, migrate, node_fields
+from .footer_cache import get_footer_cache
+from .disk_cache import DiskCache
+from .decoded_cache import DecodedCache
+from .local_tier import LocalTier
+from .stream import DataStream, PipelinedStream, SubsetView
+from .worker_pool import WorkerPoolStream
+from .stats_index import partition_stats, prune, encode_schema, decode_schema
+from .__init__ import DATA_DIR, META_PATH, META_BACKEND, CACHE_DIR, DEFAULT_SUBSET_NAME, AUTO_CLEAR_CACHE, CACHE_BUDGET, MAX_DOWNLOAD_WORKERS, \
+    CACHE_DECODED, DECODED_CACHE_DIR, DECODED_CACHE_BUDGET, LOCAL_TIER, LOCAL_TIER_DIR, LOCAL_TIER_BUDGET, STATS_COLUMNS
+from .utils import AttrDict, compute_nsamples, read_schema, unify_schema, load_parquets, load_ipc_files, compute_subset_download, compute_subset_size, joinpath, refresh_rollup, update_partition
     
 _metadata = dict()
+_meta_store:MetaStore = None
+_meta_lock = threading.RLock()
 
 def initialize_root():
     metadata = dict()
@@ -22,29 +35,42 @@ def initialize_root():
 
     return metadata
 
-def load_meta():
-    try:
-        with open(META_PATH, "r") as fp:
-            metadata = json.load(fp)
-        print("[INFO] loaded metadata file.")
-        
-    except:
-        prompt = input("[WARNING] metadata file is corrupted or not initialized, a new file will be created. Continue?[y/n]")
-        if prompt.lower()!="y":
-            print("[INFO] initialization aborted.")
-            return
-        # create a backup in case of bad decision
-        if os.path.exists(META_PATH):
-            shutil.copyfile(META_PATH, META_PATH+'.bak')
-        metadata = initialize_root()
-
-    for k in metadata:
-        _metadata[k] = metadata[k]
-    return _metadata
+def load_meta(store:MetaStore=None):
+    global _meta_store
+    if store is None:
+        store = MetaStore.get(META_BACKEND)(META_PATH)
+
+    with _meta_lock:
+        try:
+            metadata = store.load()
+            print("[INFO] loaded metadata file.")
+            
+        except:
+            prompt = input("[WARNING] metadata file is corrupted or not initialized, a new file will be created. Continue?[y/n]")
+            if prompt.lower()!="y":
+                print("[INFO] initialization aborted.")
+                return
+            # create a backup in case of bad decision
+            store.backup()
+            metadata = initialize_root()
 
-load_meta()
+        # the store is only set once its metadata is in place, get_meta relies on it
+        _metadata.clear()
+        for k in metadata:
+            _metadata[k] = metadata[k]
+        if _meta_store is not None and _meta_store is not store:
+            _meta_store.close()
+        _meta_store = store
+    return _metadata
 
 def get_meta(*args):
+    if _meta_store is None:
+        # loaded on first access rather than at import
+        with _meta_lock:
+            if _meta_store is None:
+                load_meta()
+            if _meta_store is None:
+                raise Exception("[ERROR] metadata is not initialized.")
     path = list(args)
     if len(path)==0:
         return _metadata
@@ -55,23 +81,74 @@ def get_meta(*args):
         metadata = metadata["partitions"][path.pop(0)]
     return metadata
 
-def write_meta(metadata=None):
-    if metadata is not None:
-        for k in metadata:
-            _metadata[k] = metadata[k]
-
-    with open(META_PATH, "w") as fp:
-        json.dump(_metadata, fp, ensure_ascii=True, indent=4)
+def write_meta(metadata=None, path:tuple=()):
+    """persist the metadata. 
+    Args:
+        metadata (dict, optional): top-level entries to be merged before writing. Defaults to None.
+        path (tuple, optional): (dataset, subset, partition) prefix of the entry that changed, 
+            backends that support it only write that entry. Defaults to () i.e. everything.
+    """
+    get_meta()
+    with _meta_lock:
+        if metadata is not None:
+            for k in metadata:
+                _metadata[k] = metadata[k]
+
+        _meta_store.commit(_metadata, tuple(path))
     print("[INFO] metadata file updated.")
 
+def get_dataset_summary(name:str)->dict:
+    """fields of a dataset entry without its subsets. Backends with sharded metadata serve it from the index without parsing the shard"""
+    datasets = get_meta()["datasets"]
+    if hasattr(datasets, "summary"):
+        return datasets.summary(name)
+    return node_fields(datasets[name])
+
+def migrate_meta(src_path:str, src_backend:str="json", dst_path:str=None, dst_backend:str=None):
+    """one-shot copy of existing metadata into another backend, by default the configured one"""
+    src = MetaStore.get(src_backend)(src_path)
+    dst = MetaStore.get(dst_backend or META_BACKEND)(dst_path or META_PATH)
+    if os.path.abspath(src.path)==os.path.abspath(dst.path):
+        raise Exception(f"[ERROR] source and destination of the migration are the same file {src.path}.")
+    migrate(src, dst)
+    print(f"[INFO] migrated metadata from {src.path} to {dst.path}.")
+    if _meta_store is not None and os.path.abspath(_meta_store.path)==os.path.abspath(dst.path):
+        load_meta(dst)
+
+_download_cache = None
+
+def get_download_cache()->DiskCache:
+    global _download_cache
+    if _download_cache is None:
+        _download_cache = DiskCache(CACHE_DIR, budget=0 if AUTO_CLEAR_CACHE else CACHE_BUDGET)
+    return _download_cache
+
+_decoded_cache = None
+
+def get_decoded_cache()->DecodedCache:
+    global _decoded_cache
+    if _decoded_cache is None:
+        _decoded_cache = DecodedCache(DECODED_CACHE_DIR, budget=DECODED_CACHE_BUDGET)
+    return _decoded_cache
+
+_local_tier = None
+
+def get_local_tier()->LocalTier:
+    global _local_tier
+    if _local_tier is None:
+        _local_tier = LocalTier(LOCAL_TIER_DIR, budget=LOCAL_TIER_BUDGET)
+    return _local_tier
+
 def clear_cache():
-    if os.path.exists(CACHE_DIR):
-        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+    # entries still used by ongoing downloads are kept
+    get_download_cache().clear()
+    get_decoded_cache().clear()
+    get_local_tier().clear()
     os.makedirs(CACHE_DIR,exist_ok=True)
 
 def get_data_cls(name):
     if name not in Dataset._dataset_classes:
-        data_cls = Dataset.get(get_meta()["datasets"][name]["dataset_class"])
+        data_cls = Dataset.get(get_dataset_summary(name)["dataset_class"])
     else:
         data_cls = Dataset.get(name)
     return data_cls
@@ -79,19 +156,27 @@ def get_data_cls(name):
 def import_from_path(path=None, name=None, subset=None, partition=None):
     pass
 
-def initialize_dataset(name:str, dataset_cls:str=None, verbose:bool=False, **kargs)->bool:
+def initialize_dataset(name:str, dataset_cls:str=None, verbose:bool=False, incremental:bool=True, **kargs)->bool:
     metadata = get_meta()
     ret = True
+    # refresh from the existing entry if there is one
+    previous = metadata["datasets"][name] if incremental and name in metadata["datasets"] else None
+    if dataset_cls is None and name in metadata["datasets"] and Dataset.get(name) is None:
+        # a dataset added by url is refreshed with the pipeline and url it was added with
+        dataset_cls = get_dataset_summary(name)["dataset_class"]
+        kargs.setdefault("url", get_dataset_summary(name)["source"])
     try:
         if Dataset.get(name) is not None and not Dataset.get(name).abstract:
-            data_info = Dataset.get(name).get_metadata(verbose=verbose)
+            data_info = Dataset.get(name).get_metadata(verbose=verbose, previous=previous)
+            refresh_rollup(data_info)
             metadata["datasets"][name] = data_info
     
         elif dataset_cls is not None:
-            data_info = Dataset.get(dataset_cls).get_metadata(name, verbose=verbose, **kargs)
+            data_info = Dataset.get(dataset_cls).get_metadata(name, verbose=verbose, previous=previous, **kargs)
+            refresh_rollup(data_info)
             metadata["datasets"][name] = data_info
 
-        write_meta(metadata)
+        write_meta(path=(name,))
     except Exception as e:
         print(f"[ERROR] Initialization failed:\n {e}")
         ret = False
@@ -102,18 +187,18 @@ def remove_dataset_metadata(name):
     if name in meta["datasets"]:
         del meta["datasets"][name]
         print(f"[INFO] removed {name} from metadata.")
-    write_meta(meta)
+    write_meta(path=(name,))
 
-def initialize(name:str=None, dataset_id:str=None, verbose:bool=True)->bool:
+def initialize(name:str=None, dataset_id:str=None, verbose:bool=True, incremental:bool=True)->bool:
     ret = True
 
     if name is not None:
-        ret &= initialize_dataset(name, dataset_id, verbose=verbose)
+        ret &= initialize_dataset(name, dataset_id, verbose=verbose, incremental=incremental)
     else:
         if input("[INFO] no dataset specified, will update all registered datasets.[y/n]").lower()=='y':
             for ds in Dataset._dataset_classes:
                 print(f"[INFO] updating metadata for {ds}")
-                ret &= initialize_dataset(ds, verbose=verbose)
+                ret &= initialize_dataset(ds, verbose=verbose, incremental=incremental)
     return ret
 
 def list_datasets(display=True):
@@ -123,7 +208,8 @@ def list_datasets(display=True):
     if display:
         print(f"{'dataset name':^25}|{'modality':^25}|{'description':^30}")
         for ds in datasets:
-            print(f"{ds:<25}|{metadata[ds]['modality']:^25}|{metadata[ds]['description']}")
+            info = get_dataset_summary(ds)
+            print(f"{ds:<25}|{info['modality']:^25}|{info['description']}")
     return datasets
 
 def list_subsets(name, display=True):
@@ -140,7 +226,7 @@ def list_subsets(name, display=True):
         for subs in subsets:
             info = metadata[name]["subsets"][subs]
             downloaded = compute_subset_download(info)
-            downloaded_str = str(compute_subset_download(info))+'/'+str(len(info['partitions']))
+            downloaded_str = str(downloaded)+'/'+str(len(info['partitions']))
             size = compute_subset_size(info)/1e6
             print(f"{subs:<25}|{downloaded_str:^25}|{size:<10.2f}|{info['path'] if downloaded>0 else ''}")
     return subsets
@@ -196,10 +282,9 @@ def remove(name, subset=None, partitions=[], force_remove=False):
         # update metadata
         for subset in metadata[name]['subsets'].values():
             for part in subset['partitions'].values():
-                part['downloaded']=False
-                part['n_samples']=0
+                update_partition(metadata[name], subset, part, downloaded=False, n_samples=0)
 
-        write_meta(root)
+        write_meta(path=(name,))
         print(f"[INFO] {metadata[name]['path']} deleted")
         return
 
@@ -220,24 +305,133 @@ def remove(name, subset=None, partitions=[], force_remove=False):
         # update metadata
         for part in info['partitions']:
             part_info = info['partitions'][part]
-            part_info['downloaded']=False
-            part_info['n_samples']=0
-            part_info["acquisition_time"]=None
-        write_meta(root)
+            update_partition(metadata[name], info, part_info, downloaded=False, n_samples=0, acquisition_time=None)
+        write_meta(path=(name, subset))
         print(f"[INFO] {info['path']} deleted")
         return
     
     # remove partitions
     for part in partitions:
         info = metadata[name]["subsets"][subset]["partitions"][part]
-        shutil.rmtree(joinpath(DATA_DIR, info["path"]), ignore_errors=True)
+        path = joinpath(DATA_DIR, info["path"])
+        if os.path.isfile(path):
+            os.remove(path)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
         # update metadata
-        info['downloaded']=False
-        info['n_samples']=0
+        update_partition(metadata[name], metadata[name]["subsets"][subset], info, downloaded=False, n_samples=0)
         print(f"[INFO] {info['path']} deleted")
-    write_meta(root)
+    write_meta(path=(name, subset))
+
+def _download_partition(data_cls:BaseDataset, name:str, subset:str, part:str, plan=None)->None:
+    datapath = (name, subset, part)
+    # dataset classes without a download plan keep their download(datapath) signature
+    downloaded_path = data_cls.download(datapath, plan) if plan is not None else data_cls.download(datapath)
+    fields = dict()
+    if isinstance(downloaded_path, tuple):
+        downloaded_path, fields = downloaded_path
+    n_samples = compute_nsamples(downloaded_path)
+    stats = _index_stats(downloaded_path, STATS_COLUMNS)
+    with _meta_lock:
+        ds_info = get_meta(name)
+        data_info = ds_info["subsets"][subset]
+        # update download info, num samples and timestamp
+        update_partition(ds_info, data_info, data_info["partitions"][part], 
+                         downloaded=True, 
+                         is_latest=True, 
+                         n_samples=n_samples, 
+                         acquisition_time=time.time(),
+                         stats=stats,
+                         **fields)
+        if stats is not None:
+            _merge_stats_schema(data_info, downloaded_path)
+        write_meta(path=(name, subset, part))
+
+def _index_stats(path:str, columns:list)->dict:
+    if not columns:
+        return None
+    try:
+        return partition_stats(path, columns)
+    except Exception as e:
+        # the partition is still usable, it is just never pruned
+        print(f"[WARNING] failed to index the statistics of {path}: {e}")
+        return None
 
-def download(name:str, subset:str=None, partitions:list=None, force_redownload:bool=False, verbose:bool=True)->None:
+def _merge_stats_schema(data_info:dict, path:str)->None:
+    # a single schema per subset, that of all its indexed partitions, against which their stats are pruned
+    schema = read_schema(path)
+    try:
+        if data_info.get("stats_schema") is not None:
+            schema = pa.unify_schemas([decode_schema(data_info["stats_schema"]), schema], promote_options="permissive")
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        print(f"[WARNING] the schema of {path} does not match that of its subset: {e}")
+        return
+    data_info["stats_schema"] = encode_schema(schema)
+
+def index_stats(name:str, subset:str=None, partitions:list=None, columns:list=None)->None:
+    """
+    record the column statistics of downloaded partitions in the metadata, e.g. for partitions downloaded before
+    stats_columns was set. Partitions are read from the footer cache.
+    Args:
+        columns (list, optional): columns to index, "*" for all. Defaults to None i.e. the stats_columns setting.
+    """
+    subset = subset or DEFAULT_SUBSET_NAME
+    filepaths = get_filepaths(name, subset, partitions)
+    parts = {path:part for part, path in _paths_by_partition(name, subset).items()}
+    with _meta_lock:
+        ds_info = get_meta(name)
+        data_info = ds_info["subsets"][subset]
+        for path in filepaths:
+            stats = _index_stats(path, columns if columns is not None else STATS_COLUMNS)
+            update_partition(ds_info, data_info, data_info["partitions"][parts[path]], stats=stats)
+            if stats is not None:
+                _merge_stats_schema(data_info, path)
+        write_meta(path=(name, subset))
+
+def _paths_by_partition(name:str, subset:str)->dict:
+    return {part:joinpath(DATA_DIR, info["path"]) for part, info in get_meta(name, subset)["partitions"].items()}
+
+def query_partitions(name:str, subset:str=None, filter=None, partitions:list=None, row_groups:bool=False):
+    """
+    partitions that may hold rows matching a filter according to the column statistics of the partitions and the
+    schema of the subset indexed in the metadata, without any file I/O. Partitions without statistics, e.g. not
+    downloaded, are always candidates. Subsets indexed before their schema was kept fall back on the footer cache for it.
+    Args:
+        filter: a pyarrow expression or DNF filters e.g. [("lang", "=", "en"), ("n_tokens", ">", 100)]
+        partitions (list, optional): partitions to consider. Defaults to None i.e. all.
+        row_groups (bool, optional): also return the candidate row groups of each partition. Defaults to False.
+    Returns:
+        list: candidate partition names, or with row_groups a dict of partition name to candidate row group
+            indices, None meaning all of them
+    """
+    subset = subset or DEFAULT_SUBSET_NAME
+    data_info = get_meta(name, subset)
+    if partitions is None:
+        partitions = list(data_info["partitions"].keys())
+    paths = _paths_by_partition(name, subset)
+    stats = [data_info["partitions"][part].get("stats") if data_info["partitions"][part]["downloaded"] else None for part in partitions]
+    indexed = [paths[part] for part, s in zip(partitions, stats) if s is not None]
+    if len(indexed)==0:
+        return {part:None for part in partitions} if row_groups else list(partitions)
+    schema = decode_schema(data_info["stats_schema"]) if data_info.get("stats_schema") is not None else read_schema(indexed[0])
+    candidates = prune(stats, filter, schema, row_groups=row_groups)
+    if row_groups:
+        return {partitions[i]:rgs for i, rgs in candidates.items()}
+    return [partitions[i] for i in candidates]
+
+def _prune_filepaths(name:str, subset:str, filepaths:list, filter)->list:
+    # whole partitions ruled out by their statistics are never opened
+    if filter is None or len(filepaths)==0:
+        return filepaths
+    parts = {path:part for part, path in _paths_by_partition(name, subset or DEFAULT_SUBSET_NAME).items()}
+    candidates = set(query_partitions(name, subset, filter, partitions=[parts[path] for path in filepaths]))
+    return [path for path in filepaths if parts[path] in candidates]
+
+def download(name:str, subset:str=None, partitions:list=None, force_redownload:bool=False, verbose:bool=True, max_workers:int=None)->dict:
+    """download partitions of a subset, up to max_workers at a time.
+    Returns:
+        dict: error messages of the partitions that failed to download, keyed by partition name
+    """
     root = get_meta()
     metadata = root["datasets"]
     os.makedirs(DATA_DIR,exist_ok=True)
@@ -254,6 +448,9 @@ def download(name:str, subset:str=None, partitions:list=None, force_redownload:b
     if subset not in metadata[name]["subsets"]:
         raise Exception(f"[ERROR] subset '{subset}' not found in '{name}'.")
 
+    if max_workers is None:
+        max_workers = MAX_DOWNLOAD_WORKERS
+
     data_cls = get_data_cls(name)    
     data_info = metadata[name]["subsets"][subset]
 
@@ -261,24 +458,47 @@ def download(name:str, subset:str=None, partitions:list=None, force_redownload:b
         # default as all partitions
         partitions = list(data_info["partitions"].keys())
 
-    for i, part in enumerate(partitions):
-        info = data_info["partitions"][part]
-        if verbose:
-            print(f"[INFO] [{i+1}/{len(partitions)}] downloading {info['path']}")
-
-        if not info["downloaded"] or force_redownload:
-            downloaded_path = data_cls.download((name, subset, part))
-            # update download info
-            info["downloaded"] = True
-            info["is_latest"] = True
-            # compute num samples
-            info["n_samples"] = compute_nsamples(downloaded_path)
-            # timestamp
-            info["acquisition_time"] = time.time()
-            write_meta(root)
+    tbd_parts = [part for part in partitions if not data_info["partitions"][part]["downloaded"] or force_redownload]
+    tbd_set = set(tbd_parts)
+    plan = None
+    if len(tbd_parts)>0:
+        try:
+            # only used by this call, so it cannot go stale
+            plan = data_cls.prepare_download(name, subset, tbd_parts)
+        except Exception as e:
+            # each partition will resolve what it needs on its own
+            print(f"[WARNING] failed to prepare the download plan: {e}")
+
+    failed = dict()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = dict()
+        for i, part in enumerate(partitions):
+            info = data_info["partitions"][part]
+            if verbose:
+                print(f"[INFO] [{i+1}/{len(partitions)}] downloading {info['path']}")
+
+            if part in tbd_set:
+                futures[executor.submit(_download_partition, data_cls, name, subset, part, plan)] = part
+
+        for future in as_completed(futures):
+            part = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                # a failing partition is reported and does not abort the rest
+                failed[part] = str(e)
+                print(f"[ERROR] failed to download {data_info['partitions'][part]['path']}: {e}")
+
+    if len(futures)>0:
+        # nothing to evict if every partition was already there
+        get_download_cache().evict()
 
     if verbose:
-        print("[INFO] downloading complete.")
+        if len(failed)>0:
+            print(f"[WARNING] downloading complete, {len(failed)} partition(s) failed.")
+        else:
+            print("[INFO] downloading complete.")
+    return failed
 
 def get_filepaths(name, subset=None, partitions=None, download_if_missing=False, verbose:bool=False, **kargs):
     filepaths = []
@@ -314,40 +534,205 @@ def get_filepaths(name, subset=None, partitions=None, download_if_missing=False,
     else:
         tbd_parts = partitions
 
-    download(name, subset, tbd_parts, verbose=verbose)
-    filepaths = [joinpath(DATA_DIR, data_info["partitions"][part]["path"]) for part in tbd_parts]
+    failed = download(name, subset, tbd_parts, verbose=verbose)
+    filepaths = [joinpath(DATA_DIR, data_info["partitions"][part]["path"]) for part in tbd_parts if part not in failed]
     return filepaths
 
+def warm_footer_cache(name:str, subset:str=None, partitions:list=None, max_workers:int=8)->None:
+    """read the parquet footers of downloaded partitions into the footer cache in parallel"""
+    filepaths = get_filepaths(name, subset, partitions)
+    get_footer_cache().warm(filepaths, max_workers=max_workers)
+
 def version_check(name:str)->bool:
-    metadata = get_meta()
     data_cls:BaseDataset = get_data_cls(name)
     is_updated = data_cls.check_update_to_date(name)
-    write_meta(metadata)
+    refresh_rollup(get_meta(name))
+    write_meta(path=(name,))
     return is_updated
 
-def load_dataset(name:str, subset:str=None, partitions:list=None, download_if_missing:bool=False, **kwargs)->pd.DataFrame:
-    
-    filepaths = get_filepaths(name, subset, partitions, download_if_missing, **kwargs)
+def load_dataset(name:str, subset:str=None, partitions:list=None, download_if_missing:bool=False, return_format:str="pandas", 
+                 columns:list=None, filter=None, cache_decoded:bool=None, local_tier:bool=None, **kwargs)->pd.DataFrame:
+    """load partitions of a subset in full.
+    Args:
+        return_format (str, optional): 'pandas' for a DataFrame, 'arrow' for a pyarrow Table or 
+            'numpy' for a dict of arrays. Defaults to "pandas".
+        columns (list, optional): columns to read, others are never decoded. Defaults to None i.e. all.
+        filter (optional): a pyarrow expression or DNF filters e.g. [("lang", "=", "en")], 
+            pushed down to the parquet scan. Defaults to None.
+        cache_decoded (bool, optional): decode partitions once into a local Arrow IPC cache and memory-map them
+            afterwards. Defaults to None i.e. the cache_decoded setting.
+        local_tier (bool, optional): read partitions from copies on a node-local disk, copied on first read.
+            Defaults to None i.e. the local_tier setting.
+    Partitions whose indexed column statistics rule out the filter are skipped without being read.
+    """
+    filepaths = _prune_filepaths(name, subset, get_filepaths(name, subset, partitions, download_if_missing, **kwargs), filter)
 
     if len(filepaths)==0:
         return []
     
-    data = load_parquets(filepaths)
+    cache_kargs = _cache_kargs(name, subset, filepaths, cache_decoded, local_tier)
+    if "decoded_cache" in cache_kargs:
+        with ExitStack() as stack:
+            # pinned until read, so that decoding the last partitions cannot evict the first ones
+            ipc_paths = [stack.enter_context(cache_kargs["decoded_cache"].use(path, version))
+                         for path, version in zip(filepaths, cache_kargs["versions"])]
+            data = load_ipc_files(ipc_paths, return_format=return_format, columns=columns, filter=filter,
+                                  schema=unify_schema(filepaths))
+        # back within the budget once unpinned, the mapped files stay readable
+        cache_kargs["decoded_cache"].disk.evict()
+        return data
+    if "local_tier" in cache_kargs:
+        with ExitStack() as stack:
+            # pinned until read, so that copying the last partitions cannot evict the first ones
+            local_paths = [stack.enter_context(cache_kargs["local_tier"].use(path, version))
+                           for path, version in zip(filepaths, cache_kargs["versions"])]
+            data = load_parquets(local_paths, return_format=return_format, columns=columns, filter=filter)
+        cache_kargs["local_tier"].disk.evict()
+        return data
+    data = load_parquets(filepaths, return_format=return_format, columns=columns, filter=filter)
     return data
 
-def stream_dataset(name:str, subset:str=None, partitions:list=None, download_if_missing:bool=False, batch_size:int=16, preprocess:bool=False, **kwargs)->Generator[pd.DataFrame,None,None]:
-
-    filepaths = get_filepaths(name, subset, partitions, download_if_missing, **kwargs)
+def _partitions_by_path(name:str, subset:str=None)->dict:
+    partitions_info = get_meta(name, subset or DEFAULT_SUBSET_NAME)["partitions"].values()
+    return {joinpath(DATA_DIR, info["path"]):info for info in partitions_info}
+
+def _partition_version(info:dict):
+    # a re-downloaded partition gets a new blob id or at least a new acquisition time
+    return info.get("blob_id") or info.get("acquisition_time")
+
+def _cache_kargs(name:str, subset:str, filepaths:list, cache_decoded:bool=None, local_tier:bool=None)->dict:
+    # the local caches of partitions enabled by the arguments or else by the settings
+    kargs = dict()
+    if CACHE_DECODED if cache_decoded is None else cache_decoded:
+        kargs["decoded_cache"] = get_decoded_cache()
+    if LOCAL_TIER if local_tier is None else local_tier:
+        kargs["local_tier"] = get_local_tier()
+    if len(kargs)>0:
+        infos = _partitions_by_path(name, subset)
+        kargs["versions"] = [_partition_version(infos[path]) for path in filepaths]
+    return kargs
+
+def stream_dataset(name:str, subset:str=None, partitions:list=None, download_if_missing:bool=False, batch_size:int=16, preprocess:bool=False, 
+                   columns:list=None, filter=None, prefetch:int=0, prefetch_threads:int=1, fragment_readahead:int=None, batch_readahead:int=None,
+                   shuffle:bool=False, seed:int=0, epoch:int=0, buffer_size:int=10000,
+                   rank:int=0, world_size:int=1, num_workers:int=1, worker:int=0, state:dict=None,
+                   multiprocess:bool=False, transform=None, ordered:bool=True, output:str="pandas", cache_decoded:bool=None,
+                   local_tier:bool=None, pipelined:bool=False, lookahead:int=2, evict_consumed:bool=False, **kwargs)->DataStream:
+    """
+    stream a dataset in batches of DataFrames, or with output='arrow' of arrow tables, or with output='numpy' of
+    dicts of numpy views on the arrow buffers (see utils.array_to_numpy), converted without copying.
+    With prefetch>0, up to that many batches are read and converted by background threads while the consumer
+    works, and the returned stream's `stats` tells how often the consumer still had to wait (n_waits,
+    wait_time in seconds, out of n_items batches). Streams support close() and `with`, a stream left before its end
+    stops its background threads once closed or collected.
+    Row groups are read ahead in parallel, batch_readahead of them from at most fragment_readahead files.
+    With shuffle, row groups of all partitions are read in a random order and their rows are mixed through a
+    buffer of buffer_size rows. The order only depends on (seed, epoch).
+    With world_size>1 or num_workers>1, the samples are split into world_size*num_workers shards of equal size,
+    computed from the n_samples recorded in the metadata, and only the shard of (rank, worker) is streamed.
+    Every sample belongs to exactly one shard in each epoch.
+    The stream's state_dict() is a small json-serializable position, passing it as state resumes the stream
+    right after the last batch returned, e.g. after a preemption, with the same arguments otherwise.
+    With multiprocess, num_workers processes are started, each streaming its own shard of the rank and applying
+    transform (a picklable function of an arrow table, e.g. decoding) to its batches, which are handed back through
+    shared memory. ordered gives a deterministic order, otherwise batches are returned as they complete.
+    With cache_decoded (by default the cache_decoded setting), each partition is decoded into a local Arrow IPC
+    file the first time it is read, and memory-mapped in later epochs and by other processes.
+    With local_tier (by default the local_tier setting), partitions are copied to a node-local disk the first time
+    they are read, by one process of the node, and read from there afterwards.
+    With download_if_missing and pipelined, batches are streamed from each partition as soon as it is downloaded,
+    while the following lookahead partitions download in the background, rather than after all downloads. Shards
+    are then made of whole partitions and rows are only shuffled within a partition (see PipelinedStream).
+    evict_consumed deletes the partitions downloaded by the stream once they have been streamed.
+    Partitions whose indexed column statistics rule out the filter are skipped without being read.
+    """
+    if pipelined and download_if_missing:
+        if multiprocess:
+            raise Exception("[ERROR] pipelined streams do not support multiprocess.")
+        return _pipelined_stream(name, subset, partitions, lookahead, evict_consumed, state=state,
+                                 batch_size=batch_size, columns=columns, filter=filter, prefetch=prefetch, prefetch_threads=prefetch_threads,
+                                 fragment_readahead=fragment_readahead, batch_readahead=batch_readahead, shuffle=shuffle, seed=seed,
+                                 epoch=epoch, buffer_size=buffer_size, rank=rank, world_size=world_size, num_workers=num_workers,
+                                 worker=worker, output=output, **_cache_kargs(name, subset, [], cache_decoded, local_tier))
+    filepaths = _prune_filepaths(name, subset, get_filepaths(name, subset, partitions, download_if_missing, **kwargs), filter)
 
     if len(filepaths)==0:
-        yield []
-
-    if batch_size>0:
-        batches = load_parquets_in_batch(filepaths, batchsize=batch_size)
-        yield from batches
-
-def process_samples(name:str, samples:pd.DataFrame)->AttrDict:
-    if name not in Dataset._dataset_classes:
-        return Dataset.get(get_meta()["datasets"][name]["dataset_class"]).process_samples(samples)
-    else:
-        return Dataset.get(name).process_samples(samples)
\ No newline at end of file
+        return iter([[]])
+
+    infos = _partitions_by_path(name, subset)
+    stream_kargs = dict(batch_size=batch_size, columns=columns, filter=filter, fragment_readahead=fragment_readahead, batch_readahead=batch_readahead,
+                        shuffle=shuffle, seed=seed, epoch=epoch, buffer_size=buffer_size, n_samples=[infos[path]["n_samples"] for path in filepaths],
+                        rank=rank, world_size=world_size, output=output)
+    stream_kargs.update(_cache_kargs(name, subset, filepaths, cache_decoded, local_tier))
+    if multiprocess:
+        return WorkerPoolStream(filepaths, num_workers=num_workers, transform=transform, ordered=ordered,
+                                prefetch=max(1, prefetch), state=state, **stream_kargs)
+    return DataStream(filepaths, prefetch=prefetch, prefetch_threads=prefetch_threads,
+                      num_workers=num_workers, worker=worker, state=state, **stream_kargs)
+
+def _pipelined_stream(name:str, subset:str=None, partitions:list=None, lookahead:int=2, evict_consumed:bool=False, **stream_kargs)->PipelinedStream:
+    subset = subset or DEFAULT_SUBSET_NAME
+    ds_info = get_meta(name)
+    if subset not in ds_info["subsets"]:
+        raise Exception(f"[ERROR] subset '{subset}' not found in '{name}'.")
+    data_info = ds_info["subsets"][subset]
+    if partitions is None:
+        partitions = list(data_info["partitions"].keys())
+    if stream_kargs.get("filter") is not None:
+        # downloaded partitions ruled out by their statistics, others can only be checked once downloaded
+        partitions = query_partitions(name, subset, stream_kargs["filter"], partitions)
+    parts = {joinpath(DATA_DIR, data_info["partitions"][part]["path"]):part for part in partitions}
+    data_cls = get_data_cls(name)
+    missing = [part for part in partitions if not data_info["partitions"][part]["downloaded"]]
+    plan = None
+    if len(missing)>0:
+        try:
+            plan = data_cls.prepare_download(name, subset, missing)
+        except Exception as e:
+            print(f"[WARNING] failed to prepare the download plan: {e}")
+    os.makedirs(DATA_DIR,exist_ok=True)
+    os.makedirs(CACHE_DIR,exist_ok=True)
+    # partitions that were already there are kept
+    fetched = set()
+
+    def fetch(path):
+        part = parts[path]
+        if not data_info["partitions"][part]["downloaded"]:
+            print(f"[INFO] downloading {data_info['partitions'][part]['path']}")
+            _download_partition(data_cls, name, subset, part, plan)
+            get_download_cache().evict()
+            fetched.add(part)
+
+    def release(path):
+        part = parts[path]
+        if evict_consumed and part in fetched:
+            with _meta_lock:
+                remove(name, subset, [part])
+            fetched.discard(part)
+
+    # partitions get new versions as they are downloaded, so local caches fall back to the file's size and mtime
+    stream_kargs.pop("versions", None)
+    return PipelinedStream(list(parts), fetch, lookahead=lookahead, release=release, **stream_kargs)
+
+def get_subset_view(name:str, subset:str=None, partitions:list=None, download_if_missing:bool=False, columns:list=None, cache_size:int=8,
+                    cache_decoded:bool=None, local_tier:bool=None, **kwargs)->SubsetView:
+    """
+    map-style view of the downloaded partitions of a subset, supporting len(view), view[i] and view[list_of_indices].
+    Samples are indexed in partition order, and only the row groups holding the requested samples are read.
+    """
+    filepaths = get_filepaths(name, subset, partitions, download_if_missing, **kwargs)
+    infos = _partitions_by_path(name, subset)
+    return SubsetView(filepaths, n_samples=[infos[path]["n_samples"] for path in filepaths], columns=columns, cache_size=cache_size,
+                      **_cache_kargs(name, subset, filepaths, cache_decoded, local_tier))
+
+def process_samples(name:str, samples:pd.DataFrame, **kargs)->AttrDict:
+    """
+    kargs are options of the dataset's process_samples, e.g. lazy or target_size for image datasets.
+    Arrow tables go to the arrow-native process_arrow of classes that have one, and through pandas otherwise.
+    """
+    data_cls = get_data_cls(name)
+    if isinstance(samples, (pa.Table, pa.RecordBatch)):
+        if data_cls.arrow_native:
+            return data_cls.process_arrow(samples, **kargs)
+        samples = samples.to_pandas()
+    return data_cls.process_samples(samples, **kargs)
\ No newline at end of file
@@ -64,17 +64,27 @@ class Dataset(object):
         return ret
     
 class BaseDataset(object):
+    # set by classes implementing process_arrow, which then receives arrow tables without a pandas conversion
+    arrow_native = False
     @classmethod
     def get_metadata(cls, *args, **kargs):
         pass
     @classmethod
-    def download(cls, datapath):
+    def download(cls, datapath, plan=None):
+        # returns the downloaded path, or the path and a dict of partition fields to record with it
+        pass
+    @classmethod
+    def prepare_download(cls, name, subset, partitions):
+        # returns a plan passed to the download of each of the partitions, e.g. remote file info
         pass
     @classmethod
     def check_update_to_date(cls, name):
         pass
     @classmethod
-    def process_samples(cls, samples:pd.DataFrame)->AttrDict:
+    def process_samples(cls, samples:pd.DataFrame, **kargs)->AttrDict:
+        pass
+    @classmethod
+    def process_arrow(cls, table, **kargs):
         pass
 
 from .datasets import *
\ No newline at end of file
@@ -6,46 +6,70 @@ rlsn 2024
 import os
 import pandas as pd
 import time
-from huggingface_hub import hf_hub_download, list_repo_files, get_paths_info
+from huggingface_hub import hf_hub_download, hf_hub_url, get_paths_info, list_repo_tree, dataset_info
+from huggingface_hub.hf_api import RepoFile
+from huggingface_hub.utils import build_hf_headers
 from ..dataset_wrapper import BaseDataset, Dataset, dataset_struct, subset_struct, partition_struct
-from ..__init__ import DATA_DIR, CACHE_DIR, AUTO_CLEAR_CACHE, DEFAULT_SUBSET_NAME
-from ..utils import compute_nsamples, all_partitions, divide_chunks, joinpath, AttrDict
+from ..downloader import download_file
+from ..__init__ import DATA_DIR, DEFAULT_SUBSET_NAME, RESUMABLE_DOWNLOAD, DOWNLOAD_SEGMENTS, DOWNLOAD_SEGMENT_SIZE
+from ..utils import compute_nsamples, all_partitions, divide_chunks, joinpath, AttrDict, samples_to_columns
+
+def get_repo_id(name):
+    from ..core_api import get_dataset_summary
+    return get_dataset_summary(name)["source"].split("huggingface.co/datasets/")[-1]
+
+def resolve_paths_info(repo_id, paths, chunk_size=100)->dict:
+    """path info of many files in a repo, fetched in chunked requests, keyed by path"""
+    paths_info = dict()
+    for chunks in divide_chunks(list(paths), chunk_size):
+        for info in get_paths_info(repo_id, chunks, repo_type="dataset"):
+            paths_info[info.path] = info
+    return paths_info
 
 @Dataset.register('HuggingFaceParquet')
 class HuggingFaceParquetDataset(BaseDataset):
     namespace = "HuggingFaceParquet"
     abstract = True
+    arrow_native = True
     @classmethod
-    def get_metadata(cls, repo_name, url, verbose=False):
+    def get_metadata(cls, repo_name, url, verbose=False, previous=None):
         """retrieve metadata from url
         Args:
             repo_name (str): a unique repo_name for this dataset in your storage 
             url (str): https://huggingface.co/datasets/{repo_id}
             verbose (bool, optional): verbose mode. Defaults to False.
+            previous (dict, optional): metadata from a previous retrieval. If given, the refresh is 
+                incremental: only files whose blob changed since are processed, the local fields 
+                of the other partitions are kept. Defaults to None.
 
         Returns:
-            _type_: success or not
+            dict: metadata of the dataset
         """
         repo_id = url.split("huggingface.co/datasets/")[-1]
+        revision = dataset_info(repo_id).sha
+        if previous is not None and previous.get("revision")==revision:
+            if verbose:
+                print(f"[INFO] {repo_id} is unchanged since revision {revision}")
+            return previous
 
         meta = dataset_struct(
             path=repo_name,
             formats="parquet",
             source=url,
             dataset_class=HuggingFaceParquetDataset.namespace,
+            revision=revision,
         )
-        
-        parquets = []
-        for path in list_repo_files(repo_id, repo_type="dataset"):
-            if path.endswith("parquet"):
-                parquets.append(path)
-        
-        paths_info = []
-        for chunks in divide_chunks(parquets, 100):
-            paths_info.extend(get_paths_info(repo_id, chunks, repo_type="dataset"))
-        for info in paths_info:
-            if verbose:
-                print(f"retrieving info from {info.path}")
+        previous_subsets = dict()
+        if previous is not None:
+            for k in ["description", "modality"]:
+                meta[k] = previous.get(k, meta[k])
+            previous_subsets = previous["subsets"]
+
+        # a single listing gives the size and blob id of every file
+        n_changed = 0
+        for info in list_repo_tree(repo_id, recursive=True, revision=revision, repo_type="dataset"):
+            if not isinstance(info, RepoFile) or not info.path.endswith("parquet"):
+                continue
 
             path = info.path.split("/")
             part = path[-1]
@@ -54,56 +78,104 @@ class HuggingFaceParquetDataset(BaseDataset):
             if subs not in meta["subsets"]:
                 meta["subsets"][subs] = subset_struct(
                     path=joinpath(repo_name, subs),
+                    description=previous_subsets[subs]["description"] if subs in previous_subsets else "",
                 )
+            prev_part = previous_subsets[subs]["partitions"].get(part) if subs in previous_subsets else None
+            if prev_part is not None and prev_part.get("hf_blob_id")==info.blob_id:
+                meta["subsets"][subs]["partitions"][part] = prev_part
+                continue
+
+            if verbose:
+                print(f"retrieving info from {info.path}")
+            n_changed += 1
             part_path = joinpath(repo_name, subs, part)
-            download_path = joinpath(DATA_DIR, part_path)
-            downloaded = os.path.exists(download_path)
-            meta["subsets"][subs]["partitions"][part]=partition_struct(
-                path=part_path,
-                size=info.size,
-                downloaded=downloaded,
-                hf_path=info.path,
-                n_samples=compute_nsamples(download_path) if downloaded else 0,
-                acquisition_time=time.time() if downloaded else None
-            )
+            if prev_part is not None:
+                # a new version of a known file, what is stored locally stays as is
+                part_info = dict(prev_part, size=info.size, hf_path=info.path)
+            else:
+                download_path = joinpath(DATA_DIR, part_path)
+                downloaded = os.path.exists(download_path)
+                part_info = partition_struct(
+                    path=part_path,
+                    size=info.size,
+                    downloaded=downloaded,
+                    hf_path=info.path,
+                    n_samples=compute_nsamples(download_path) if downloaded else 0,
+                    acquisition_time=time.time() if downloaded else None
+                )
+            part_info["hf_blob_id"] = info.blob_id
+            if part_info["downloaded"] and "blob_id" in part_info:
+                part_info["is_latest"] = part_info["blob_id"]==info.blob_id
+            meta["subsets"][subs]["partitions"][part] = part_info
+
+        if verbose:
+            print(f"[INFO] {n_changed} changed file(s) at revision {revision}")
         return meta
     
     @classmethod
-    def download(cls, datapath):
+    def download(cls, datapath, plan:dict=None):
+        """download a partition, using the path info of the plan from prepare_download if it has it.
+        Returns:
+            tuple: the downloaded path and the partition fields to record, i.e. its blob_id
+        """
         from ..core_api import get_meta
         name,_,_ = datapath
-        repo_id = get_meta(datapath[0])["source"].split("huggingface.co/datasets/")[-1]
+        repo_id = get_repo_id(name)
         part_info = get_meta(*datapath)
         download_path = joinpath(DATA_DIR, part_info["path"])
-        blob_id = get_paths_info(repo_id, part_info["hf_path"], repo_type="dataset")[0].blob_id
+        path_info = plan.get(part_info["hf_path"]) if plan is not None else None
+        if path_info is None:
+            path_info = get_paths_info(repo_id, part_info["hf_path"], repo_type="dataset")[0]
+        blob_id = path_info.blob_id
 
         os.makedirs(os.path.dirname(download_path),exist_ok=True)
-        filepath=hf_hub_download(repo_id=repo_id,
-                        filename=part_info["hf_path"],
-                        force_download = True,
-                        local_dir=CACHE_DIR,
-                        cache_dir=CACHE_DIR,repo_type="dataset")
-        part_info["blob_id"] = blob_id
-        os.replace(filepath, download_path)
-        if AUTO_CLEAR_CACHE:
-            from ..core_api import clear_cache
-            clear_cache()
-        return download_path
+        if RESUMABLE_DOWNLOAD:
+            # written next to download_path and resumed from where an interrupted download stopped.
+            # The size and version come from the path info, the redirect to the storage host is followed
+            # without the hub token
+            url = hf_hub_url(repo_id, part_info["hf_path"], repo_type="dataset")
+            download_file(url, download_path, headers=build_hf_headers(), 
+                          size=path_info.size, etag=blob_id,
+                          n_segments=DOWNLOAD_SEGMENTS, min_segment_size=DOWNLOAD_SEGMENT_SIZE)
+        else:
+            from ..core_api import get_download_cache
+            cache = get_download_cache()
+            # make room for the file, then download it into its own pinned cache entry
+            cache.evict(reserve=part_info["size"])
+            with cache.use(f"{repo_id}/{part_info['hf_path']}") as cache_dir:
+                filepath=hf_hub_download(repo_id=repo_id,
+                                filename=part_info["hf_path"],
+                                force_download = True,
+                                local_dir=cache_dir,
+                                cache_dir=cache_dir,repo_type="dataset")
+                os.replace(filepath, download_path)
+        # recorded by the caller with the rest of the download info, under the metadata lock
+        return download_path, dict(blob_id=blob_id)
     
+    @classmethod
+    def prepare_download(cls, name, subset, partitions)->dict:
+        """the path info of all partitions to be downloaded, resolved in a few batched requests and keyed by hf_path"""
+        from ..core_api import get_meta
+        repo_id = get_repo_id(name)
+        parts = get_meta(name, subset)["partitions"]
+        return resolve_paths_info(repo_id, [parts[part]["hf_path"] for part in partitions])
+
     @classmethod
     def check_update_to_date(cls, name):
         up_to_date = True
-        for part in all_partitions(name):
-            if part["downloaded"]:
-                latest_blob = get_paths_info(name, [part["hf_path"]], repo_type="dataset")[0].blob_id
-                part["is_latest"] = "blob_id" in part and part["blob_id"]==latest_blob
-                up_to_date &= part["is_latest"]
+        downloaded = [part for part in all_partitions(name) if part["downloaded"]]
+        paths_info = resolve_paths_info(get_repo_id(name), [part["hf_path"] for part in downloaded])
+        for part in downloaded:
+            latest_blob = paths_info[part["hf_path"]].blob_id if part["hf_path"] in paths_info else None
+            part["is_latest"] = "blob_id" in part and part["blob_id"]==latest_blob
+            up_to_date &= part["is_latest"]
         return up_to_date
 
     @classmethod
-    def process_samples(cls, samples:pd.DataFrame)->AttrDict:
-        data = AttrDict([(col,[]) for col in samples.columns])
-        for row in samples.itertuples():
-            for col in samples.columns:
-                data[col].append(getattr(row, col))
-        return data
\ No newline at end of file
+    def process_samples(cls, samples:pd.DataFrame, **kargs)->AttrDict:
+        return samples_to_columns(samples)
+
+    @classmethod
+    def process_arrow(cls, table, **kargs):
+        # the columns need no processing, so arrow batches are passed through as they are
+        return table
\ No newline at end of file
@@ -5,25 +5,31 @@ rlsn 2024
 
 import pandas as pd
 from ..dataset_wrapper import BaseDataset, Dataset
-from ..utils import AttrDict
+from ..utils import AttrDict, samples_to_columns
 
 @Dataset.register('wikimedia/wikipedia')
 class WikipediaDataset(BaseDataset):
     namespace = "wikimedia/wikipedia"
     abstract = False
+    arrow_native = True
     @classmethod
-    def get_metadata(cls, verbose=False):
+    def get_metadata(cls, verbose=False, previous=None):
         from .hf_parquet import HuggingFaceParquetDataset
         url = "https://huggingface.co/datasets/wikimedia/wikipedia"
-        meta = HuggingFaceParquetDataset.get_metadata(cls.namespace, url, verbose)
+        meta = HuggingFaceParquetDataset.get_metadata(cls.namespace, url, verbose, previous)
         meta["description"] = "Wikipedia dataset containing cleaned articles of all languages."
         meta["modality"]="text"
         return meta
         
     @classmethod
-    def download(cls, datapath):
+    def download(cls, datapath, plan=None):
         from .hf_parquet import HuggingFaceParquetDataset
-        return HuggingFaceParquetDataset.download(datapath)
+        return HuggingFaceParquetDataset.download(datapath, plan)
+
+    @classmethod
+    def prepare_download(cls, name, subset, partitions):
+        from .hf_parquet import HuggingFaceParquetDataset
+        return HuggingFaceParquetDataset.prepare_download(name, subset, partitions)
 
     @classmethod
     def check_update_to_date(cls, name):
@@ -31,9 +37,10 @@ class WikipediaDataset(BaseDataset):
         return HuggingFaceParquetDataset.check_update_to_date(name)
 
     @classmethod
-    def process_samples(cls, samples:pd.DataFrame)->AttrDict:
-        data = AttrDict([(col,[]) for col in samples.columns])
-        for row in samples.itertuples():
-            for col in samples.columns:
-                data[col].append(getattr(row, col))
-        return data
+    def process_samples(cls, samples:pd.DataFrame, **kargs)->AttrDict:
+        return samples_to_columns(samples)
+
+    @classmethod
+    def process_arrow(cls, table, **kargs):
+        # the columns need no processing, so arrow batches are passed through as they are
+        return table
@@ -2,30 +2,101 @@
 An API for ingesting wikimedia/wit_base dataset at https://huggingface.co/datasets/wikimedia/wit_base
 rlsn 2024
 """
+import os
+import io
+import threading
+import numpy as np
 import pandas as pd
 from PIL import Image
 from PIL.JpegImagePlugin import JpegImageFile
-import io
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from ..dataset_wrapper import BaseDataset, Dataset
-from ..utils import AttrDict
+from ..utils import AttrDict, samples_to_columns
+
+def decode_image(item, target_size:tuple=None, mode:str=None):
+    """
+    decode an image entry {'bytes':..., 'path':...}.
+    Args:
+        target_size (tuple, optional): (width, height) the image is shrunk to fit in, JPEGs are decoded
+            at a reduced scale by the codec and other formats are reduced before resampling. Defaults to None.
+        mode (str, optional): pixel mode, e.g. 'RGB', converted directly. Defaults to None i.e. non-JPEG images
+            are converted to JPEG, which is what the web UI displays.
+    """
+    img = Image.open(io.BytesIO(item['bytes']))
+    if target_size is not None:
+        # uses draft mode for JPEGs and reduce() for other formats
+        img.thumbnail(target_size, reducing_gap=2.0)
+    if mode is not None:
+        return img.convert(mode)
+    if type(img)!=JpegImageFile:
+        with io.BytesIO() as b:
+            img.convert('RGB').save(b, format="jpeg")
+            img = Image.open(b)
+            img.load()
+    else:
+        img.load()
+    return img
+
+class LazyImage(object):
+    """an image handle decoded on first access, it behaves like the decoded PIL image"""
+    def __init__(self, item, target_size:tuple=None, mode:str=None):
+        self._item = item
+        self._args = (target_size, mode)
+        self._image = None
+        self._lock = threading.Lock()
+
+    @property
+    def image(self):
+        with self._lock:
+            if self._image is None:
+                self._image = decode_image(self._item, *self._args)
+                self._item = None
+        return self._image
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.image, name)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.image, dtype=dtype)
+
+_pools = dict()
+_pools_lock = threading.Lock()
+
+def _get_pool(kind:str, num_workers:int):
+    with _pools_lock:
+        if (kind, num_workers) not in _pools:
+            if kind=="thread":
+                _pools[(kind, num_workers)] = ThreadPoolExecutor(max_workers=num_workers)
+            elif kind=="process":
+                _pools[(kind, num_workers)] = ProcessPoolExecutor(max_workers=num_workers)
+            else:
+                raise Exception(f"[ERROR] unknown pool '{kind}', expected 'thread' or 'process'.")
+        return _pools[(kind, num_workers)]
 
 @Dataset.register('wikimedia/wit_base')
 class WitbaseDataset(BaseDataset):
     namespace = "wikimedia/wit_base"
     abstract = False
     @classmethod
-    def get_metadata(cls, verbose=False):
+    def get_metadata(cls, verbose=False, previous=None):
         from .hf_parquet import HuggingFaceParquetDataset
         url = "https://huggingface.co/datasets/wikimedia/wit_base"
-        meta = HuggingFaceParquetDataset.get_metadata(cls.namespace, url, verbose)
+        meta = HuggingFaceParquetDataset.get_metadata(cls.namespace, url, verbose, previous)
         meta["description"] = "Wikimedia's version of the Wikipedia-based Image Text (WIT) Dataset, a large multimodal multilingual dataset."
         meta["modality"]="text,image"
         return meta
         
     @classmethod
-    def download(cls, datapath):
+    def download(cls, datapath, plan=None):
         from .hf_parquet import HuggingFaceParquetDataset
-        return HuggingFaceParquetDataset.download(datapath)
+        return HuggingFaceParquetDataset.download(datapath, plan)
+
+    @classmethod
+    def prepare_download(cls, name, subset, partitions):
+        from .hf_parquet import HuggingFaceParquetDataset
+        return HuggingFaceParquetDataset.prepare_download(name, subset, partitions)
     
     @classmethod
     def check_update_to_date(cls, name):
@@ -33,18 +104,28 @@ class WitbaseDataset(BaseDataset):
         return HuggingFaceParquetDataset.check_update_to_date(name)
     
     @classmethod
-    def process_samples(cls, samples:pd.DataFrame)->AttrDict:
-        data = AttrDict([(col,[]) for col in samples.columns])
-        for row in samples.itertuples():
-            for col in samples.columns:
-                if col=="image":
-                    img = Image.open(io.BytesIO(getattr(row, col)['bytes']))
-                    if type(img)!=JpegImageFile:
-                        with io.BytesIO() as b:
-                            img.convert('RGB').save(b, format="jpeg")
-                            img = Image.open(b)
-                            img.load()
-                    data[col].append(img)
-                else:
-                    data[col].append(getattr(row, col))
-        return data
\ No newline at end of file
+    def decode_images(cls, items:list, lazy:bool=False, target_size:tuple=None, mode:str=None, num_workers:int=None, pool:str="thread")->list:
+        if lazy:
+            return [LazyImage(item, target_size, mode) for item in items]
+        if num_workers is None:
+            num_workers = min(8, os.cpu_count() or 1)
+        if num_workers<=1 or len(items)<=1:
+            return [decode_image(item, target_size, mode) for item in items]
+        # codecs release the GIL, so threads decode in parallel. Images from a process pool come back as plain PIL images
+        return list(_get_pool(pool, num_workers).map(decode_image, items, [target_size]*len(items), [mode]*len(items)))
+
+    @classmethod
+    def process_samples(cls, samples:pd.DataFrame, lazy:bool=False, target_size:tuple=None, mode:str=None,
+                        num_workers:int=None, pool:str="thread")->AttrDict:
+        """
+        Args:
+            lazy (bool, optional): return image handles decoded on first access. Defaults to False.
+            target_size (tuple, optional): (width, height) images are shrunk to fit in while decoding. Defaults to None.
+            mode (str, optional): e.g. 'RGB' to get the pixels without converting to JPEG. Defaults to None.
+            num_workers (int, optional): decoding threads or processes. Defaults to None i.e. up to 8.
+            pool (str, optional): 'thread' or 'process'. Defaults to 'thread'.
+        """
+        data = samples_to_columns(samples)
+        if "image" in data:
+            data["image"] = cls.decode_images(data["image"], lazy, target_size, mode, num_workers, pool)
+        return data
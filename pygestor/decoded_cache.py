@@ -0,0 +1,41 @@
+"""
+This script contains a local cache of partitions decoded into uncompressed Arrow IPC files,
+which are memory-mapped instead of reading and decompressing the parquet again
+rlsn 2024
+"""
+import os
+import uuid
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .disk_cache import VersionedCache, digest
+
+def parquet_to_ipc(src:str, dest:str)->str:
+    """write a parquet file as an uncompressed Arrow IPC file, one record batch per row group"""
+    pf = pq.ParquetFile(src)
+    schema = pf.schema_arrow
+    tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for i in range(pf.num_row_groups):
+            table = pf.read_row_group(i).combine_chunks()
+            batches = table.to_batches()
+            writer.write_batch(batches[0] if len(batches)>0 else pa.RecordBatch.from_pylist([], schema=schema))
+    os.replace(tmp, dest)
+    return dest
+
+class DecodedCache(VersionedCache):
+    """
+    partitions decoded into Arrow IPC files, within a byte budget with LRU eviction (see VersionedCache).
+    A partition is identified by its path and a version, e.g. its blob_id or acquisition_time, so a
+    re-downloaded partition is decoded again and its stale file is removed.
+    """
+    def _name(self, path:str, version:str)->str:
+        return digest(version)+".arrow"
+
+    def _write(self, path:str, dest:str)->None:
+        parquet_to_ipc(path, dest)
+
+    def open(self, path:str, version=None)->pa.ipc.RecordBatchFileReader:
+        """memory-mapped reader of the decoded partition, record batch i is row group i"""
+        with self.use(path, version) as ipc_path:
+            # the mapping stays readable even if the file is evicted afterwards
+            return pa.ipc.open_file(pa.memory_map(ipc_path, "r"))
@@ -0,0 +1,237 @@
+"""
+This script contains a size-bounded directory cache with LRU eviction
+rlsn 2024
+"""
+import os
+import time
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+from urllib.parse import quote
+try:
+    import fcntl
+except ImportError:
+    # no cross-process locking on platforms without fcntl
+    fcntl = None
+
+def _size(path):
+    if os.path.isdir(path):
+        total = 0
+        for root, _, files in os.walk(path):
+            for f in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, f))
+                except OSError:
+                    pass
+        return total
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+class DiskCache(object):
+    """
+    entries (files or directories) directly under root, evicted in least recently used order
+    once their total size exceeds the budget. The last use of an entry is its mtime, set when it is
+    used: atimes change whenever entries are read or scanned. Hidden names are not entries. Entries in use, by this or any other process on
+    the same host, are never evicted.
+    """
+    _lock_dir = ".locks"
+
+    def __init__(self, root:str, budget:int=None):
+        self.root = root
+        self.budget = budget
+        self._pins = dict()
+        self._lock = threading.RLock()
+
+    def entry_path(self, key:str)->str:
+        return os.path.join(self.root, quote(key, safe=""))
+
+    def _lock_path(self, name:str)->str:
+        return os.path.join(self.root, self._lock_dir, name+".lock")
+
+    def _open_lock(self, name:str):
+        os.makedirs(os.path.join(self.root, self._lock_dir), exist_ok=True)
+        return open(self._lock_path(name), "a+")
+
+    @contextmanager
+    def use(self, key:str):
+        """pin an entry so it cannot be evicted while in use, and mark it as recently used"""
+        path = self.entry_path(key)
+        name = os.path.basename(path)
+        with self._lock:
+            self._pins[name] = self._pins.get(name, 0)+1
+        fp = self._open_lock(name)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fp, fcntl.LOCK_SH)
+            self.touch(key)
+            yield path
+        finally:
+            fp.close()
+            with self._lock:
+                self._pins[name] -= 1
+                if self._pins[name]==0:
+                    del self._pins[name]
+
+    @contextmanager
+    def filling(self, key:str):
+        """exclusive lock held while an entry is written, so that a single process on the host fills it"""
+        fp = self._open_lock(os.path.basename(self.entry_path(key))+".fill")
+        try:
+            if fcntl is not None:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+            yield
+        finally:
+            fp.close()
+
+    def touch(self, key:str)->None:
+        path = self.entry_path(key)
+        try:
+            # only the mtime records the use, the atime is left as it is
+            os.utime(path, ns=(os.stat(path).st_atime_ns, time.time_ns()))
+        except OSError:
+            pass
+
+    def entries(self)->list:
+        """(name, last use, size) of all entries"""
+        if not os.path.isdir(self.root):
+            return []
+        ret = []
+        for name in os.listdir(self.root):
+            if name.startswith("."):
+                # lock files, or e.g. the footer cache kept next to the entries
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            ret.append((name, st.st_mtime, _size(path)))
+        return ret
+
+    def usage(self)->int:
+        return sum(e[2] for e in self.entries())
+
+    def _try_remove(self, name)->bool:
+        with self._lock:
+            if self._pins.get(name, 0)>0:
+                return False
+            with self._open_lock(name) as fp:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(fp, fcntl.LOCK_EX|fcntl.LOCK_NB)
+                    except OSError:
+                        # in use by another process
+                        return False
+                path = os.path.join(self.root, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+        # lock files are kept, removing one could let another process lock a stale inode
+        return True
+
+    def evict(self, reserve:int=0, budget:int=None)->int:
+        """remove least recently used entries until reserve more bytes fit in the budget.
+        Returns:
+            int: number of bytes freed
+        """
+        budget = self.budget if budget is None else budget
+        if budget is None:
+            return 0
+        freed = 0
+        with self._open_lock(".evict") as fp:
+            if fcntl is not None:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+            entries = sorted(self.entries(), key=lambda e: e[1])
+            usage = sum(e[2] for e in entries)
+            for name, _, size in entries:
+                if usage+reserve<=budget:
+                    break
+                if self._try_remove(name):
+                    usage -= size
+                    freed += size
+        return freed
+
+    def clear(self)->int:
+        """remove all entries that are not in use"""
+        return self.evict(budget=0)
+
+def digest(s:str, n:int=16)->str:
+    return hashlib.sha1(s.encode()).hexdigest()[:n]
+
+def file_version(path:str)->str:
+    """version of a file for want of a better one, e.g. a blob id"""
+    st = os.stat(path)
+    return f"{st.st_size}-{st.st_mtime_ns}"
+
+class VersionedCache(object):
+    """
+    files derived from source files, e.g. decoded or copied partitions, in a DiskCache with one entry per
+    source path. An entry holds the file of a single version of its source: the file of a new version
+    replaces the stale one. A file is written once, by a single process of the host, and pinned while in
+    use. Subclasses implement _name and _write.
+    """
+    def __init__(self, root:str, budget:int=None):
+        self.root = root
+        self.budget = budget
+        self.disk = DiskCache(root, budget)
+        self._locks = defaultdict(threading.Lock)
+
+    def __reduce__(self):
+        # rebuilt from its settings in worker processes
+        return (type(self), (self.root, self.budget))
+
+    def _key(self, path:str)->str:
+        path = os.path.abspath(path)
+        return f"{digest(path)}-{os.path.basename(path)}"
+
+    def _name(self, path:str, version:str)->str:
+        """file name of a version of the source"""
+        raise NotImplementedError
+
+    def _write(self, path:str, dest:str)->None:
+        """write the file derived from the source at path to dest, atomically"""
+        raise NotImplementedError
+
+    def _reserve(self, path:str)->int:
+        # bytes made room for before writing, the budget is enforced again once written
+        return 0
+
+    def _fill(self, path:str, key:str, entry:str, version)->str:
+        name = self._name(path, str(version) if version is not None else file_version(path))
+        dest = os.path.join(entry, name)
+        if os.path.exists(dest):
+            return dest
+        with self._locks[key], self.disk.filling(key):
+            # another process may have written it meanwhile
+            if os.path.exists(dest):
+                return dest
+            os.makedirs(entry, exist_ok=True)
+            for f in os.listdir(entry):
+                if f!=name:
+                    # derived from an older version, or left by an interrupted write
+                    os.remove(os.path.join(entry, f))
+            self.disk.evict(reserve=self._reserve(path))
+            self._write(path, dest)
+        self.disk.touch(key)
+        self.disk.evict()
+        return dest
+
+    @contextmanager
+    def use(self, path:str, version=None):
+        """the file derived from a source, written on first use and pinned against eviction while in use"""
+        key = self._key(path)
+        with self.disk.use(key) as entry:
+            yield self._fill(path, key, entry, version)
+
+    def path(self, path:str, version=None)->str:
+        """the file derived from a source, which may be evicted once returned"""
+        with self.use(path, version) as dest:
+            return dest
+
+    def clear(self)->int:
+        return self.disk.clear()
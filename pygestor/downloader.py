@@ -0,0 +1,171 @@
+"""
+This script contains a resumable HTTP downloader using range requests
+rlsn 2024
+"""
+import os
+import json
+import shutil
+import threading
+import urllib.request
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+class RangeNotSupported(Exception):
+    pass
+
+class _RedirectHandler(urllib.request.HTTPRedirectHandler):
+    """follows redirects with the same headers, except credentials, which are not sent to another host e.g. a storage host"""
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        new = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if new is not None and urlparse(newurl).netloc!=urlparse(req.full_url).netloc:
+            new.remove_header("Authorization")
+        return new
+
+_opener = urllib.request.build_opener(_RedirectHandler)
+
+def _request(url, headers, start=None, end=None, method="GET", timeout=60):
+    headers = dict(headers or {})
+    if start is not None:
+        headers["Range"] = f"bytes={start}-{end-1}"
+    return _opener.open(urllib.request.Request(url, headers=headers, method=method), timeout=timeout)
+
+def probe(url:str, headers:dict=None, timeout:int=60)->int:
+    """size of the remote file, or None if the server does not tell"""
+    with _request(url, headers, method="HEAD", timeout=timeout) as r:
+        size = r.headers.get("Content-Length")
+    return int(size) if size is not None else None
+
+def _split(size, n_segments, min_segment_size):
+    n = max(1, min(n_segments, size//max(1, min_segment_size)))
+    bounds = [size*i//n for i in range(n+1)]
+    return [[bounds[i], bounds[i+1], 0] for i in range(n)]
+
+class _Progress(object):
+    """download state of a temporary file, persisted next to it so an interrupted download can resume"""
+    def __init__(self, path, size, etag, segments):
+        self.path = path
+        self.size = size
+        self.etag = etag
+        self.segments = segments
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, size, etag):
+        try:
+            with open(path, "r") as fp:
+                state = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if state["size"]!=size or state["etag"]!=etag:
+            # the remote file has changed since
+            return None
+        return cls(path, size, etag, state["segments"])
+
+    def save(self):
+        with self._lock:
+            state = dict(size=self.size, etag=self.etag, segments=self.segments)
+            with open(self.path+".tmp", "w") as fp:
+                json.dump(state, fp)
+            os.replace(self.path+".tmp", self.path)
+
+    def advance(self, segment, n):
+        with self._lock:
+            segment[2] += n
+
+    @property
+    def done(self):
+        return sum(s[2] for s in self.segments)
+
+def _fetch_segment(url, headers, tmp_path, segment, progress, chunk_size, save_every, timeout):
+    start, end, done = segment
+    if start+done>=end:
+        return
+    with _request(url, headers, start+done, end, timeout=timeout) as r, open(tmp_path, "r+b") as fp:
+        if r.status!=206:
+            raise RangeNotSupported(url)
+        fp.seek(start+done)
+        unsaved = 0
+        while True:
+            buf = r.read(min(chunk_size, end-start-segment[2]))
+            if not buf:
+                break
+            fp.write(buf)
+            progress.advance(segment, len(buf))
+            unsaved += len(buf)
+            if unsaved>=save_every:
+                # only bytes already handed to the file are recorded as done
+                fp.flush()
+                progress.save()
+                unsaved = 0
+    if segment[2]<end-start:
+        raise IOError(f"connection closed after {start+segment[2]} of {end} bytes")
+
+def _fetch_whole(url, headers, tmp_path, timeout):
+    with _request(url, headers, timeout=timeout) as r, open(tmp_path, "wb") as fp:
+        shutil.copyfileobj(r, fp)
+
+def download_file(url:str, dest:str, headers:dict=None, size:int=None, etag:str=None, n_segments:int=1,
+                  min_segment_size:int=64*2**20, chunk_size:int=2**20, save_every:int=16*2**20, timeout:int=60)->str:
+    """download url to dest through a temporary file next to it, which is renamed to dest once complete.
+    Args:
+        url (str): remote file
+        dest (str): final local path
+        headers (dict, optional): extra request headers, e.g. authorization. Defaults to None.
+        size (int, optional): size of the remote file, probed with a HEAD request if not given. Defaults to None.
+        etag (str, optional): version of the remote file, partial data of other versions is discarded. Defaults to None.
+        n_segments (int, optional): max number of byte ranges fetched in parallel. Defaults to 1.
+        min_segment_size (int, optional): files are not split into ranges smaller than this. Defaults to 64MiB.
+
+    Returns:
+        str: dest
+    """
+    tmp_path = dest+".incomplete"
+    state_path = tmp_path+".json"
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+    if size is None:
+        size = probe(url, headers, timeout)
+
+    if size is None:
+        # without a known size there is nothing to resume from
+        _fetch_whole(url, headers, tmp_path, timeout)
+        os.replace(tmp_path, dest)
+        return dest
+
+    progress = _Progress.load(state_path, size, etag) if os.path.exists(tmp_path) else None
+    if progress is None:
+        progress = _Progress(state_path, size, etag, _split(size, n_segments, min_segment_size))
+        with open(tmp_path, "wb") as fp:
+            fp.truncate(size)
+        progress.save()
+    elif progress.done>0:
+        print(f"[INFO] resuming {os.path.basename(dest)} from {progress.done}/{size} bytes")
+
+    pending = [s for s in progress.segments if s[0]+s[2]<s[1]]
+    try:
+        if len(pending)>0:
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                futures = [executor.submit(_fetch_segment, url, headers, tmp_path, s, progress, chunk_size, save_every, timeout)
+                           for s in pending]
+                for future in futures:
+                    future.result()
+    except RangeNotSupported:
+        print(f"[WARNING] {url} does not support range requests, downloading as a whole.")
+        _fetch_whole(url, headers, tmp_path, timeout)
+    except HTTPError as e:
+        if e.code!=416:
+            progress.save()
+            raise
+        # the partial data does not match the remote file anymore
+        os.remove(tmp_path)
+        os.remove(state_path)
+        raise
+    except BaseException:
+        progress.save()
+        raise
+
+    if os.path.getsize(tmp_path)!=size:
+        raise IOError(f"downloaded {os.path.getsize(tmp_path)} bytes of {url}, expected {size}.")
+    os.replace(tmp_path, dest)
+    os.remove(state_path)
+    return dest
@@ -0,0 +1,160 @@
+"""
+This script contains a persistent cache of parquet footers, i.e. schema, row counts,
+row group layout and column statistics of downloaded partitions
+rlsn 2024
+"""
+import os
+import json
+import sqlite3
+import threading
+import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .utils import AttrDict
+
+def _stat_value(v):
+    # only values that survive a json round trip are kept
+    if isinstance(v, (bool, int, float, str)):
+        return v
+    if isinstance(v, (datetime.date, datetime.datetime)):
+        return v.isoformat()
+    return None
+
+def _column_stats(column):
+    stats = column.statistics
+    if stats is None:
+        return dict(min=None, max=None, null_count=None)
+    has_min_max = stats.has_min_max
+    return dict(
+        min=_stat_value(stats.min) if has_min_max else None,
+        max=_stat_value(stats.max) if has_min_max else None,
+        null_count=stats.null_count if stats.has_null_count else None,
+        )
+
+def parse_footer(path:str)->AttrDict:
+    """read the footer of a parquet file"""
+    meta = pq.ParquetFile(path).metadata
+    row_groups = []
+    offset = 0
+    for i in range(meta.num_row_groups):
+        rg = meta.row_group(i)
+        columns = dict()
+        for j in range(rg.num_columns):
+            column = rg.column(j)
+            columns[column.path_in_schema] = _column_stats(column)
+        row_groups.append(AttrDict(
+            num_rows=rg.num_rows,
+            row_offset=offset,
+            total_byte_size=rg.total_byte_size,
+            columns=columns,
+            ))
+        offset += rg.num_rows
+    return AttrDict(
+        schema=meta.schema.to_arrow_schema(),
+        num_rows=meta.num_rows,
+        row_groups=row_groups,
+        )
+
+class FooterCache(object):
+    """
+    footers keyed by (path, size, mtime), kept in memory and in an sqlite file shared by
+    all processes, so a file's footer is read once until the file changes. The file holds at
+    most max_stored footers, those of removed or changed files and then the least recently
+    written ones are pruned every prune_every writes.
+    """
+    def __init__(self, path:str, max_entries:int=4096, max_stored:int=100000, prune_every:int=256):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_stored = max_stored
+        self.prune_every = prune_every
+        self._n_writes = 0
+        self._memory = OrderedDict()
+        self._conn = None
+        self._lock = threading.RLock()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS footers (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, schema BLOB, info TEXT)")
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, key, footer):
+        self._memory[key] = footer
+        self._memory.move_to_end(key)
+        while len(self._memory)>self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, path:str)->AttrDict:
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            row = self.conn.execute("SELECT size, mtime, schema, info FROM footers WHERE path=?", (path,)).fetchone()
+
+        if row is not None and tuple(row[:2])==key[1:]:
+            info = json.loads(row[3])
+            footer = AttrDict(
+                schema=pa.ipc.read_schema(pa.py_buffer(row[2])),
+                num_rows=info["num_rows"],
+                row_groups=[AttrDict(rg) for rg in info["row_groups"]],
+                )
+        else:
+            footer = parse_footer(path)
+            info = dict(num_rows=footer.num_rows, row_groups=footer.row_groups)
+            with self._lock, self.conn as conn:
+                conn.execute("INSERT OR REPLACE INTO footers VALUES (?, ?, ?, ?, ?)",
+                             (path, *key[1:], footer.schema.serialize().to_pybytes(), json.dumps(info)))
+                self._n_writes += 1
+                prune = self._n_writes%self.prune_every==0
+            if prune:
+                self.prune()
+        with self._lock:
+            self._remember(key, footer)
+        return footer
+
+    def prune(self)->int:
+        """remove the footers of files that are gone or changed, then the oldest ones beyond max_stored.
+        Returns:
+            int: number of footers removed
+        """
+        with self._lock:
+            rows = self.conn.execute("SELECT path, size, mtime FROM footers").fetchall()
+        stale = []
+        for path, size, mtime in rows:
+            try:
+                st = os.stat(path)
+                if (st.st_size, st.st_mtime)!=(size, mtime):
+                    stale.append(path)
+            except OSError:
+                stale.append(path)
+        with self._lock, self.conn as conn:
+            conn.executemany("DELETE FROM footers WHERE path=?", [(path,) for path in stale])
+            # rows are re-inserted when rewritten, so the lowest rowids are the least recently written
+            cur = conn.execute("DELETE FROM footers WHERE rowid NOT IN (SELECT rowid FROM footers ORDER BY rowid DESC LIMIT ?)",
+                               (self.max_stored,))
+        return len(stale)+max(0, cur.rowcount)
+
+    def warm(self, paths:list, max_workers:int=8)->None:
+        """read the footers of many files in parallel"""
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            list(executor.map(self.get, paths))
+
+_footer_cache = None
+
+def get_footer_cache()->FooterCache:
+    global _footer_cache
+    if _footer_cache is None:
+        from .__init__ import FOOTER_CACHE_PATH, FOOTER_CACHE_MAX_ENTRIES
+        _footer_cache = FooterCache(FOOTER_CACHE_PATH, max_stored=FOOTER_CACHE_MAX_ENTRIES)
+    return _footer_cache
+
+def read_footer(path:str)->AttrDict:
+    return get_footer_cache().get(path)
@@ -0,0 +1,27 @@
+"""
+This script contains a read-through tier of partitions copied from the data directory, typically
+a shared NFS mount, onto a node-local disk
+rlsn 2024
+"""
+import os
+import uuid
+import shutil
+from .disk_cache import VersionedCache, digest
+
+class LocalTier(VersionedCache):
+    """
+    local copies of partitions within a byte budget with LRU eviction (see VersionedCache), shared by all
+    processes of the node. A partition is copied once on its first read, by a single process, and later
+    reads are served from the copy. Copies are identified by the partition path and a version, e.g. its
+    blob_id or acquisition_time, so the copy of a re-downloaded partition is stale and replaced.
+    """
+    def _name(self, path:str, version:str)->str:
+        return f"{digest(version)}-{os.path.basename(path)}"
+
+    def _reserve(self, path:str)->int:
+        return os.path.getsize(path)
+
+    def _write(self, path:str, dest:str)->None:
+        tmp = os.path.join(os.path.dirname(dest), f".{uuid.uuid4().hex}.tmp")
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, dest)
@@ -0,0 +1,461 @@
+"""
+This script contains the storage backends of the metadata
+rlsn 2024
+"""
+import os
+import glob
+import json
+import shutil
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+from collections.abc import MutableMapping
+
+# container keys of each level in the metadata tree: root -> dataset -> subset -> partition
+_children = ["datasets", "subsets", "partitions"]
+
+def node_fields(node:dict)->dict:
+    """shallow copy of a metadata node without its child container"""
+    return {k:v for k,v in node.items() if k not in _children}
+
+def resolve(metadata:dict, path:tuple)->dict:
+    """return the node at path, or None if it does not exist"""
+    node = metadata
+    for key, child in zip(path, _children):
+        node = node[child].get(key) if child in node else None
+        if node is None:
+            return None
+    return node
+
+def apply_delta(metadata:dict, record:dict)->None:
+    """apply a journal record to the metadata tree in place"""
+    path = record["path"]
+    parent = resolve(metadata, path[:-1])
+    container = parent[_children[len(path)-1]]
+    key = path[-1]
+    if "fields" in record:
+        node = container.get(key, dict())
+        child = _children[len(path)] if len(path)<len(_children) else None
+        container[key] = dict(record["fields"])
+        if child is not None:
+            container[key][child] = node.get(child, dict())
+    elif record["node"] is None:
+        container.pop(key, None)
+    else:
+        container[key] = record["node"]
+
+class MetaStore(object):
+    """
+    Base class of metadata backends. A backend loads the full metadata tree as a dict
+    and persists changes made to it. `commit` receives a path (dataset, subset, partition)
+    pointing at the node that changed: the subtree at path is replaced (or deleted if it
+    no longer exists) and the fields of its ancestors are upserted.
+    An empty path commits the whole tree.
+    """
+    _backends = {}
+
+    @classmethod
+    def get(cls, backend:str):
+        if backend in cls._backends:
+            return cls._backends[backend]
+        else:
+            raise Exception(f"[ERROR] metadata backend '{backend}' not found.")
+
+    @classmethod
+    def register(cls, backend:str):
+        def inner_wrapper(wrapped_class):
+            cls._backends[backend] = wrapped_class
+            return wrapped_class
+        return inner_wrapper
+
+    def __init__(self, path:str):
+        self.path = path
+
+    def exists(self)->bool:
+        return os.path.exists(self.path)
+
+    def backup(self)->None:
+        if self.exists():
+            shutil.copyfile(self.path, self.path+'.bak')
+
+    def load(self)->dict:
+        raise NotImplementedError
+
+    def commit(self, metadata:dict, path:tuple=())->None:
+        raise NotImplementedError
+
+    def close(self)->None:
+        pass
+
+@MetaStore.register("json")
+class JsonMetaStore(MetaStore):
+    """the whole tree in a single json file, rewritten on every commit"""
+    def load(self)->dict:
+        with open(self.path, "r") as fp:
+            return json.load(fp)
+
+    def commit(self, metadata:dict, path:tuple=())->None:
+        tmp_path = self.path+".tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(metadata, fp, ensure_ascii=True, indent=4)
+        os.replace(tmp_path, self.path)
+
+@MetaStore.register("sqlite")
+class SqliteMetaStore(MetaStore):
+    """
+    an embedded sqlite database with one table per level, each row holding the json encoded
+    fields of a node. Committing a partition costs a constant number of row upserts.
+    """
+    _schema = [
+        "CREATE TABLE IF NOT EXISTS root (key TEXT PRIMARY KEY, value TEXT)",
+        "CREATE TABLE IF NOT EXISTS datasets (name TEXT PRIMARY KEY, info TEXT)",
+        "CREATE TABLE IF NOT EXISTS subsets (dataset TEXT, name TEXT, info TEXT, PRIMARY KEY (dataset, name))",
+        "CREATE TABLE IF NOT EXISTS partitions (dataset TEXT, subset TEXT, name TEXT, info TEXT, PRIMARY KEY (dataset, subset, name))",
+    ]
+
+    def __init__(self, path:str):
+        super().__init__(path)
+        self._conn = None
+        self._lock = threading.RLock()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            for stmt in self._schema:
+                self._conn.execute(stmt)
+            self._conn.commit()
+        return self._conn
+
+    def load(self)->dict:
+        if not self.exists():
+            raise FileNotFoundError(self.path)
+        with self._lock:
+            conn = self.conn
+            metadata = {k:json.loads(v) for k,v in conn.execute("SELECT key, value FROM root")}
+            datasets = metadata["datasets"] = dict()
+            for name, info in conn.execute("SELECT name, info FROM datasets"):
+                datasets[name] = dict(json.loads(info), subsets=dict())
+            for ds, name, info in conn.execute("SELECT dataset, name, info FROM subsets"):
+                datasets[ds]["subsets"][name] = dict(json.loads(info), partitions=dict())
+            for ds, subs, name, info in conn.execute("SELECT dataset, subset, name, info FROM partitions"):
+                datasets[ds]["subsets"][subs]["partitions"][name] = json.loads(info)
+        return metadata
+
+    def _write_root(self, conn, metadata):
+        conn.executemany("INSERT OR REPLACE INTO root VALUES (?, ?)",
+                         [(k, json.dumps(v)) for k,v in node_fields(metadata).items()])
+
+    def _write_node(self, conn, path, node):
+        table = _children[len(path)-1]
+        keys = ", ".join("?"*(len(path)+1))
+        conn.execute(f"INSERT OR REPLACE INTO {table} VALUES ({keys})", (*path, json.dumps(node_fields(node))))
+
+    def _delete_subtree(self, conn, path):
+        # the leading key columns of a node are shared by the rows of all its descendants
+        columns = [["name"], ["dataset", "name"], ["dataset", "subset", "name"]]
+        for depth in range(len(path), len(_children)+1):
+            cond = " AND ".join(f"{c}=?" for c in columns[depth-1][:len(path)])
+            conn.execute(f"DELETE FROM {_children[depth-1]} WHERE {cond}", path)
+
+    def _write_subtree(self, conn, path, node):
+        self._write_node(conn, path, node)
+        if len(path)<len(_children):
+            for key, child in node[_children[len(path)]].items():
+                self._write_subtree(conn, (*path, key), child)
+
+    def commit(self, metadata:dict, path:tuple=())->None:
+        path = tuple(path)
+        with self._lock, self.conn as conn:
+            self._write_root(conn, metadata)
+            if len(path)==0:
+                for table in _children:
+                    conn.execute(f"DELETE FROM {table}")
+                for name, ds in metadata["datasets"].items():
+                    self._write_subtree(conn, (name,), ds)
+                return
+            # upsert ancestors
+            for depth in range(1, len(path)):
+                node = resolve(metadata, path[:depth])
+                if node is None:
+                    raise KeyError(path[:depth])
+                self._write_node(conn, path[:depth], node)
+            # replace the subtree
+            self._delete_subtree(conn, path)
+            node = resolve(metadata, path)
+            if node is not None:
+                self._write_subtree(conn, path, node)
+
+    def close(self)->None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+@MetaStore.register("journal")
+class JournalMetaStore(JsonMetaStore):
+    """
+    a json snapshot plus an append-only journal of delta records. Every commit appends the
+    changed entry and its ancestors' fields to the journal, loading replays the journal over
+    the snapshot. Once the journal grows past `limit` bytes it is sealed and folded into a
+    new snapshot by a background thread.
+    """
+    def __init__(self, path:str, limit:int=None):
+        super().__init__(path)
+        if limit is None:
+            from .__init__ import META_JOURNAL_LIMIT
+            limit = META_JOURNAL_LIMIT
+        self.limit = limit
+        self.journal_path = path+".journal"
+        self._lock = threading.RLock()
+        self._compactor = None
+
+    def _sealed_journals(self)->list:
+        sealed = glob.glob(glob.escape(self.journal_path)+".*")
+        return sorted(sealed, key=lambda x: int(x.rsplit(".", 1)[-1]))
+
+    @staticmethod
+    def _replay(metadata:dict, journal:str)->int:
+        n = 0
+        with open(journal, "r") as fp:
+            for i, line in enumerate(fp):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # a torn write from a crash, the records after it were appended on a new line
+                    print(f"[WARNING] skipped an incomplete record at line {i+1} of {journal}.")
+                    continue
+                apply_delta(metadata, record)
+                n += 1
+        return n
+
+    def load(self)->dict:
+        with self._lock:
+            while True:
+                sealed = self._sealed_journals()
+                metadata = super().load()
+                # retry if a compaction has folded the sealed journals in the meantime
+                if all(os.path.exists(journal) for journal in sealed):
+                    break
+            for journal in sealed+[self.journal_path]:
+                if os.path.exists(journal):
+                    self._replay(metadata, journal)
+        return metadata
+
+    def _append(self, records:list):
+        with open(self.journal_path, "a+b") as fp:
+            data = "".join(json.dumps(r, ensure_ascii=True)+"\n" for r in records).encode()
+            if fp.tell()>0:
+                fp.seek(-1, os.SEEK_END)
+                if fp.read(1)!=b"\n":
+                    # terminate a torn record so that it does not swallow the new ones
+                    data = b"\n"+data
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def commit(self, metadata:dict, path:tuple=())->None:
+        path = tuple(path)
+        with self._lock:
+            if len(path)==0 or not self.exists():
+                # a full commit is a fresh snapshot that supersedes all journals
+                self.wait()
+                super().commit(metadata)
+                for journal in self._sealed_journals()+[self.journal_path]:
+                    if os.path.exists(journal):
+                        os.remove(journal)
+                return
+
+            records = []
+            for depth in range(1, len(path)):
+                node = resolve(metadata, path[:depth])
+                if node is None:
+                    raise KeyError(path[:depth])
+                records.append(dict(path=path[:depth], fields=node_fields(node)))
+            records.append(dict(path=path, node=resolve(metadata, path)))
+            self._append(records)
+
+            if os.path.getsize(self.journal_path)>self.limit and self._compactor is None:
+                # seal the current journal, new records go to a fresh one
+                sealed = f"{self.journal_path}.{time.time_ns()}"
+                os.replace(self.journal_path, sealed)
+                self._compactor = threading.Thread(target=self.compact, daemon=True)
+                self._compactor.start()
+
+    def compact(self)->None:
+        """fold the sealed journals into a new snapshot"""
+        try:
+            sealed = self._sealed_journals()
+            metadata = JsonMetaStore.load(self)
+            n = sum(self._replay(metadata, journal) for journal in sealed)
+            JsonMetaStore.commit(self, metadata)
+            # replaying a sealed journal over the new snapshot is idempotent,
+            # so a crash before this point loses nothing
+            for journal in sealed:
+                os.remove(journal)
+            print(f"[INFO] compacted {n} metadata journal records.")
+        finally:
+            self._compactor = None
+
+    def wait(self)->None:
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def close(self)->None:
+        self.wait()
+
+class LazyDatasets(MutableMapping):
+    """
+    the "datasets" mapping of a sharded metadata tree. Dataset entries are parsed from their
+    shard on first access, while the fields without subsets are served from the index.
+    """
+    def __init__(self, index:dict, loader):
+        self._index = index
+        self._loader = loader
+        self._loaded = dict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            if name not in self._index:
+                raise KeyError(name)
+            with self._lock:
+                if name not in self._loaded:
+                    self._loaded[name] = self._loader(name)
+        return self._loaded[name]
+
+    def __setitem__(self, name, info):
+        self._loaded[name] = info
+        self._index[name] = node_fields(info)
+
+    def __delitem__(self, name):
+        del self._index[name]
+        self._loaded.pop(name, None)
+
+    def __iter__(self):
+        return iter(list(self._index))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def summary(self, name)->dict:
+        if name in self._loaded:
+            return node_fields(self._loaded[name])
+        return self._index[name]
+
+    def loaded(self)->dict:
+        return dict(self._loaded)
+
+@MetaStore.register("sharded")
+class ShardedMetaStore(MetaStore):
+    """
+    one directory per dataset under the directory at `path`, holding the dataset's fields and one
+    json shard per subset, plus an index.json holding the root fields and each dataset's fields
+    without subsets. Datasets are parsed on first access, and a partition commit only rewrites
+    the shard of its subset, the dataset's fields and the index.
+    """
+    def __init__(self, path:str):
+        super().__init__(path)
+        self.index_path = os.path.join(path, "index.json")
+        self._lock = threading.RLock()
+
+    def shard_path(self, name:str, subset:str=None)->str:
+        path = os.path.join(self.path, "datasets", quote(name, safe=""))
+        if subset is None:
+            return path
+        return os.path.join(path, "subsets", quote(subset, safe="")+".json")
+
+    def exists(self)->bool:
+        return os.path.exists(self.index_path)
+
+    def backup(self)->None:
+        if self.exists():
+            shutil.copyfile(self.index_path, self.index_path+'.bak')
+
+    def _read_shard(self, name:str)->dict:
+        path = self.shard_path(name)
+        if os.path.exists(path+".json"):
+            # a whole dataset in a single shard, as written by earlier versions
+            with open(path+".json", "r") as fp:
+                return json.load(fp)
+        with open(os.path.join(path, "dataset.json"), "r") as fp:
+            dataset = json.load(fp)
+        dataset["subsets"] = dict()
+        for subset in dataset.pop("subset_names"):
+            with open(self.shard_path(name, subset), "r") as fp:
+                dataset["subsets"][subset] = json.load(fp)
+        return dataset
+
+    @staticmethod
+    def _dump(obj, path):
+        tmp_path = path+".tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(obj, fp, ensure_ascii=True, indent=4)
+        os.replace(tmp_path, path)
+
+    def _write_dataset(self, name:str, dataset:dict, subsets:list=None):
+        """write the dataset's fields and the shards of the given subsets, by default all of them"""
+        path = self.shard_path(name)
+        if os.path.exists(path+".json"):
+            # migrated to the per-subset layout on its first write
+            subsets = None
+        os.makedirs(os.path.join(path, "subsets"), exist_ok=True)
+        for subset in (dataset["subsets"] if subsets is None else subsets):
+            self._dump(dataset["subsets"][subset], self.shard_path(name, subset))
+        if subsets is None:
+            shards = {self.shard_path(name, subset) for subset in dataset["subsets"]}
+            for shard in glob.glob(os.path.join(glob.escape(path), "subsets", "*.json")):
+                if shard not in shards:
+                    os.remove(shard)
+        self._dump(dict(node_fields(dataset), subset_names=list(dataset["subsets"])), os.path.join(path, "dataset.json"))
+        if os.path.exists(path+".json"):
+            os.remove(path+".json")
+
+    def _remove_dataset(self, name:str):
+        path = self.shard_path(name)
+        shutil.rmtree(path, ignore_errors=True)
+        if os.path.exists(path+".json"):
+            os.remove(path+".json")
+
+    def load(self)->dict:
+        with open(self.index_path, "r") as fp:
+            metadata = json.load(fp)
+        metadata["datasets"] = LazyDatasets(metadata["datasets"], self._read_shard)
+        return metadata
+
+    def commit(self, metadata:dict, path:tuple=())->None:
+        datasets = metadata["datasets"]
+        with self._lock:
+            os.makedirs(os.path.join(self.path, "datasets"), exist_ok=True)
+            if len(path)==0:
+                # only datasets that have been loaded can have changed
+                changed = datasets.loaded() if isinstance(datasets, LazyDatasets) else datasets
+                for name in list(changed):
+                    self._write_dataset(name, datasets[name])
+                shards = {self.shard_path(name) for name in datasets}
+                for shard in glob.glob(os.path.join(glob.escape(self.path), "datasets", "*")):
+                    if shard.rsplit(".json", 1)[0] not in shards:
+                        shutil.rmtree(shard) if os.path.isdir(shard) else os.remove(shard)
+            elif path[0] not in datasets:
+                self._remove_dataset(path[0])
+            elif len(path)==1 or path[1] not in datasets[path[0]]["subsets"]:
+                self._write_dataset(path[0], datasets[path[0]])
+            else:
+                self._write_dataset(path[0], datasets[path[0]], [path[1]])
+
+            index = node_fields(metadata)
+            index["datasets"] = {name:(datasets.summary(name) if isinstance(datasets, LazyDatasets) 
+                                       else node_fields(datasets[name])) for name in datasets}
+            self._dump(index, self.index_path)
+
+def migrate(src:MetaStore, dst:MetaStore)->dict:
+    """copy the full metadata tree from one backend to another"""
+    metadata = src.load()
+    metadata["datasets"] = dict(metadata["datasets"].items())
+    dst.commit(metadata)
+    return metadata
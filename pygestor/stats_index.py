@@ -0,0 +1,116 @@
+"""
+This script contains the column statistics index of partitions, i.e. per-partition and per-row-group
+min, max and null count of selected columns kept in the metadata, used to prune partitions by filter
+rlsn 2024
+"""
+import base64
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as pds
+from pyarrow.fs import LocalFileSystem
+from .footer_cache import read_footer
+from .utils import to_filter_expression
+
+def _merge(stats:list)->dict:
+    # a bound is unknown as soon as it is unknown in one row group
+    mins, maxs, nulls = [s["min"] for s in stats], [s["max"] for s in stats], [s["null_count"] for s in stats]
+    # row groups holding only nulls do not bound the values
+    known = [i for i, s in enumerate(stats) if s["null_count"]!=s["num_rows"]]
+    return dict(
+        min=min(mins[i] for i in known) if len(known)>0 and all(mins[i] is not None for i in known) else None,
+        max=max(maxs[i] for i in known) if len(known)>0 and all(maxs[i] is not None for i in known) else None,
+        null_count=sum(nulls) if all(n is not None for n in nulls) else None,
+        num_rows=sum(s["num_rows"] for s in stats),
+        )
+
+def partition_stats(path:str, columns:list="*")->dict:
+    """
+    statistics of a parquet file's columns, from its cached footer.
+    Returns:
+        dict: {"columns": {column: stats}, "row_groups": [{column: stats}, ...]}, stats being
+            {"min", "max", "null_count", "num_rows"} with None for what the file does not record
+    """
+    footer = read_footer(path)
+    names = footer.schema.names if columns=="*" else [c for c in columns if c in footer.schema.names]
+    row_groups = []
+    for rg in footer.row_groups:
+        # only top-level columns, nested ones have no single min and max
+        row_groups.append({c:dict(rg.columns[c], num_rows=rg.num_rows) for c in names if c in rg.columns})
+    return dict(
+        columns={c:_merge([rg[c] for rg in row_groups]) for c in names if all(c in rg for rg in row_groups)},
+        row_groups=row_groups,
+        )
+
+def encode_schema(schema)->str:
+    """an arrow schema serialized and base64 encoded, to be stored in json"""
+    return base64.b64encode(schema.remove_metadata().serialize().to_pybytes()).decode()
+
+def decode_schema(s:str):
+    return pa.ipc.read_schema(pa.py_buffer(base64.b64decode(s)))
+
+def _literal(value, type):
+    try:
+        return pa.scalar(value).cast(type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+        return None
+
+def stats_expression(schema, stats:dict):
+    """an expression true for all rows described by the stats of a partition or row group, None if nothing is known"""
+    terms = []
+    for name, s in stats.items():
+        if name not in schema.names:
+            continue
+        field, type = pc.field(name), schema.field(name).type
+        if s["null_count"] is not None and s["null_count"]==s["num_rows"]:
+            terms.append(field.is_null())
+            continue
+        lo, hi = _literal(s["min"], type), _literal(s["max"], type)
+        if lo is None or hi is None:
+            continue
+        term = (field>=lo)&(field<=hi)
+        # with nulls, the bounds only hold for the valid rows
+        terms.append(term&field.is_valid() if s["null_count"]==0 else term|field.is_null())
+    if len(terms)==0:
+        return None
+    expr = terms[0]
+    for term in terms[1:]:
+        expr = expr&term
+    return expr
+
+def prune(stats:list, filter, schema, row_groups:bool=False):
+    """
+    the files whose stats do not rule out rows matching the filter, without reading them. Files without
+    stats, e.g. captured before the index or not downloaded, are always kept, and so are files whose
+    filtered columns have nulls, as their bounds do not hold for every row.
+    Args:
+        stats (list): partition_stats of each file, or None
+        filter: pyarrow expression or DNF filters
+        schema: arrow schema of the files
+        row_groups (bool, optional): return the candidate row groups of each file. Defaults to False.
+    Returns:
+        list: indices of the candidate files, or with row_groups a dict of file index to candidate row group
+            indices, None meaning all of them
+    """
+    filter = to_filter_expression(filter)
+    if filter is None:
+        return {i:None for i in range(len(stats))} if row_groups else list(range(len(stats)))
+    fmt, fs = pds.ParquetFileFormat(), LocalFileSystem()
+    fragments = []
+    for i, s in enumerate(stats):
+        if s is None or not row_groups:
+            units = [("", s["columns"] if s is not None else dict())]
+        else:
+            units = list(enumerate(s["row_groups"]))
+        for j, unit_stats in units:
+            expr = stats_expression(schema, unit_stats)
+            # fragments are never opened, their paths only identify the file and row group
+            fragments.append(fmt.make_fragment(f"{i}/{j}", fs, partition_expression=expr if expr is not None else pc.scalar(True)))
+    candidates = dict()
+    for fragment in pds.FileSystemDataset(fragments, schema, fmt, fs).get_fragments(filter=filter):
+        i, j = fragment.path.split("/")
+        rgs = candidates.setdefault(int(i), [])
+        if j!="" and rgs is not None:
+            rgs.append(int(j))
+        elif j=="":
+            candidates[int(i)] = None
+    return candidates if row_groups else sorted(candidates)
@@ -0,0 +1,639 @@
+"""
+This script contains the batch streams behind core_api.stream_dataset and map-style subset views
+rlsn 2024
+"""
+import os
+import time
+import queue
+import threading
+import bisect
+from functools import partial
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as pds
+from pyarrow.fs import LocalFileSystem
+from pyarrow.dataset import dataset
+from .footer_cache import read_footer
+from .utils import AttrDict, unify_schema, to_filter_expression, convert_table
+
+_end = object()
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+def _done(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+def _put(q, stop, item)->bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _produce(iterable, transform, pool, q, stop):
+    try:
+        for item in iterable:
+            future = pool.submit(transform, item) if pool is not None else _done(item)
+            if not _put(q, stop, future):
+                return
+        _put(q, stop, _done(_end))
+    except BaseException as e:
+        _put(q, stop, _done(_Failure(e)))
+    finally:
+        # e.g. stops the read-ahead of a generator left halfway
+        if hasattr(iterable, "close"):
+            iterable.close()
+
+class Prefetcher(object):
+    """
+    iterates over an iterable in a background thread and keeps up to `prefetch` items ready in a
+    bounded queue. Items are optionally transformed by a pool of `num_threads` threads, in order.
+    `stats` counts how often and how long the consumer had to wait for an item.
+    """
+    def __init__(self, iterable, prefetch:int=4, transform=None, num_threads:int=1):
+        self.stats = AttrDict(n_items=0, n_waits=0, wait_time=0.)
+        self._queue = queue.Queue(maxsize=max(1, prefetch))
+        self._stop = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=num_threads) if transform is not None else None
+        # the thread does not refer to the prefetcher, so an abandoned one is collected and closed
+        self._thread = threading.Thread(target=_produce, args=(iterable, transform, self._pool, self._queue, self._stop), daemon=True)
+        self._thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._stop.is_set():
+            raise StopIteration
+        t = time.time()
+        future = self._queue.get()
+        waited = not future.done()
+        item = future.result()
+        if waited or time.time()-t>1e-3:
+            self.stats.n_waits += 1
+            self.stats.wait_time += time.time()-t
+        if item is _end:
+            self.close()
+            raise StopIteration
+        if isinstance(item, _Failure):
+            self.close()
+            raise item.error
+        self.stats.n_items += 1
+        return item
+
+    def close(self):
+        self._stop.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def __del__(self):
+        self.close()
+
+def shard_range(total:int, shard:int, n_shards:int)->tuple:
+    """the contiguous range of global sample indices [start, end) of a shard, shard sizes differ by at most one"""
+    return total*shard//n_shards, total*(shard+1)//n_shards
+
+def plan_units(filepaths:list, n_samples:list=None, shard:int=0, n_shards:int=1, shuffle:bool=False, seed:int=0, epoch:int=0)->list:
+    """
+    split the samples of a shard into read units (path, row group, first row, end row).
+    Files are laid end to end, in a random order with shuffle, and each shard takes an equal contiguous range
+    of samples, cutting row groups where needed, so every sample belongs to exactly one shard. The ranges are
+    computed from n_samples (e.g. from the metadata), so only the footers of the shard's own files are read.
+    With shuffle, the shard's units are permuted as well. Both orders are deterministic for a given (seed, epoch).
+    """
+    if n_samples is None:
+        n_samples = [None]*len(filepaths)
+    counts = [n if n else read_footer(path).num_rows for path, n in zip(filepaths, n_samples)]
+    order = np.arange(len(filepaths))
+    if shuffle:
+        order = np.random.default_rng([seed, epoch]).permutation(len(filepaths))
+    start, end = shard_range(sum(counts), shard, n_shards)
+
+    units = []
+    offset = 0
+    for f in order:
+        path, count = filepaths[f], counts[f]
+        lo, hi = max(start-offset, 0), min(end-offset, count)
+        offset += count
+        if lo>=hi:
+            continue
+        footer = read_footer(path)
+        if footer.num_rows!=count:
+            raise Exception(f"[ERROR] {path} has {footer.num_rows} samples but {count} are recorded in the metadata, please run version_check to refresh it.")
+        for i, rg in enumerate(footer.row_groups):
+            s, e = max(lo, rg.row_offset), min(hi, rg.row_offset+rg.num_rows)
+            if s<e:
+                units.append((path, i, s-rg.row_offset, e-rg.row_offset))
+    if shuffle:
+        rng = np.random.default_rng([seed, epoch, shard])
+        units = [units[i] for i in rng.permutation(len(units))]
+    return units
+
+def plan_windows(units:list, buffer_size:int)->list:
+    """group consecutive units into windows of at least buffer_size rows, the rows of a window are mixed together"""
+    windows, window, n_rows = [], [], 0
+    for unit in units:
+        window.append(unit)
+        n_rows += unit[3]-unit[2]
+        if n_rows>=buffer_size:
+            windows.append(window)
+            window, n_rows = [], 0
+    if len(window)>0:
+        windows.append(window)
+    return windows
+
+class _UnitReader(object):
+    """
+    reads read units, keeping the fragments of recently read files open. With a decoded cache, units are read
+    from the memory-mapped Arrow IPC file of their partition instead, with a local tier from the memory-mapped local
+    copy of their partition. versions maps paths to partition versions.
+    """
+    def __init__(self, schema, columns=None, filter=None, max_open:int=16, decoded_cache=None, versions:dict=None, local_tier=None):
+        self.schema = schema
+        self.columns = columns
+        self.filter = filter
+        self.max_open = max_open
+        self.decoded_cache = decoded_cache
+        self.versions = versions or dict()
+        self.local_tier = local_tier
+        self._format = pds.ParquetFileFormat()
+        self._fs = LocalFileSystem()
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _fragment(self, path):
+        with self._lock:
+            if path in self._fragments:
+                self._fragments.move_to_end(path)
+                return self._fragments[path]
+        if self.decoded_cache is not None:
+            fragment = self.decoded_cache.open(path, self.versions.get(path))
+        elif self.local_tier is not None:
+            with self.local_tier.use(path, self.versions.get(path)) as local_path:
+                # the mapping stays readable even if the copy is evicted afterwards
+                fragment = self._format.make_fragment(pa.memory_map(local_path, "r"))
+                fragment.ensure_complete_metadata()
+        else:
+            fragment = self._format.make_fragment(os.path.abspath(path), self._fs)
+            fragment.ensure_complete_metadata()
+        with self._lock:
+            self._fragments[path] = fragment
+            while len(self._fragments)>self.max_open:
+                self._fragments.popitem(last=False)
+        return fragment
+
+    def _conform(self, table)->pa.Table:
+        # a partition's own schema to that of all partitions, as parquet fragments are read with it
+        if table.schema==self.schema:
+            return table
+        return pa.table([table.column(f.name).cast(f.type) if f.name in table.column_names else pa.nulls(table.num_rows, f.type)
+                         for f in self.schema], schema=self.schema)
+
+    def read(self, unit)->pa.Table:
+        path, rg, start, end = unit
+        if self.decoded_cache is not None:
+            # zero-copy from the mapped file, nothing is decompressed
+            table = self._conform(pa.Table.from_batches([self._fragment(path).get_batch(rg)]))
+            if end-start<table.num_rows:
+                table = table.slice(start, end-start)
+            if self.filter is None and self.columns is None:
+                return table
+            return dataset(table).to_table(columns=self.columns, filter=self.filter)
+        fragment = self._fragment(path).subset(row_group_ids=[rg])
+        if start==0 and end==fragment.row_groups[0].num_rows:
+            return fragment.to_table(schema=self.schema, columns=self.columns, filter=self.filter)
+        # a slice of a row group is cut before filtering, so the filter may need columns outside the projection
+        table = fragment.to_table(schema=self.schema).slice(start, end-start)
+        if self.filter is None and self.columns is None:
+            return table
+        return dataset(table).to_table(columns=self.columns, filter=self.filter)
+
+def _read_ahead(reader, units, batch_readahead:int=4, fragment_readahead:int=2):
+    """read units in order, with up to batch_readahead row groups from up to fragment_readahead files in flight"""
+    if batch_readahead<=0:
+        for unit in units:
+            yield reader.read(unit)
+        return
+    pending = []
+    units = iter(units)
+    with ThreadPoolExecutor(max_workers=batch_readahead) as executor:
+        for unit in units:
+            files = {u[0] for u, _ in pending}
+            while len(pending)>=batch_readahead or (unit[0] not in files and len(files)>=max(1, fragment_readahead)):
+                yield pending.pop(0)[1].result()
+                files = {u[0] for u, _ in pending}
+            pending.append((unit, executor.submit(reader.read, unit)))
+        while len(pending)>0:
+            yield pending.pop(0)[1].result()
+
+def _convert(output, item):
+    batch, position = item
+    if output=="pandas":
+        # batches may share buffers with the rest of their window, so they are not converted destructively
+        return batch.to_pandas(), position
+    return convert_table(batch, output), position
+
+class _ShardReader(object):
+    """reads the batches of a stream's shard from a position, the windows of read units are planned on first use"""
+    def __init__(self, filepaths:list, n_samples:list, shard:int, n_shards:int, shuffle:bool, seed:int, epoch:int,
+                 buffer_size:int, batch_size:int, batch_readahead:int, fragment_readahead:int, reader_kargs:dict):
+        self.filepaths = filepaths
+        self.n_samples = n_samples
+        self.shard = shard
+        self.n_shards = n_shards
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = epoch
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.batch_readahead = batch_readahead
+        self.fragment_readahead = fragment_readahead
+        self.reader_kargs = reader_kargs
+        self._windows = None
+
+    def windows(self)->list:
+        if self._windows is None:
+            if len(self.filepaths)==0:
+                return []
+            units = plan_units(self.filepaths, self.n_samples, self.shard, self.n_shards, self.shuffle, self.seed, self.epoch)
+            self._windows = plan_windows(units, self.buffer_size)
+        return self._windows
+
+    def batches(self, position:tuple, resumed_at:tuple=None):
+        """yields (table, position after it)"""
+        if len(self.filepaths)==0:
+            return
+        windows = self.windows()
+        first, skip = position
+        if first<len(windows) and resumed_at not in (None, tuple(windows[first][0][:2])):
+            raise Exception(f"[ERROR] the files changed since the stream state was saved, cannot resume from {resumed_at}.")
+
+        reader = _UnitReader(unify_schema(self.filepaths), **self.reader_kargs)
+        tables = _read_ahead(reader, [unit for window in windows[first:] for unit in window], self.batch_readahead, self.fragment_readahead)
+        carry = None
+        for w in range(first, len(windows)):
+            table = pa.concat_tables([next(tables) for _ in windows[w]])
+            if self.shuffle:
+                rng = np.random.default_rng([self.seed, self.epoch, self.shard, w])
+                table = table.take(rng.permutation(table.num_rows))
+            if w==first:
+                table = table.slice(skip)
+            # rows of this window in front of the current slice
+            offset = skip if w==first else 0
+            n_carry = 0
+            if carry is not None:
+                n_carry = carry.num_rows
+                table = pa.concat_tables([carry, table])
+            n_full = table.num_rows//self.batch_size*self.batch_size
+            for start in range(0, n_full, self.batch_size):
+                yield table.slice(start, self.batch_size), (w, offset+start+self.batch_size-n_carry)
+            carry = table.slice(n_full)
+        if carry is not None and carry.num_rows>0:
+            yield carry, (len(windows), 0)
+
+class DataStream(object):
+    """
+    an iterator over batches of parquet files as DataFrames, arrow tables or dicts of numpy arrays.
+    With prefetch>0, batches are read and converted by background threads ahead of the consumer.
+    The position of the stream is given by state_dict(), a stream created with that state continues
+    right after the last batch returned, reading only the row groups from there on.
+    Args:
+        filepaths (list): parquet files
+        batch_size (int): rows per batch
+        columns (list, optional): columns to read. Defaults to None i.e. all.
+        filter (optional): pyarrow expression or DNF filters. Defaults to None.
+        prefetch (int, optional): number of batches kept ready in the background. Defaults to 0 i.e. synchronous.
+        prefetch_threads (int, optional): threads converting prefetched batches. Defaults to 1.
+        fragment_readahead (int, optional): max number of files read ahead at once. Defaults to 2.
+        batch_readahead (int, optional): number of row groups read ahead in parallel. Defaults to 4.
+        shuffle (bool, optional): read row groups in a random order and mix rows through a shuffle buffer. Defaults to False.
+        seed (int, optional): shuffle seed, the order is the same for the same (seed, epoch). Defaults to 0.
+        epoch (int, optional): epoch number, mixed into the seed. Defaults to 0.
+        buffer_size (int, optional): rows mixed together by the shuffle buffer, memory holds at most this plus one row group. Defaults to 10000.
+        n_samples (list, optional): number of samples of each file, used to balance shards. Defaults to None i.e. read from the footers.
+        rank (int, optional): rank of this process. Defaults to 0.
+        world_size (int, optional): number of ranks. Defaults to 1.
+        num_workers (int, optional): number of data loading workers per rank. Defaults to 1.
+        worker (int, optional): index of this worker within the rank. Defaults to 0.
+        state (dict, optional): state_dict() of a previous stream to resume from, its seed and epoch take precedence. Defaults to None.
+        output (str, optional): 'pandas', 'arrow' or 'numpy', see utils.array_to_numpy for the zero-copy numpy layout. Defaults to 'pandas'.
+        decoded_cache (DecodedCache, optional): read partitions from their memory-mapped decoded copies. Defaults to None.
+        versions (list, optional): version of each file, e.g. blob_id, invalidating decoded and local copies. Defaults to None.
+        local_tier (LocalTier, optional): read partitions from their copies on a local disk. Defaults to None.
+    """
+    def __init__(self, filepaths:list, batch_size:int=16, columns:list=None, filter=None,
+                 prefetch:int=0, prefetch_threads:int=1, fragment_readahead:int=None, batch_readahead:int=None,
+                 shuffle:bool=False, seed:int=0, epoch:int=0, buffer_size:int=10000,
+                 n_samples:list=None, rank:int=0, world_size:int=1, num_workers:int=1, worker:int=0, state:dict=None,
+                 output:str="pandas", decoded_cache=None, versions:list=None, local_tier=None):
+        if output not in ["pandas", "arrow", "numpy"]:
+            raise Exception(f"[ERROR] unknown output '{output}', expected 'pandas', 'arrow' or 'numpy'.")
+        if not (0<=rank<world_size and 0<=worker<num_workers):
+            raise Exception(f"[ERROR] invalid shard: rank {rank} of {world_size}, worker {worker} of {num_workers}.")
+        self.filepaths = filepaths
+        self.batch_size = batch_size
+        self.columns = columns
+        self.filter = to_filter_expression(filter)
+        self.output = output
+        self.decoded_cache = decoded_cache
+        self.versions = dict(zip(filepaths, versions)) if versions is not None else None
+        self.local_tier = local_tier
+        self.fragment_readahead = 2 if fragment_readahead is None else fragment_readahead
+        self.batch_readahead = 4 if batch_readahead is None else batch_readahead
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = epoch
+        self.buffer_size = buffer_size if shuffle else 1
+        self.n_samples = n_samples
+        self.shard = rank*num_workers+worker
+        self.n_shards = world_size*num_workers
+        self.stats = AttrDict(n_items=0, n_waits=0, wait_time=0.)
+
+        self._position = (0, 0)
+        self._resumed_at = None
+        if state is not None:
+            self._load_state(state)
+        self._reader = _ShardReader(filepaths, n_samples, self.shard, self.n_shards, self.shuffle, self.seed, self.epoch,
+                                    self.buffer_size, batch_size, self.batch_readahead, self.fragment_readahead,
+                                    dict(columns=columns, filter=self.filter, decoded_cache=decoded_cache,
+                                         versions=self.versions, local_tier=local_tier))
+        # neither refers to the stream, so that an abandoned stream is collected and its threads stopped
+        self._source = self._batches()
+        convert = partial(_convert, output)
+        if prefetch>0:
+            self._iterator = Prefetcher(self._source, prefetch=prefetch,
+                                        transform=convert, num_threads=prefetch_threads)
+            self.stats = self._iterator.stats
+        else:
+            self._iterator = map(convert, self._source)
+
+    def _load_state(self, state:dict):
+        expected = dict(shuffle=self.shuffle, buffer_size=self.buffer_size, shard=self.shard, n_shards=self.n_shards)
+        for k, v in expected.items():
+            if state[k]!=v:
+                raise Exception(f"[ERROR] cannot resume a stream with {k}={state[k]} as {k}={v}.")
+        self.seed = state["seed"]
+        self.epoch = state["epoch"]
+        self._position = (state["window"], state["row_offset"])
+        self._resumed_at = (state["partition"], state["row_group"])
+
+    def state_dict(self)->dict:
+        """
+        position after the last batch returned, i.e. the window of row groups and the number of its rows already returned.
+        Shuffle orders are derived from (seed, epoch, shard, window), so these also stand for the shuffle RNG state.
+        """
+        window, row_offset = self._position
+        windows = self._reader.windows()
+        partition, row_group = windows[window][0][:2] if window<len(windows) else (None, None)
+        return dict(epoch=self.epoch, seed=self.seed, shuffle=self.shuffle, buffer_size=self.buffer_size,
+                    shard=self.shard, n_shards=self.n_shards, window=window, row_offset=row_offset,
+                    partition=partition, row_group=row_group)
+
+    def _batches(self):
+        """yields (table, position after it)"""
+        return self._reader.batches(self._position, self._resumed_at)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        batch, self._position = next(self._iterator)
+        return batch
+
+    def close(self):
+        """stop reading ahead, the stream is exhausted afterwards"""
+        iterator = getattr(self, "_iterator", None)
+        if isinstance(iterator, Prefetcher):
+            iterator.close()
+        elif iterator is not None:
+            self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+class PipelinedStream(object):
+    """
+    a stream over partitions that are fetched, e.g. downloaded, in the background while the earlier ones are consumed.
+    Partitions are streamed one after the other, each by a DataStream, and up to lookahead of the following ones are
+    fetched meanwhile, so the first batches come as soon as the first partition is available. Shards are made of whole
+    partitions, the i-th partition going to shard i%n_shards, so that each rank and worker only fetches its own.
+    With shuffle, partitions are taken in a random order of (seed, epoch) and rows are only mixed within a partition.
+    The last batch of each partition may hold fewer than batch_size rows.
+    Args:
+        filepaths (list): parquet files, not necessarily available yet
+        fetch (callable): fetch(path) makes a file available, partitions it fails on are reported and skipped
+        lookahead (int, optional): number of partitions fetched ahead of the one being streamed. Defaults to 2.
+        release (callable, optional): release(path) is called once a file has been streamed, e.g. to delete it. Defaults to None.
+        shuffle (bool, optional): shuffle the partitions and the rows within each of them. Defaults to False.
+        seed (int, optional): shuffle seed. Defaults to 0.
+        epoch (int, optional): epoch number, mixed into the seed. Defaults to 0.
+        rank (int, optional): rank of this process. Defaults to 0.
+        world_size (int, optional): number of ranks. Defaults to 1.
+        num_workers (int, optional): number of data loading workers per rank. Defaults to 1.
+        worker (int, optional): index of this worker within the rank. Defaults to 0.
+        state (dict, optional): state_dict() of a previous stream to resume from. Defaults to None.
+        stream_kargs: other arguments of DataStream, e.g. batch_size, columns, filter, buffer_size, prefetch, output.
+    """
+    def __init__(self, filepaths:list, fetch, lookahead:int=2, release=None, shuffle:bool=False, seed:int=0, epoch:int=0,
+                 rank:int=0, world_size:int=1, num_workers:int=1, worker:int=0, state:dict=None, **stream_kargs):
+        if not (0<=rank<world_size and 0<=worker<num_workers):
+            raise Exception(f"[ERROR] invalid shard: rank {rank} of {world_size}, worker {worker} of {num_workers}.")
+        self.fetch = fetch
+        self.release = release
+        self.lookahead = max(0, lookahead)
+        self.shuffle = shuffle
+        self.shard = rank*num_workers+worker
+        self.n_shards = world_size*num_workers
+        self.stream_kargs = stream_kargs
+        self.stats = AttrDict(n_items=0, n_waits=0, wait_time=0.)
+
+        self._partition, stream_state = 0, None
+        if state is not None:
+            expected = dict(shuffle=shuffle, shard=self.shard, n_shards=self.n_shards)
+            for k, v in expected.items():
+                if state[k]!=v:
+                    raise Exception(f"[ERROR] cannot resume a stream with {k}={state[k]} as {k}={v}.")
+            seed, epoch = state["seed"], state["epoch"]
+            self._partition, stream_state = state["partition"], state["stream"]
+        self.seed = seed
+        self.epoch = epoch
+        order = np.random.default_rng([seed, epoch]).permutation(len(filepaths)) if shuffle else range(len(filepaths))
+        self.filepaths = [filepaths[i] for i in order][self.shard::self.n_shards]
+
+        self._pool = ThreadPoolExecutor(max_workers=max(1, self.lookahead))
+        self._futures = dict()
+        self._stream = None
+        self._stream_state = stream_state
+
+    def _fetch_ahead(self):
+        for i in range(self._partition, min(self._partition+1+self.lookahead, len(self.filepaths))):
+            if i not in self._futures:
+                self._futures[i] = self._pool.submit(self.fetch, self.filepaths[i])
+
+    def _open_next(self)->bool:
+        while self._partition<len(self.filepaths):
+            self._fetch_ahead()
+            future = self._futures[self._partition]
+            t = time.time()
+            if not future.done():
+                self.stats.n_waits += 1
+            try:
+                future.result()
+            except Exception as e:
+                print(f"[ERROR] failed to fetch {self.filepaths[self._partition]}, skipped: {e}")
+                self._futures.pop(self._partition)
+                self._partition += 1
+                self._stream_state = None
+                continue
+            finally:
+                self.stats.wait_time += time.time()-t
+            self._stream = DataStream([self.filepaths[self._partition]], shuffle=self.shuffle, seed=self.seed, epoch=self.epoch,
+                                      state=self._stream_state, **self.stream_kargs)
+            return True
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self._stream is not None or self._open_next():
+            try:
+                batch = next(self._stream)
+                self._stream_state = self._stream.state_dict()
+                self.stats.n_items += 1
+                return batch
+            except StopIteration:
+                self._stream.close()
+                self._stream = None
+                self._stream_state = None
+                self._futures.pop(self._partition)
+                if self.release is not None:
+                    self.release(self.filepaths[self._partition])
+                self._partition += 1
+        self.close()
+        raise StopIteration
+
+    def state_dict(self)->dict:
+        """the partition being streamed and the position within it"""
+        return dict(epoch=self.epoch, seed=self.seed, shuffle=self.shuffle, shard=self.shard, n_shards=self.n_shards,
+                    partition=self._partition, stream=self._stream_state)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, "_pool"):
+            self.close()
+
+class SubsetView(object):
+    """
+    map-style access to the samples of a list of parquet files by global index, e.g. view[i] or view[[i, j, k]].
+    Files are located with the cumulative n_samples and rows with the row group offsets of the cached footers,
+    so only the row groups containing the requested samples are read. Recently decoded row groups are kept
+    in an LRU of cache_size entries.
+    Args:
+        filepaths (list): parquet files
+        n_samples (list, optional): number of samples of each file. Defaults to None i.e. read from the footers.
+        columns (list, optional): columns to read. Defaults to None i.e. all.
+        cache_size (int, optional): number of decoded row groups kept in memory. Defaults to 8.
+        decoded_cache (DecodedCache, optional): read partitions from their memory-mapped decoded copies. Defaults to None.
+        versions (list, optional): version of each file, invalidating decoded and local copies. Defaults to None.
+        local_tier (LocalTier, optional): read partitions from their copies on a local disk. Defaults to None.
+    """
+    def __init__(self, filepaths:list, n_samples:list=None, columns:list=None, cache_size:int=8, decoded_cache=None, versions:list=None,
+                 local_tier=None):
+        if n_samples is None:
+            n_samples = [None]*len(filepaths)
+        self.filepaths = filepaths
+        footers = [read_footer(path) for path in filepaths]
+        self.counts = [n if n else footer.num_rows for footer, n in zip(footers, n_samples)]
+        self.offsets = np.cumsum([0]+self.counts).tolist()
+        # files and then rows are located by bisecting these
+        self._num_rows = [footer.num_rows for footer in footers]
+        self._row_offsets = [[rg.row_offset for rg in footer.row_groups] for footer in footers]
+        self.columns = columns
+        self.cache_size = cache_size
+        self._reader = _UnitReader(unify_schema(filepaths), columns, decoded_cache=decoded_cache,
+                                   versions=dict(zip(filepaths, versions)) if versions is not None else None,
+                                   local_tier=local_tier) if len(filepaths)>0 else None
+        self._row_groups = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def locate(self, index:int)->tuple:
+        """(path, row group, row within the row group) of a global sample index"""
+        if index<0:
+            index += len(self)
+        if not 0<=index<len(self):
+            raise IndexError(f"sample index {index} out of range for {len(self)} samples")
+        f = bisect.bisect_right(self.offsets, index)-1
+        path, row = self.filepaths[f], index-self.offsets[f]
+        if self._num_rows[f]!=self.counts[f]:
+            raise Exception(f"[ERROR] {path} has {self._num_rows[f]} samples but {self.counts[f]} are recorded in the metadata, please run version_check to refresh it.")
+        rg = bisect.bisect_right(self._row_offsets[f], row)-1
+        return path, rg, row-self._row_offsets[f][rg]
+
+    def _row_group(self, path:str, rg:int)->pa.Table:
+        key = (path, rg)
+        with self._lock:
+            if key in self._row_groups:
+                self._row_groups.move_to_end(key)
+                return self._row_groups[key]
+        num_rows = read_footer(path).row_groups[rg].num_rows
+        table = self._reader.read((path, rg, 0, num_rows))
+        with self._lock:
+            self._row_groups[key] = table
+            while len(self._row_groups)>self.cache_size:
+                self._row_groups.popitem(last=False)
+        return table
+
+    def take(self, indices)->pa.Table:
+        """the samples at the given global indices as an arrow table, in the given order"""
+        groups = OrderedDict()
+        for i, index in enumerate(indices):
+            path, rg, row = self.locate(int(index))
+            groups.setdefault((path, rg), ([], []))
+            groups[(path, rg)][0].append(i)
+            groups[(path, rg)][1].append(row)
+        if len(groups)==0:
+            if self._reader is None:
+                # a view without files has no schema either
+                return pa.table({})
+            return self._reader.schema.empty_table() if self.columns is None else \
+                self._reader.schema.empty_table().select(self.columns)
+        pieces, order = [], []
+        for (path, rg), (positions, rows) in groups.items():
+            pieces.append(self._row_group(path, rg).take(rows))
+            order += positions
+        return pa.concat_tables(pieces).take(np.argsort(order))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            index = range(*index.indices(len(self)))
+        if isinstance(index, (list, tuple, range, np.ndarray)):
+            return self.take(index).to_pandas()
+        return self.take([index]).to_pylist()[0]
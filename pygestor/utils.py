@@ -4,7 +4,10 @@ rlsn 2024
 """
 import os
 import pandas as pd
+import numpy as np
+import pyarrow as pa
 import pyarrow.parquet as pq
+import pyarrow.compute as pc
 from pyarrow.dataset import dataset
 from pyarrow.parquet import ParquetDataset
 
@@ -33,34 +36,154 @@ def normpath(path):
 def joinpath(*path):
     return normpath(os.path.join(*path))
 
+_rollup_keys = ["downloaded", "size", "n_samples", "outdated"]
+
+def partition_rollup(part):
+    downloaded = 1 if part['downloaded'] else 0
+    return dict(
+        downloaded=downloaded,
+        size=part['size'],
+        n_samples=part['n_samples'],
+        outdated=downloaded if not part.get('is_latest', False) else 0,
+        )
+
+def refresh_rollup(info):
+    """recompute the aggregates of a subset (or of a dataset and all its subsets) from its partitions"""
+    if "subsets" in info:
+        rollups = [refresh_rollup(subs) for subs in info["subsets"].values()]
+    else:
+        rollups = [partition_rollup(part) for part in info["partitions"].values()]
+    info["rollup"] = {k:sum(r[k] for r in rollups) for k in _rollup_keys}
+    return info["rollup"]
+
+def get_rollup(info):
+    """the aggregates of a subset or dataset, computed once and then maintained by update_partition"""
+    if "rollup" not in info:
+        refresh_rollup(info)
+    return info["rollup"]
+
+def update_partition(ds_info, subs_info, part_info, **fields):
+    """update partition fields and apply the change to the subset and dataset aggregates"""
+    # the dataset first, computing its aggregates also computes those of its subsets
+    rollups = [get_rollup(ds_info), get_rollup(subs_info)]
+    old = partition_rollup(part_info)
+    part_info.update(fields)
+    new = partition_rollup(part_info)
+    for rollup in rollups:
+        for k in rollup:
+            rollup[k] += new[k]-old[k]
+
 def compute_subset_download(subs):
-    return sum([1 if part['downloaded'] else 0 for part in subs["partitions"].values()])
+    return get_rollup(subs)['downloaded']
 
 def compute_subset_n_samples(subs):
-    return sum([part['n_samples'] for part in subs["partitions"].values()])
+    return get_rollup(subs)['n_samples']
 
 def compute_subset_size(subs):
-    return sum([part['size'] for part in subs["partitions"].values()])
+    return get_rollup(subs)['size']
+
+def is_subset_latest(subs):
+    return get_rollup(subs)['outdated']==0
 
 def compute_nsamples(parquet):
+    if os.path.isfile(parquet):
+        from .footer_cache import read_footer
+        return read_footer(parquet).num_rows
     dataset = ParquetDataset(parquet)
     n_samples = sum(p.count_rows() for p in dataset.fragments)
     return n_samples
 
 def read_schema(parquet):
-    return pq.read_schema(parquet)
+    from .footer_cache import read_footer
+    return read_footer(parquet).schema
+
+def unify_schema(parquets):
+    """the schema of all files from their cached footers: columns of any of them, null columns taking the type
+    they have in other files"""
+    if len(parquets)==0:
+        return None
+    return pa.unify_schemas([read_schema(p) for p in parquets], promote_options="permissive")
 
-def load_parquets_in_batch(parquets, batchsize=10):    
+def to_filter_expression(filter):
+    """a pyarrow expression from either an expression or the DNF filter notation of pyarrow/pandas,
+    e.g. [("lang", "=", "en"), ("n_tokens", ">", 100)] or [[...], [...]] for a disjunction
+    """
+    if filter is None or isinstance(filter, pc.Expression):
+        return filter
+    return pq.filters_to_expression(filter)
+
+def load_parquets_in_batch(parquets, batchsize=10, columns=None, filter=None):    
     def generator():
-        ds = dataset(parquets, format="parquet")
-        for batch in ds.to_batches(batch_size=batchsize):
+        # the cached schemas spare the scan from inspecting the footers to infer it
+        ds = dataset(parquets, schema=unify_schema(parquets), format="parquet")
+        # only the projected columns are decoded, row groups are skipped using their statistics
+        for batch in ds.to_batches(batch_size=batchsize, columns=columns, filter=to_filter_expression(filter)):
             yield batch.to_pandas()
     yield from generator()
 
-def load_parquets(parquets):
-    dataframes = [pd.read_parquet(f, engine='pyarrow') for f in parquets]
-    data = pd.concat(dataframes, axis=0)
-    return data
+def _validity(arr):
+    if arr.null_count==0:
+        return None
+    return arr.is_valid().to_numpy(zero_copy_only=False)
+
+def array_to_numpy(arr):
+    """
+    numpy views on the buffers of an arrow array, without copying if the array has a single chunk.
+    Fixed-width columns become an array of values, strings and binaries an AttrDict of offsets into a
+    uint8 data array, i.e. item i is data[offsets[i]:offsets[i+1]]. Columns with nulls come with a
+    boolean 'valid' mask (null values are undefined), other types are converted to object arrays.
+    """
+    if isinstance(arr, pa.ChunkedArray):
+        arr = arr.chunk(0) if arr.num_chunks==1 else arr.combine_chunks()
+    t = arr.type
+    if pa.types.is_string(t) or pa.types.is_binary(t) or pa.types.is_large_string(t) or pa.types.is_large_binary(t):
+        _, offsets, data = arr.buffers()
+        offset_type = np.int64 if pa.types.is_large_string(t) or pa.types.is_large_binary(t) else np.int32
+        ret = AttrDict(
+            offsets=np.frombuffer(offsets, dtype=offset_type)[arr.offset:arr.offset+len(arr)+1],
+            data=np.frombuffer(data, dtype=np.uint8) if data is not None else np.zeros(0, dtype=np.uint8),
+            )
+        if arr.null_count>0:
+            ret.valid = _validity(arr)
+        return ret
+    if pa.types.is_integer(t) or pa.types.is_floating(t) or pa.types.is_temporal(t):
+        if arr.null_count==0:
+            # dates and times may need a unit conversion
+            return arr.to_numpy(zero_copy_only=not pa.types.is_temporal(t))
+        kind = 'f' if pa.types.is_floating(t) else 'u' if pa.types.is_unsigned_integer(t) else 'i'
+        values = np.frombuffer(arr.buffers()[1], dtype=np.dtype(f"<{kind}{t.bit_width//8}"))
+        return AttrDict(values=values[arr.offset:arr.offset+len(arr)], valid=_validity(arr))
+    # booleans are bit-packed and nested types have no flat layout, these are copied
+    return arr.to_numpy(zero_copy_only=False)
+
+def table_to_numpy(table):
+    """an AttrDict of numpy views on the columns of an arrow table, see array_to_numpy"""
+    return AttrDict([(name, array_to_numpy(table.column(name))) for name in table.column_names])
+
+def convert_table(table, return_format="pandas"):
+    """convert an arrow table to 'pandas', 'arrow' or 'numpy' (a dict of arrays)"""
+    if return_format=="arrow":
+        return table
+    elif return_format=="pandas":
+        # arrow buffers are released column by column while converting, which keeps the peak memory low
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+    elif return_format=="numpy":
+        # zero-copy views on the arrow buffers
+        return table_to_numpy(table)
+    raise Exception(f"[ERROR] unknown return format '{return_format}'.")
+
+def load_ipc_files(paths, return_format="pandas", columns=None, filter=None, schema=None):
+    # memory-mapped, so only the filtered or converted columns are ever copied
+    from pyarrow.fs import LocalFileSystem
+    ds = dataset(paths, schema=schema, format="ipc", filesystem=LocalFileSystem(use_mmap=True))
+    table = ds.to_table(columns=columns, filter=to_filter_expression(filter), use_threads=True)
+    return convert_table(table, return_format)
+
+def load_parquets(parquets, return_format="pandas", columns=None, filter=None):
+    # a single multi-threaded scan over all files into one table
+    ds = dataset(parquets, schema=unify_schema(parquets), format="parquet")
+    table = ds.to_table(columns=columns, filter=to_filter_expression(filter), use_threads=True)
+    return convert_table(table, return_format)
 
 import json
 class AttrDict(dict):
@@ -78,6 +201,21 @@ class AttrDict(dict):
             obj = cls(json.loads(f.read()))
         return obj
     
+def samples_to_columns(samples, decoders:dict=None)->AttrDict:
+    """
+    one list per column of a DataFrame or arrow table, each built in a single vectorized conversion.
+    Only columns with a function in decoders, e.g. images, are processed item by item.
+    """
+    decoders = decoders or dict()
+    data = AttrDict()
+    is_arrow = not isinstance(samples, pd.DataFrame)
+    for col in (samples.column_names if is_arrow else samples.columns):
+        values = samples.column(col).to_pylist() if is_arrow else samples[col].to_list()
+        if col in decoders:
+            values = [decoders[col](v) for v in values]
+        data[col] = values
+    return data
+
 class Mutable(object):
     def __init__(self, v=None):
         self.v = v
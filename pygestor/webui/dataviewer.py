@@ -5,7 +5,7 @@ rlsn 2024
 import pyperclip
 from nicegui import ui
 import asyncio
-from pygestor import DATA_DIR, get_meta, download, remove, stream_dataset, process_samples, version_check, remove_dataset_metadata
+from pygestor import DATA_DIR, get_meta, get_dataset_summary, download, remove, stream_dataset, get_subset_view, process_samples, version_check, remove_dataset_metadata
 from pygestor.utils import read_schema, Mutable
 from pygestor.webui.infoview import *
 from pygestor.webui.webui_utils import stream_load_code_snippet, full_load_code_snippet, display_sample, is_part_latest, is_subs_latest
@@ -28,11 +28,12 @@ def dataset_table():
     ]
     rows = []
     for ds in get_meta()["datasets"]:
+        info = get_dataset_summary(ds)
         rows.append({
             'name': ds, 
-            'modality': get_meta(ds)["modality"],
-            'desc': get_meta(ds)["description"],
-            'src': get_meta(ds)["source"],
+            'modality': info["modality"],
+            'desc': info["description"],
+            'src': info["source"],
         })
 
     return columns, rows
@@ -212,11 +213,19 @@ def show_schema(path):
     info = get_meta(*path)
 
     download_path = os.path.abspath(os.path.join(DATA_DIR, info["path"]))
-    parquet_file = glob.glob(download_path+"/*")[0]
+    parquet_file = glob.glob(download_path+"/*.parquet")[0]
     schema = read_schema(parquet_file)
     datastream = iter(stream_dataset(name, subs, download_if_missing=False, 
                                      batch_size = webui_config.n_preview_samples))
     batch = Mutable(process_samples(name, next(datastream)))
+    subset_view = get_subset_view(name, subs, download_if_missing=False)
+    jump_to = Mutable(0)
+
+    def load_from(start):
+        # random access only reads the row groups holding the requested samples
+        start = max(0, min(int(start or 0), len(subset_view)-1))
+        indices = list(range(start, min(start+webui_config.n_preview_samples, len(subset_view))))
+        batch.set(process_samples(name, subset_view[indices]))
 
     def on_click_sample(index):
         iloc = Mutable(1)
@@ -254,6 +263,12 @@ def show_schema(path):
                         batch.set(process_samples(name, next(datastream))),
                         fill_content()
                     )).classes('p-3')
+                    ui.number(label='jump to sample', min=0, max=max(0, len(subset_view)-1)).bind_value(jump_to, 'v').classes('px-2 py-0')
+                    ui.button(icon='start',on_click=lambda:(
+                        load_from(jump_to.v),
+                        iloc.set(1),
+                        fill_content()
+                    )).classes('p-3')
 
         sampleview.open()
 
@@ -27,7 +27,7 @@ def show_dataset_info_list(name):
     def on_save():
         for k,v in changes.items():
             info[k] = v
-        write_meta()
+        write_meta(path=(name,))
         ui.notify("Change saved.")
         from pygestor.webui.dataviewer import show_datasets, show_dataset_info
         show_datasets()
@@ -53,7 +53,7 @@ def show_subset_info_list(path):
     def on_save():
         for k,v in changes.items():
             info[k] = v
-        write_meta()
+        write_meta(path=path)
         ui.notify("Change saved.")
         from pygestor.webui.dataviewer import show_subsets, show_subset_info
         show_subsets(name)
@@ -5,32 +5,38 @@ rlsn 2024
 from PIL.JpegImagePlugin import JpegImageFile
 from nicegui import ui
 import re
-from ..utils import compute_subset_download
+from ..utils import compute_subset_download, is_subset_latest
 def is_subs_latest(subs_info):
     if compute_subset_download(subs_info)<=0:
         return ""
-    all_latest = True
-    for part_info in subs_info["partitions"].values():
-        all_latest &= is_part_latest(part_info)!="No"
-    return "Yes" if all_latest else "No"
+    return "Yes" if is_subset_latest(subs_info) else "No"
     
 def is_part_latest(part_info):
     if not part_info["downloaded"]:
         return ""
     return "Yes" if "is_latest" in part_info and part_info["is_latest"] else "No"
 
-def stream_load_code_snippet(name, subs, parts=[]):
+def scan_args_code(columns=None, filter=None):
+    code = ''
+    if columns is not None and len(columns)>0:
+        code += ', columns=' + repr(list(columns))
+    # DNF filters are written as they are, pyarrow expressions have no source form and are left out
+    if isinstance(filter, (list, tuple)) and len(filter)>0:
+        code += ', filter=' + repr(filter)
+    return code
+
+def stream_load_code_snippet(name, subs, parts=[], columns=None, filter=None):
     code = f'import pygestor\n\nbatches = pygestor.stream_dataset("{name}", "{subs}"'
     if len(parts)>0:
         code += ', ["' + '","'.join(parts) +'"]'
-    code += ', batch_size=16)\n\nfor bn, batch in enumerate(batches):\n    # do something'
+    code += ', batch_size=16' + scan_args_code(columns, filter) + ')\n\nfor bn, batch in enumerate(batches):\n    # do something'
     return code
 
-def full_load_code_snippet(name, subs, parts=[]):
+def full_load_code_snippet(name, subs, parts=[], columns=None, filter=None):
     code = f'import pygestor\n\nds = pygestor.load_dataset("{name}", "{subs}"'
     if len(parts)>0:
         code += ', ["' + '","'.join(parts) + '"]'
-    code += ')'
+    code += scan_args_code(columns, filter) + ')'
     return code
 
 def display_sample(sample):
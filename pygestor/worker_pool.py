@@ -0,0 +1,211 @@
+"""
+This script contains a stream of batches read and decoded by a pool of worker processes,
+handed back through shared memory as Arrow IPC buffers
+rlsn 2024
+"""
+import time
+import queue
+import traceback
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from .utils import AttrDict, convert_table
+from .footer_cache import get_footer_cache
+
+def _ipc_size(table)->int:
+    sink = pa.MockOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.size()
+
+def _write_ipc(buf, table):
+    with pa.ipc.new_stream(pa.FixedSizeBufferWriter(pa.py_buffer(buf)), table.schema) as writer:
+        writer.write_table(table)
+
+def to_shared_memory(table)->tuple:
+    """write a table into a new shared memory block, which the reader unlinks. Returns (name, size)"""
+    size = _ipc_size(table)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+    _write_ipc(shm.buf, table)
+    shm.close()
+    return shm.name, size
+
+class _SharedBlock(object):
+    """an attached shared memory block, unlinked right away and closed once no arrow buffer refers to it"""
+    def __init__(self, name:str):
+        self.shm = shared_memory.SharedMemory(name=name)
+        self.shm.unlink()
+        self.view = np.frombuffer(self.shm.buf, dtype=np.uint8)
+
+    def read(self, size:int)->pa.Table:
+        buf = pa.foreign_buffer(self.view.ctypes.data, size, base=self)
+        return pa.ipc.open_stream(buf).read_all()
+
+    def __del__(self):
+        self.view = None
+        self.shm.close()
+
+def from_shared_memory(name:str, size:int)->pa.Table:
+    """zero-copy read of a table written by to_shared_memory"""
+    return _SharedBlock(name).read(size)
+
+def _to_table(batch):
+    if isinstance(batch, pa.Table):
+        return batch
+    if isinstance(batch, pa.RecordBatch):
+        return pa.Table.from_batches([batch])
+    if isinstance(batch, pd.DataFrame):
+        return pa.Table.from_pandas(batch, preserve_index=False)
+    return pa.table(dict(batch))
+
+def _worker_loop(worker:int, stream_kargs:dict, state:dict, transform, out_queue, stop, footer_cache_path:str):
+    from . import footer_cache
+    from .stream import DataStream
+    # the footers the parent already read
+    footer_cache._footer_cache = footer_cache.FooterCache(footer_cache_path)
+    try:
+        stream = DataStream(**stream_kargs, worker=worker, state=state)
+        for table, position in stream._batches():
+            if stop.is_set():
+                return
+            if transform is not None:
+                table = _to_table(transform(table))
+            name, size = to_shared_memory(table)
+            stream._position = position
+            message = ("batch", worker, name, size, stream.state_dict())
+            while True:
+                try:
+                    out_queue.put(message, timeout=0.1)
+                    break
+                except queue.Full:
+                    if stop.is_set():
+                        # nobody will read the block anymore
+                        _SharedBlock(name)
+                        return
+        out_queue.put(("done", worker))
+    except BaseException:
+        out_queue.put(("error", worker, traceback.format_exc()))
+
+class WorkerPoolStream(object):
+    """
+    a stream of batches produced by num_workers processes, worker i streaming shard i of the rank (see DataStream),
+    so each worker owns a disjoint set of row groups. Batches are optionally transformed in the workers, e.g. decoded,
+    and handed back as Arrow IPC buffers in shared memory rather than pickled.
+    Args:
+        filepaths (list): parquet files
+        num_workers (int, optional): number of worker processes. Defaults to 2.
+        transform (callable, optional): picklable function applied by the workers to each arrow table, returning
+            an arrow table, a DataFrame or a dict of columns. Defaults to None.
+        ordered (bool, optional): return batches in a deterministic order, cycling over the workers, rather than
+            as they complete. Defaults to True.
+        prefetch (int, optional): number of batches each worker may have waiting. Defaults to 2.
+        output (str, optional): 'pandas', 'arrow' or 'numpy'. Defaults to 'pandas'.
+        start_method (str, optional): multiprocessing start method. Defaults to 'spawn'.
+        state (dict, optional): state_dict() of a previous stream to resume from. Defaults to None.
+        stream_kargs: other arguments of DataStream, e.g. batch_size, shuffle, seed, epoch, rank, world_size.
+    """
+    def __init__(self, filepaths:list, num_workers:int=2, transform=None, ordered:bool=True, prefetch:int=2,
+                 output:str="pandas", start_method:str="spawn", state:dict=None, **stream_kargs):
+        if output not in ["pandas", "arrow", "numpy"]:
+            raise Exception(f"[ERROR] unknown output '{output}', expected 'pandas', 'arrow' or 'numpy'.")
+        self.num_workers = num_workers
+        self.ordered = ordered
+        self.output = output
+        self.stats = AttrDict(n_items=0, n_waits=0, wait_time=0.)
+        self._processes = []
+        self._states = list(state["workers"]) if state is not None else [None]*num_workers
+        if len(self._states)!=num_workers:
+            raise Exception(f"[ERROR] cannot resume a stream of {len(self._states)} workers with {num_workers} workers.")
+
+        ctx = multiprocessing.get_context(start_method)
+        self._stop = ctx.Event()
+        if ordered:
+            self._queues = [ctx.Queue(maxsize=max(1, prefetch)) for _ in range(num_workers)]
+        else:
+            self._queues = [ctx.Queue(maxsize=max(1, prefetch)*num_workers)]
+        stream_kargs = dict(stream_kargs, filepaths=filepaths, num_workers=num_workers)
+        footer_cache_path = get_footer_cache().path
+        for i in range(num_workers):
+            p = ctx.Process(target=_worker_loop, args=(i, stream_kargs, self._states[i], transform,
+                                                       self._queues[i if ordered else 0], self._stop, footer_cache_path), daemon=True)
+            p.start()
+            self._processes.append(p)
+        self._running = list(range(num_workers))
+        self._next = 0
+
+    def _get(self, q):
+        t = time.time()
+        try:
+            message = q.get_nowait()
+        except queue.Empty:
+            self.stats.n_waits += 1
+            message = q.get()
+            self.stats.wait_time += time.time()-t
+        return message
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while len(self._running)>0:
+            if self.ordered:
+                self._next %= len(self._running)
+                message = self._get(self._queues[self._running[self._next]])
+            else:
+                message = self._get(self._queues[0])
+            kind, worker = message[:2]
+            if kind=="done":
+                self._running.remove(worker)
+                continue
+            if kind=="error":
+                self.close()
+                raise Exception(f"[ERROR] data loading worker {worker} failed:\n{message[2]}")
+            self._next += 1
+            _, _, name, size, self._states[worker] = message
+            table = from_shared_memory(name, size)
+            self.stats.n_items += 1
+            # numpy views keep the shared memory block mapped as long as they live
+            return convert_table(table, self.output)
+        self.close()
+        raise StopIteration
+
+    def state_dict(self)->dict:
+        """positions of all workers after the batches returned so far"""
+        return dict(workers=list(self._states))
+
+    def _drain(self):
+        # release the blocks of batches nobody will read
+        for q in self._queues:
+            while True:
+                try:
+                    message = q.get_nowait()
+                except (queue.Empty, OSError, ValueError):
+                    break
+                if message[0]=="batch":
+                    _SharedBlock(message[2])
+
+    def close(self):
+        self._stop.set()
+        deadline = time.time()+5
+        while any(p.is_alive() for p in self._processes) and time.time()<deadline:
+            self._drain()
+            for p in self._processes:
+                p.join(timeout=0.05)
+        for p in self._processes:
+            if p.is_alive():
+                p.terminate()
+        self._drain()
+        self._processes = []
+        self._running = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        if len(getattr(self, "_processes", []))>0:
+            self.close()
@@ -0,0 +1,28 @@
+"""
+Shared fixtures of the unit tests
+
+rlsn 2024
+"""
+import os, sys
+sys.path.append(os.getcwd())
+import pytest
+from pygestor import footer_cache
+
+@pytest.fixture(autouse=True)
+def tmp_footer_cache(tmp_path, monkeypatch):
+    # footers of the test files go to a temporary cache rather than the default one
+    cache = footer_cache.FooterCache(str(tmp_path/".footers.db"))
+    monkeypatch.setattr(footer_cache, "_footer_cache", cache)
+    return cache
+
+@pytest.fixture
+def tmp_meta(tmp_path, monkeypatch):
+    # an empty metadata store, data and download cache of the core api under tmp_path
+    from pygestor import core_api
+    from pygestor.metastore import MetaStore
+    monkeypatch.setattr(core_api, "DATA_DIR", str(tmp_path/"data"))
+    monkeypatch.setattr(core_api, "CACHE_DIR", str(tmp_path/"cache"))
+    monkeypatch.setattr(core_api, "_download_cache", None)
+    monkeypatch.setattr(core_api, "_metadata", core_api.initialize_root())
+    monkeypatch.setattr(core_api, "_meta_store", MetaStore.get("json")(str(tmp_path/"metadata.json")))
+    return core_api._metadata
@@ -5,7 +5,93 @@ rlsn 2024
 """
 import os, sys
 sys.path.append(os.getcwd())
+import time
 import pygestor
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pygestor import core_api
+from pygestor.dataset_wrapper import BaseDataset, Dataset, dataset_struct, subset_struct, partition_struct
+from pygestor.utils import joinpath
+
+def write_partition(datapath, n_rows=10):
+    path = joinpath(core_api.DATA_DIR, core_api.get_meta(*datapath)["path"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(pa.table({"id":list(range(n_rows))}), path)
+    return path
+
+@Dataset.register("tests/stub")
+class StubDataset(BaseDataset):
+    # a dataset class predating download plans
+    abstract = False
+    @classmethod
+    def download(cls, datapath):
+        return write_partition(datapath)
+
+@Dataset.register("tests/planned")
+class PlannedDataset(BaseDataset):
+    abstract = False
+    @classmethod
+    def prepare_download(cls, name, subset, partitions):
+        return {part:f"blob-{part}" for part in partitions}
+    @classmethod
+    def download(cls, datapath, plan=None):
+        return write_partition(datapath), dict(blob_id=plan[datapath[2]])
+
+@Dataset.register("tests/slow")
+class SlowDataset(BaseDataset):
+    # downloads overlap, and one partition fails
+    abstract = False
+    @classmethod
+    def download(cls, datapath):
+        time.sleep(0.05)
+        if datapath[2]=="p3.parquet":
+            raise Exception("connection reset")
+        return write_partition(datapath)
+
+def add_dataset(meta, name, n_partitions):
+    ds = meta["datasets"][name] = dataset_struct(path=name, dataset_class=name)
+    subs = ds["subsets"]["s"] = subset_struct(path=joinpath(name, "s"))
+    for i in range(n_partitions):
+        subs["partitions"][f"p{i}.parquet"] = partition_struct(path=joinpath(name, "s", f"p{i}.parquet"))
+    return subs["partitions"]
+
+def test_download(tmp_meta):
+    parts = add_dataset(tmp_meta, "tests/stub", 2)
+    assert core_api.download("tests/stub", "s", verbose=False)=={}
+    assert all(p["downloaded"] and p["n_samples"]==10 for p in parts.values())
+
+    # the plan is passed to the download of each partition
+    parts = add_dataset(tmp_meta, "tests/planned", 2)
+    assert core_api.download("tests/planned", "s", verbose=False)=={}
+    assert [p["blob_id"] for p in parts.values()]==["blob-p0.parquet", "blob-p1.parquet"]
+
+def test_concurrent_download(tmp_meta, monkeypatch):
+    add_dataset(tmp_meta, "tests/slow", 8)
+    failed = core_api.download("tests/slow", "s", verbose=False, max_workers=4)
+    # the failing partition does not abort the others
+    assert list(failed)==["p3.parquet"] and "connection reset" in failed["p3.parquet"]
+    # every commit of the pool made it to the store
+    stored = core_api._meta_store.load()["datasets"]["tests/slow"]["subsets"]["s"]
+    assert [p["downloaded"] for p in stored["partitions"].values()]==[True]*3+[False]+[True]*4
+    assert stored["rollup"]["downloaded"]==7 and stored["rollup"]["n_samples"]==70
+
+    # the download cache is left alone when nothing is fetched
+    evicted = []
+    monkeypatch.setattr(core_api, "get_download_cache", lambda: evicted.append(1))
+    assert len(core_api.get_filepaths("tests/slow", "s"))==7
+    assert evicted==[]
+
+def test_load_decoded(tmp_meta, tmp_path, monkeypatch):
+    from pygestor.decoded_cache import DecodedCache, parquet_to_ipc
+    add_dataset(tmp_meta, "tests/stub", 3)
+    core_api.download("tests/stub", "s", verbose=False)
+    size = os.path.getsize(parquet_to_ipc(core_api.get_filepaths("tests/stub", "s")[0], str(tmp_path/"p.arrow")))
+    # the subset does not fit in the budget, its partitions are all read nonetheless
+    monkeypatch.setattr(core_api, "_decoded_cache", DecodedCache(str(tmp_path/"decoded"), budget=int(2.5*size)))
+    for _ in range(2):
+        table = core_api.load_dataset("tests/stub", "s", return_format="arrow", cache_decoded=True)
+        assert table.num_rows==30
+    assert core_api.get_decoded_cache().disk.usage()<=2.5*size
 
 def test_core():
     
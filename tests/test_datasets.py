@@ -0,0 +1,122 @@
+"""
+An unit test script to test sample processing of dataset classes
+
+rlsn 2024
+"""
+import os, sys
+sys.path.append(os.getcwd())
+import io
+import numpy as np
+import pandas as pd
+from PIL import Image
+from PIL.JpegImagePlugin import JpegImageFile
+from pygestor.datasets.wit_base import WitbaseDataset, LazyImage
+
+def encode(fmt, size=(64, 48)):
+    with io.BytesIO() as b:
+        Image.fromarray(np.full((size[1], size[0], 3), 128, dtype=np.uint8)).save(b, format=fmt)
+        return dict(bytes=b.getvalue(), path=None)
+
+def test_wit_images():
+    samples = pd.DataFrame({"caption":["a", "b", "c"], "image":[encode("png"), encode("jpeg"), encode("png")]})
+
+    data = WitbaseDataset.process_samples(samples, num_workers=2)
+    assert data.caption==["a", "b", "c"]
+    assert all(type(img)==JpegImageFile for img in data.image)
+
+    data = WitbaseDataset.process_samples(samples, target_size=(16, 16), mode="RGB", num_workers=2)
+    assert all(img.mode=="RGB" and max(img.size)<=16 for img in data.image)
+    assert data.image[0].format is None
+
+    data = WitbaseDataset.process_samples(samples, lazy=True, mode="RGB")
+    assert all(isinstance(img, LazyImage) and img._image is None for img in data.image)
+    assert data.image[1].size==(64, 48) and np.asarray(data.image[1]).shape==(48, 64, 3)
+    assert data.image[0]._image is None
+
+def test_arrow_native():
+    import pyarrow as pa
+    from pygestor.datasets.wikipedia import WikipediaDataset
+    table = pa.table({"text":["a", "b"]})
+    # options meant for other datasets, e.g. image decoding, are accepted and ignored
+    assert WikipediaDataset.process_arrow(table, lazy=True) is table
+    assert WikipediaDataset.process_samples(table.to_pandas(), lazy=True).text==["a", "b"]
+
+def hf_file(path, size, blob_id):
+    from huggingface_hub.hf_api import RepoFile
+    return RepoFile(path=path, size=size, oid=blob_id)
+
+def test_incremental_metadata(tmp_path, monkeypatch, capsys):
+    from pygestor.utils import AttrDict
+    from pygestor.datasets import hf_parquet
+    from pygestor.datasets.hf_parquet import HuggingFaceParquetDataset
+    url = "https://huggingface.co/datasets/org/repo"
+    revision = ["r1"]
+    files = [hf_file("en/p0.parquet", 10, "a0"), hf_file("en/p1.parquet", 20, "a1"), hf_file("fr/p0.parquet", 30, "b0"),
+             hf_file("README.md", 1, "c0")]
+    listed = []
+    monkeypatch.setattr(hf_parquet, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(hf_parquet, "dataset_info", lambda repo_id: AttrDict(sha=revision[0]))
+    monkeypatch.setattr(hf_parquet, "list_repo_tree", lambda repo_id, **kargs: listed.append(kargs["revision"]) or list(files))
+    # the listing has all there is to know, no file is looked up on its own
+    monkeypatch.setattr(hf_parquet, "get_paths_info", None)
+
+    meta = HuggingFaceParquetDataset.get_metadata("org/repo", url)
+    assert sorted(meta["subsets"])==["en", "fr"] and meta["revision"]=="r1"
+    assert meta["subsets"]["en"]["partitions"]["p1.parquet"]["hf_blob_id"]=="a1"
+    # local fields recorded since, e.g. by a download
+    meta["subsets"]["en"]["partitions"]["p0.parquet"].update(downloaded=True, n_samples=5, blob_id="a0")
+
+    # the revision is unchanged, the repository is not listed again
+    assert HuggingFaceParquetDataset.get_metadata("org/repo", url, previous=meta) is meta
+    assert listed==["r1"]
+
+    # only en/p0.parquet changed in the new revision
+    revision[0] = "r2"
+    files[0] = hf_file("en/p0.parquet", 11, "a2")
+    capsys.readouterr()
+    refreshed = HuggingFaceParquetDataset.get_metadata("org/repo", url, verbose=True, previous=meta)
+    out = capsys.readouterr().out
+    assert out.count("retrieving info from")==1 and "retrieving info from en/p0.parquet" in out
+    assert listed==["r1", "r2"] and refreshed["revision"]=="r2"
+    parts = refreshed["subsets"]["en"]["partitions"]
+    assert parts["p1.parquet"] is meta["subsets"]["en"]["partitions"]["p1.parquet"]
+    # what is stored locally stays as is, and is now outdated
+    assert parts["p0.parquet"]["downloaded"] and parts["p0.parquet"]["n_samples"]==5 and parts["p0.parquet"]["blob_id"]=="a0"
+    assert parts["p0.parquet"]["size"]==11 and parts["p0.parquet"]["hf_blob_id"]=="a2" and not parts["p0.parquet"]["is_latest"]
+
+def test_download_plan(tmp_meta, tmp_path, monkeypatch):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from pygestor import core_api
+    from pygestor.utils import AttrDict
+    from pygestor.datasets import hf_parquet
+    from pygestor.dataset_wrapper import dataset_struct, subset_struct, partition_struct
+    ds = tmp_meta["datasets"]["org/repo"] = dataset_struct(path="org/repo", source="https://huggingface.co/datasets/org/repo",
+                                                           dataset_class="HuggingFaceParquet")
+    subs = ds["subsets"]["en"] = subset_struct(path="org/repo/en")
+    for i in range(250):
+        subs["partitions"][f"p{i}.parquet"] = partition_struct(path=f"org/repo/en/p{i}.parquet", size=i, hf_path=f"en/p{i}.parquet")
+
+    requests = []
+    def get_paths_info(repo_id, paths, repo_type=None):
+        requests.append(list(paths))
+        return [AttrDict(path=path, size=int(path[4:-8]), blob_id=f"blob-{path}") for path in paths]
+    def download_file(url, path, size=None, etag=None, **kargs):
+        assert etag==f"blob-{url.split('/resolve/main/')[-1]}"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(pa.table({"id":list(range(size))}), path)
+        return path
+    monkeypatch.setattr(hf_parquet, "get_paths_info", get_paths_info)
+    monkeypatch.setattr(hf_parquet, "download_file", download_file)
+    monkeypatch.setattr(hf_parquet, "RESUMABLE_DOWNLOAD", True)
+    monkeypatch.setattr(hf_parquet, "DATA_DIR", core_api.DATA_DIR)
+
+    # paths are resolved in bounded chunks
+    plan = hf_parquet.HuggingFaceParquetDataset.prepare_download("org/repo", "en", list(subs["partitions"]))
+    assert [len(r) for r in requests]==[100, 100, 50] and len(plan)==250
+
+    # the download of each partition takes its path info from the plan, resolved in a single request
+    requests.clear()
+    assert core_api.download("org/repo", "en", ["p3.parquet", "p4.parquet", "p5.parquet"], verbose=False)=={}
+    assert requests==[["en/p3.parquet", "en/p4.parquet", "en/p5.parquet"]]
+    assert subs["partitions"]["p4.parquet"]["blob_id"]=="blob-en/p4.parquet" and subs["partitions"]["p4.parquet"]["n_samples"]==4
@@ -0,0 +1,54 @@
+"""
+An unit test script to test the resumable downloader against a local server
+
+rlsn 2024
+"""
+import os, sys
+sys.path.append(os.getcwd())
+import pytest
+from pygestor.downloader import download_file
+from benchmarks.hub_standin import HubStandin
+
+def make_file(root, size):
+    data = os.urandom(size)
+    with open(os.path.join(root, "blob.bin"), "wb") as fp:
+        fp.write(data)
+    return data
+
+@pytest.mark.parametrize("n_segments", [1, 4])
+def test_download(tmp_path, n_segments):
+    hub = tmp_path/"hub"
+    hub.mkdir()
+    data = make_file(hub, 3*2**20+17)
+    dest = str(tmp_path/"data"/"blob.bin")
+    with HubStandin(str(hub), bandwidth=1e9, latency=0) as server:
+        download_file(f"{server.url}/blob.bin", dest, n_segments=n_segments, min_segment_size=2**20)
+    assert open(dest, "rb").read()==data
+    assert os.listdir(tmp_path/"data")==["blob.bin"]
+
+@pytest.mark.parametrize("n_segments", [1, 3])
+def test_resume(tmp_path, n_segments):
+    hub = tmp_path/"hub"
+    hub.mkdir()
+    data = make_file(hub, 3*2**20)
+    dest = str(tmp_path/"blob.bin")
+    with HubStandin(str(hub), bandwidth=1e9, latency=0, drop_after=2**19, drops=n_segments) as server:
+        url = f"{server.url}/blob.bin"
+        with pytest.raises(Exception):
+            download_file(url, dest, size=len(data), n_segments=n_segments, min_segment_size=2**20, 
+                          chunk_size=2**16, save_every=2**16)
+        assert not os.path.exists(dest)
+        assert os.path.getsize(dest+".incomplete")==len(data)
+        download_file(url, dest, size=len(data), n_segments=n_segments, min_segment_size=2**20)
+    assert open(dest, "rb").read()==data
+    assert not os.path.exists(dest+".incomplete.json")
+
+def test_redirect_credentials():
+    import urllib.request
+    from pygestor.downloader import _RedirectHandler
+    req = urllib.request.Request("https://hub.example/file", headers={"Authorization":"Bearer x", "Range":"bytes=0-9"})
+    # credentials stay on the host they were meant for, the range follows
+    new = _RedirectHandler().redirect_request(req, None, 302, "Found", {}, "https://storage.example/blob")
+    assert not new.has_header("Authorization") and new.get_header("Range")=="bytes=0-9"
+    new = _RedirectHandler().redirect_request(req, None, 302, "Found", {}, "https://hub.example/other")
+    assert new.has_header("Authorization")
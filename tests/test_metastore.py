@@ -0,0 +1,139 @@
+"""
+An unit test script to test metadata backends
+
+rlsn 2024
+"""
+import os, sys
+sys.path.append(os.getcwd())
+import copy
+from pygestor.metastore import MetaStore, migrate
+from pygestor.dataset_wrapper import dataset_struct, subset_struct, partition_struct
+
+def make_metadata():
+    meta = dict(data_root="./data", cache_dir="./cache", datasets=dict())
+    for ds in ["a/x", "b/y"]:
+        meta["datasets"][ds] = dataset_struct(path=ds, modality="text")
+        for subs in ["s0", "s1"]:
+            meta["datasets"][ds]["subsets"][subs] = subset_struct(path=f"{ds}/{subs}")
+            for i in range(3):
+                part = f"p{i}.parquet"
+                meta["datasets"][ds]["subsets"][subs]["partitions"][part] = partition_struct(path=f"{ds}/{subs}/{part}", size=i)
+    return meta
+
+def test_sqlite_store(tmp_path):
+    src = MetaStore.get("json")(str(tmp_path/"metadata.json"))
+    meta = make_metadata()
+    src.commit(meta)
+
+    store = MetaStore.get("sqlite")(str(tmp_path/"metadata.db"))
+    migrate(src, store)
+    assert store.load() == meta
+
+    # partition upsert
+    meta["datasets"]["a/x"]["subsets"]["s1"]["partitions"]["p2.parquet"]["downloaded"] = True
+    store.commit(meta, ("a/x", "s1", "p2.parquet"))
+    assert store.load() == meta
+
+    # subset replacement and dataset deletion
+    del meta["datasets"]["b/y"]["subsets"]["s0"]["partitions"]["p0.parquet"]
+    store.commit(meta, ("b/y", "s0"))
+    del meta["datasets"]["a/x"]
+    store.commit(meta, ("a/x",))
+    assert store.load() == meta
+
+    store.close()
+    assert MetaStore.get("sqlite")(store.path).load() == meta
+    assert src.load() != meta
+
+def test_json_store(tmp_path):
+    store = MetaStore.get("json")(str(tmp_path/"metadata.json"))
+    meta = make_metadata()
+    store.commit(copy.deepcopy(meta), ("a/x",))
+    assert store.load() == meta
+
+def test_journal_store(tmp_path):
+    store = MetaStore.get("journal")(str(tmp_path/"metadata.json"), limit=2000)
+    meta = make_metadata()
+    store.commit(meta)
+
+    for i in range(20):
+        part = meta["datasets"]["b/y"]["subsets"]["s1"]["partitions"][f"p{i%3}.parquet"]
+        part["n_samples"] = i
+        store.commit(meta, ("b/y", "s1", f"p{i%3}.parquet"))
+        assert store.load() == meta
+    store.wait()
+    assert not os.path.exists(store.journal_path) or os.path.getsize(store.journal_path) < 2000
+    assert MetaStore.get("json")(store.path).load() != make_metadata()
+
+    # a torn record at the end of the journal is ignored
+    del meta["datasets"]["a/x"]
+    store.commit(meta, ("a/x",))
+    with open(store.journal_path, "a") as fp:
+        fp.write('{"path": ["b/y"], "no')
+    assert store.load() == meta
+
+    # so are torn records followed by later commits
+    for i in range(2):
+        part = meta["datasets"]["b/y"]["subsets"]["s1"]["partitions"][f"p{i+1}.parquet"]
+        part["n_samples"] = 11+i
+        store.commit(meta, ("b/y", "s1", f"p{i+1}.parquet"))
+    assert store.load() == meta
+    store.close()
+
+def test_sharded_store(tmp_path):
+    src = MetaStore.get("json")(str(tmp_path/"metadata.json"))
+    src.commit(make_metadata())
+    store = MetaStore.get("sharded")(str(tmp_path/"metadata"))
+    meta = migrate(src, store)
+
+    lazy = store.load()
+    datasets = lazy["datasets"]
+    assert sorted(datasets) == ["a/x", "b/y"]
+    assert datasets.summary("b/y")["modality"] == "text"
+    assert len(datasets.loaded()) == 0
+
+    datasets["b/y"]["subsets"]["s0"]["partitions"]["p1.parquet"]["downloaded"] = True
+    meta["datasets"]["b/y"]["subsets"]["s0"]["partitions"]["p1.parquet"]["downloaded"] = True
+    # only the shard of the subset is rewritten
+    other = store.shard_path("b/y", "s1")
+    os.utime(other, (0, 0))
+    store.commit(lazy, ("b/y", "s0", "p1.parquet"))
+    assert list(datasets.loaded()) == ["b/y"]
+    assert os.path.getmtime(other) == 0 and os.path.getmtime(store.shard_path("b/y", "s0")) > 0
+    assert store.load()["datasets"]["b/y"] == meta["datasets"]["b/y"]
+
+    del datasets["a/x"]
+    del meta["datasets"]["a/x"]
+    store.commit(lazy)
+    assert migrate(store, MetaStore.get("json")(str(tmp_path/"out.json"))) == meta
+    assert not os.path.exists(store.shard_path("a/x"))
+
+def test_load_meta(tmp_path, monkeypatch):
+    import time
+    import threading
+    import pytest
+    from pygestor import core_api
+    monkeypatch.setattr(core_api, "_meta_store", None)
+    monkeypatch.setattr(core_api, "_metadata", dict())
+
+    class SlowStore(MetaStore):
+        def load(self):
+            time.sleep(0.2)
+            if not os.path.exists(self.path):
+                raise FileNotFoundError(self.path)
+            return make_metadata()
+
+    # an aborted initialization leaves no store behind
+    monkeypatch.setattr("builtins.input", lambda prompt: "n")
+    monkeypatch.setattr(core_api, "META_PATH", str(tmp_path/"missing.json"))
+    assert core_api.load_meta(SlowStore(str(tmp_path/"missing"))) is None
+    with pytest.raises(Exception, match="not initialized"):
+        core_api.get_meta("a/x")
+
+    # readers wait for the metadata of a load in progress
+    (tmp_path/"meta").touch()
+    loader = threading.Thread(target=core_api.load_meta, args=(SlowStore(str(tmp_path/"meta")),))
+    loader.start()
+    time.sleep(0.05)
+    assert core_api.get_meta("a/x")["modality"]=="text"
+    loader.join()
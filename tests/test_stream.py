@@ -0,0 +1,296 @@
+"""
+An unit test script to test dataset streams
+
+rlsn 2024
+"""
+import os, sys
+sys.path.append(os.getcwd())
+import time
+import pytest
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pygestor.stream import Prefetcher, DataStream, SubsetView
+
+def write_parts(tmp_path, n_parts=3, n_rows=50, row_group_size=10):
+    paths = []
+    for p in range(n_parts):
+        path = str(tmp_path/f"p{p}.parquet")
+        ids = list(range(p*n_rows, (p+1)*n_rows))
+        pq.write_table(pa.table({"id":ids, "text":[str(i) for i in ids]}), path, row_group_size=row_group_size)
+        paths.append(path)
+    return paths
+
+def test_prefetcher():
+    def slow():
+        for i in range(5):
+            time.sleep(0.02)
+            yield i
+    it = Prefetcher(slow(), prefetch=2, transform=lambda x: x*2, num_threads=2)
+    assert list(it)==[0, 2, 4, 6, 8]
+    assert it.stats.n_items==5 and it.stats.n_waits>0
+
+    def failing():
+        yield 1
+        raise ValueError("broken")
+    it = Prefetcher(failing(), prefetch=2)
+    assert next(it)==1
+    with pytest.raises(ValueError):
+        next(it)
+
+def test_prefetch_stream(tmp_path):
+    paths = write_parts(tmp_path)
+    expected = list(range(150))
+    for prefetch in [0, 3]:
+        stream = DataStream(paths, batch_size=16, prefetch=prefetch, prefetch_threads=2, fragment_readahead=1, batch_readahead=2)
+        batches = list(stream)
+        assert [i for batch in batches for i in batch["id"]]==expected
+        assert stream.stats.n_items==(len(batches) if prefetch else 0)
+
+def test_abandoned_stream(tmp_path):
+    import gc
+    import threading
+    paths = write_parts(tmp_path, n_rows=500)
+    def wait_threads(n):
+        deadline = time.time()+5
+        while threading.active_count()>n and time.time()<deadline:
+            time.sleep(0.05)
+        return threading.active_count()
+    n_threads = threading.active_count()
+    for _ in range(5):
+        for i, batch in enumerate(DataStream(paths, batch_size=4, prefetch=4, prefetch_threads=2)):
+            if i==2:
+                break
+    gc.collect()
+    assert wait_threads(n_threads)==n_threads
+
+    with DataStream(paths, batch_size=4, prefetch=4) as stream:
+        next(stream)
+    assert wait_threads(n_threads)==n_threads and list(stream)==[]
+
+def test_shuffled_stream(tmp_path):
+    paths = write_parts(tmp_path)
+    def epoch_ids(seed, epoch, **kargs):
+        stream = DataStream(paths, batch_size=16, shuffle=True, seed=seed, epoch=epoch, buffer_size=30, **kargs)
+        batches = list(stream)
+        assert all(len(b)==16 for b in batches[:-1])
+        return [i for batch in batches for i in batch["id"]]
+
+    ids = epoch_ids(0, 0)
+    assert sorted(ids)==list(range(150)) and ids!=list(range(150))
+    assert epoch_ids(0, 0, prefetch=2)==ids
+    assert epoch_ids(0, 1)!=ids and epoch_ids(1, 0)!=ids
+
+    stream = DataStream(paths, batch_size=16, shuffle=True, buffer_size=30, columns=["text"], filter=[("id", "<", 20)])
+    texts = [t for batch in stream for t in batch["text"]]
+    assert sorted(map(int, texts))==list(range(20))
+
+def test_sharded_stream(tmp_path):
+    paths = write_parts(tmp_path, n_parts=4, n_rows=37, row_group_size=8)
+    for shuffle in [False, True]:
+        seen = []
+        for rank in range(3):
+            for worker in range(2):
+                stream = DataStream(paths, batch_size=5, shuffle=shuffle, epoch=1, buffer_size=20, n_samples=[37]*4,
+                                    rank=rank, world_size=3, num_workers=2, worker=worker)
+                ids = [i for batch in stream for i in batch["id"]]
+                assert len(ids) in (24, 25)
+                seen += ids
+        assert sorted(seen)==list(range(148))
+
+    with pytest.raises(Exception):
+        list(DataStream(paths, n_samples=[40]*4, world_size=2))
+
+def test_subset_view(tmp_path, monkeypatch):
+    paths = write_parts(tmp_path, n_parts=3, n_rows=37, row_group_size=8)
+    view = SubsetView(paths, n_samples=[37]*3, columns=["text"], cache_size=2)
+    assert len(view)==111
+    assert view[0]=={"text":"0"} and view[-1]=={"text":"110"} and view[45]["text"]=="45"
+    assert view.locate(45)==(paths[1], 1, 0)
+    indices = [100, 3, 45, 4, 110]
+    assert list(view[indices]["text"])==[str(i) for i in indices]
+    assert list(view[10:14]["text"])==["10", "11", "12", "13"]
+    assert len(view._row_groups)==2
+    with pytest.raises(IndexError):
+        view[111]
+
+    empty = SubsetView([])
+    assert len(empty)==0 and len(empty[[]])==0
+    with pytest.raises(IndexError):
+        empty[0]
+
+    # footers are read once, locating a sample does not read them again
+    view = SubsetView(paths, n_samples=[37]*3)
+    monkeypatch.setattr("pygestor.stream.read_footer", None)
+    assert view.locate(100)==(paths[2], 3, 2)
+
+def test_resume_stream(tmp_path):
+    import json
+    paths = write_parts(tmp_path, n_parts=3, n_rows=37, row_group_size=8)
+    for kargs in [dict(), dict(shuffle=True, seed=3, epoch=2, buffer_size=20), dict(world_size=2, rank=1, filter=[("id", ">", 20)])]:
+        full = [list(b["id"]) for b in DataStream(paths, batch_size=7, **kargs)]
+        stream = DataStream(paths, batch_size=7, prefetch=2, **kargs)
+        head = [list(next(stream)["id"]) for _ in range(5)]
+        state = json.loads(json.dumps(stream.state_dict()))
+        stream.close()
+        tail = [list(b["id"]) for b in DataStream(paths, batch_size=7, state=state, **kargs)]
+        assert head+tail==full
+
+    stream = DataStream(paths, batch_size=7)
+    list(stream)
+    assert list(DataStream(paths, batch_size=7, state=stream.state_dict()))==[]
+    with pytest.raises(Exception):
+        DataStream(paths, batch_size=7, shuffle=True, state=stream.state_dict())
+
+def add_length(table):
+    return table.append_column("length", pa.compute.utf8_length(table.column("text")))
+
+def test_worker_pool_stream(tmp_path):
+    from pygestor.worker_pool import WorkerPoolStream
+    paths = write_parts(tmp_path, n_parts=3, n_rows=37, row_group_size=8)
+    ordered = [list(b["id"]) for b in WorkerPoolStream(paths, num_workers=2, batch_size=5)]
+    assert sorted(i for b in ordered for i in b)==list(range(111))
+    assert [list(b["id"]) for b in WorkerPoolStream(paths, num_workers=2, batch_size=5)]==ordered
+
+    stream = WorkerPoolStream(paths, num_workers=3, batch_size=5, ordered=False, transform=add_length, output="arrow", shuffle=True)
+    head = [next(stream) for _ in range(4)]
+    assert all(b.column_names==["id", "text", "length"] for b in head)
+    state = stream.state_dict()
+    stream.close()
+    tail = list(WorkerPoolStream(paths, num_workers=3, batch_size=5, output="arrow", shuffle=True, state=state))
+    ids = [i for b in head+tail for i in b.column("id").to_pylist()]
+    assert sorted(ids)==list(range(111))
+
+def test_stream_output(tmp_path):
+    import numpy as np
+    paths = write_parts(tmp_path, n_parts=2, n_rows=20, row_group_size=8)
+    batches = list(DataStream(paths, batch_size=6, output="arrow"))
+    assert all(isinstance(b, pa.Table) for b in batches)
+
+    for batch in DataStream(paths, batch_size=6, output="numpy"):
+        ids, text = batch["id"], batch["text"]
+        assert isinstance(ids, np.ndarray) and ids.dtype==np.int64
+        decoded = [bytes(text.data[text.offsets[i]:text.offsets[i+1]]).decode() for i in range(len(ids))]
+        assert decoded==[str(i) for i in ids]
+
+def test_evolved_schema_stream(tmp_path):
+    from pygestor.decoded_cache import DecodedCache
+    paths = [str(tmp_path/f"p{i}.parquet") for i in range(2)]
+    pq.write_table(pa.table({"id":[0, 1], "text":pa.nulls(2)}), paths[0])
+    pq.write_table(pa.table({"id":[2, 3], "text":["c", "d"], "lang":["en", "fr"]}), paths[1])
+    for kargs in [dict(), dict(decoded_cache=DecodedCache(str(tmp_path/"decoded")))]:
+        batch = next(iter(DataStream(paths, batch_size=4, output="arrow", **kargs)))
+        assert batch.column("text").to_pylist()==[None, None, "c", "d"] and batch.column("lang").to_pylist()==[None, None, "en", "fr"]
+        view = SubsetView(paths, **kargs)
+        assert view[[3, 0]]["lang"].isna().tolist()==[False, True]
+
+def test_decoded_cache(tmp_path, monkeypatch):
+    import multiprocessing
+    from pygestor import decoded_cache
+    from pygestor.decoded_cache import DecodedCache
+    from pygestor.utils import load_ipc_files
+    paths = write_parts(tmp_path, n_parts=3, n_rows=37, row_group_size=8)
+    cache = DecodedCache(str(tmp_path/"decoded"))
+    kargs = dict(batch_size=7, shuffle=True, seed=1, buffer_size=20, filter=[("id", ">", 20)])
+    full = [list(b["id"]) for b in DataStream(paths, **kargs)]
+    for _ in range(2):
+        assert [list(b["id"]) for b in DataStream(paths, decoded_cache=cache, versions=["a"]*3, **kargs)]==full
+    assert len(cache.disk.entries())==3
+
+    view = SubsetView(paths, n_samples=[37]*3, decoded_cache=cache, versions=["a"]*3)
+    assert list(view[[100, 3, 45]]["text"])==["100", "3", "45"]
+    ipc_path = cache.path(paths[0], "a")
+    assert cache.path(paths[0], "b")!=ipc_path and not os.path.exists(ipc_path)
+    assert list(load_ipc_files([cache.path(p) for p in paths], columns=["id"], filter=[("id", "<", 5)])["id"])==[0, 1, 2, 3, 4]
+
+    size = os.path.getsize(cache.path(paths[1], "a"))
+    small = DecodedCache(str(tmp_path/"small"), budget=int(size*1.5))
+    for p in paths:
+        small.path(p)
+    assert len(small.disk.entries())==1
+
+    # processes reading the same partition decode it once
+    log = str(tmp_path/"decoded.log")
+    def logged(src, dest, convert=decoded_cache.parquet_to_ipc):
+        with open(log, "a") as fp:
+            fp.write(src+"\n")
+        time.sleep(0.2)
+        return convert(src, dest)
+    monkeypatch.setattr(decoded_cache, "parquet_to_ipc", logged)
+    shared = DecodedCache(str(tmp_path/"shared"))
+    processes = [multiprocessing.get_context("fork").Process(target=shared.path, args=(paths[2],)) for _ in range(3)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    assert open(log).read()==paths[2]+"\n" and os.path.exists(shared.path(paths[2]))
+
+def test_local_tier(tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from pygestor import local_tier
+    from pygestor.local_tier import LocalTier
+    paths = write_parts(tmp_path, n_parts=3, n_rows=37, row_group_size=8)
+    tier = LocalTier(str(tmp_path/"local"))
+    copies = []
+    copyfile = local_tier.shutil.copyfile
+    monkeypatch.setattr(local_tier.shutil, "copyfile", lambda src, dst: copies.append(src) or copyfile(src, dst))
+
+    kargs = dict(batch_size=7, shuffle=True, seed=1, buffer_size=20)
+    full = [list(b["id"]) for b in DataStream(paths, **kargs)]
+    for _ in range(2):
+        assert [list(b["id"]) for b in DataStream(paths, local_tier=tier, versions=["a"]*3, **kargs)]==full
+    assert sorted(copies)==sorted(paths)
+    view = SubsetView(paths, n_samples=[37]*3, local_tier=tier, versions=["a"]*3)
+    assert list(view[[100, 3, 45]]["text"])==["100", "3", "45"]
+
+    # a new version of the partition replaces its stale copy, once for concurrent readers
+    stale = tier.path(paths[0], "a")
+    with ThreadPoolExecutor(4) as pool:
+        assert len(set(pool.map(lambda _: tier.path(paths[0], "b"), range(8))))==1
+    assert len(copies)==4 and not os.path.exists(stale)
+
+    small = LocalTier(str(tmp_path/"small"), budget=int(os.path.getsize(paths[0])*1.5))
+    with small.use(paths[0]) as pinned:
+        for p in paths[1:]:
+            small.path(p)
+        assert os.path.exists(pinned)
+    # space is freed when the next copy needs it
+    local_path = small.path(paths[1])
+    assert [e[0] for e in small.disk.entries()]==[os.path.basename(os.path.dirname(local_path))]
+
+def test_pipelined_stream(tmp_path):
+    import json
+    import shutil
+    from pygestor.stream import PipelinedStream
+    (tmp_path/"remote").mkdir()
+    sources = write_parts(tmp_path/"remote", n_parts=4, n_rows=20, row_group_size=8)
+    paths = [str(tmp_path/os.path.basename(p)) for p in sources]
+    fetched, released = [], []
+    def fetch(path):
+        if os.path.basename(path)=="p2.parquet":
+            raise ValueError("unavailable")
+        time.sleep(0.05)
+        shutil.copy(str(tmp_path/"remote"/os.path.basename(path)), path)
+        fetched.append(path)
+    def release(path):
+        released.append(path)
+        os.remove(path)
+
+    stream = PipelinedStream(paths, fetch, lookahead=1, release=release, batch_size=6)
+    first = next(stream)
+    # the first partition is streamed while the second one is fetched, the others are not started yet
+    assert list(first["id"])==list(range(6)) and len(fetched)<=2
+    ids = list(first["id"])+[i for b in stream for i in b["id"]]
+    assert ids==list(range(40))+list(range(60, 80))
+    assert released==[paths[0], paths[1], paths[3]] and not any(os.path.exists(p) for p in paths)
+
+    shards = [[i for b in PipelinedStream(sources, fetch=lambda p: None, world_size=2, rank=r, batch_size=6) for i in b["id"]] for r in range(2)]
+    assert sorted(shards[0]+shards[1])==list(range(80)) and shards[0]==list(range(20))+list(range(40, 60))
+
+    kargs = dict(fetch=lambda p: None, shuffle=True, seed=2, batch_size=6, buffer_size=10)
+    full = [list(b["id"]) for b in PipelinedStream(sources, **kargs)]
+    assert sorted(i for b in full for i in b)==list(range(80)) and full[0]!=list(range(6))
+    stream = PipelinedStream(sources, **kargs)
+    head = [list(next(stream)["id"]) for _ in range(6)]
+    state = json.loads(json.dumps(stream.state_dict()))
+    stream.close()
+    assert head+[list(b["id"]) for b in PipelinedStream(sources, state=state, **kargs)]==full
@@ -0,0 +1,235 @@
+"""
+An unit test script to test utility functions
+
+rlsn 2024
+"""
+import os, sys
+sys.path.append(os.getcwd())
+from pygestor.utils import refresh_rollup, update_partition, compute_subset_download, compute_subset_size, is_subset_latest
+from pygestor.dataset_wrapper import dataset_struct, subset_struct, partition_struct
+
+def test_rollup():
+    ds = dataset_struct()
+    for subs in ["s0", "s1"]:
+        ds["subsets"][subs] = subset_struct()
+        for i in range(4):
+            ds["subsets"][subs]["partitions"][f"p{i}"] = partition_struct(size=10)
+    subs = ds["subsets"]["s1"]
+    assert compute_subset_download(subs)==0 and compute_subset_size(subs)==40
+
+    update_partition(ds, subs, subs["partitions"]["p0"], downloaded=True, is_latest=True, n_samples=5)
+    update_partition(ds, subs, subs["partitions"]["p1"], downloaded=True, n_samples=7)
+    assert compute_subset_download(subs)==2 and not is_subset_latest(subs)
+    assert ds["rollup"]==dict(downloaded=2, size=80, n_samples=12, outdated=1)
+
+    update_partition(ds, subs, subs["partitions"]["p1"], downloaded=False, n_samples=0)
+    assert is_subset_latest(subs)
+    rollup = dict(ds["rollup"])
+    assert refresh_rollup(ds)==rollup
+
+def test_footer_cache(tmp_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from pygestor.footer_cache import FooterCache
+    path = str(tmp_path/"p.parquet")
+    pq.write_table(pa.table({"id":list(range(100)), "text":[str(i) for i in range(100)]}), path, row_group_size=30)
+
+    cache = FooterCache(str(tmp_path/"footers.db"))
+    footer = cache.get(path)
+    assert footer.num_rows==100 and footer.schema.names==["id", "text"]
+    assert [rg.row_offset for rg in footer.row_groups]==[0, 30, 60, 90]
+    assert footer.row_groups[1].columns["id"]["min"]==30 and footer.row_groups[1].columns["id"]["max"]==59
+
+    persisted = FooterCache(str(tmp_path/"footers.db")).get(path)
+    assert persisted.schema==footer.schema and persisted.row_groups==footer.row_groups
+
+    pq.write_table(pa.table({"id":list(range(10))}), path)
+    os.utime(path, (0, 1))
+    assert cache.get(path).num_rows==10
+
+    # footers of changed or removed files, then the oldest ones, are pruned
+    small = FooterCache(str(tmp_path/"small.db"), max_stored=2, prune_every=2)
+    paths = [str(tmp_path/f"q{i}.parquet") for i in range(4)]
+    for p in paths:
+        pq.write_table(pa.table({"id":[1]}), p)
+    small.get(paths[0])
+    os.remove(paths[0])
+    for p in paths[1:]:
+        small.get(p)
+    stored = [row[0] for row in small.conn.execute("SELECT path FROM footers ORDER BY rowid")]
+    assert stored==[os.path.abspath(p) for p in paths[2:]]
+
+def test_disk_cache(tmp_path):
+    import time
+    from pygestor.disk_cache import DiskCache
+    cache = DiskCache(str(tmp_path/"cache"), budget=250)
+    os.makedirs(cache.root)
+    for i, key in enumerate(["a", "b", "c"]):
+        with open(cache.entry_path(key), "wb") as fp:
+            fp.write(b"0"*100)
+        os.utime(cache.entry_path(key), (i, i))
+    cache.touch("a")
+
+    with cache.use("b"):
+        # b is pinned, c is the least recently used one left
+        assert cache.evict(reserve=50)==100
+        assert sorted(e[0] for e in cache.entries())==["a", "b"]
+        assert cache.clear()==100
+    assert cache.clear()==100 and cache.usage()==0
+
+    # reading an entry, e.g. when its size is computed, does not make it recently used
+    for i, key in enumerate(["d", "e"]):
+        os.makedirs(os.path.join(cache.entry_path(key), "sub"))
+        with open(os.path.join(cache.entry_path(key), "sub", "f"), "wb") as fp:
+            fp.write(b"0"*100)
+        os.utime(cache.entry_path(key), (i, i))
+    os.utime(cache.entry_path("d"), (time.time()+3600, 0))
+    cache.touch("e")
+    assert os.stat(cache.entry_path("e")).st_atime==1
+    assert cache.evict(reserve=100)==100
+    assert [e[0] for e in cache.entries()]==["e"]
+
+def test_load_parquets(tmp_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from pygestor.utils import load_parquets
+    paths = []
+    for i in range(3):
+        paths.append(str(tmp_path/f"p{i}.parquet"))
+        pq.write_table(pa.table({"id":list(range(i*10, i*10+10)), "text":["x"]*10}), paths[-1])
+
+    df = load_parquets(paths)
+    assert len(df)==30 and sorted(df["id"])==list(range(30))
+    assert load_parquets(paths, return_format="arrow").num_rows==30
+    arrays = load_parquets(paths, return_format="numpy")
+    assert arrays["id"].sum()==sum(range(30)) and len(arrays.text.offsets)==31 and bytes(arrays.text.data)==b"x"*30
+
+def test_load_evolved_schema(tmp_path):
+    import pyarrow as pa
+    import pandas as pd
+    import pyarrow.parquet as pq
+    from pygestor.utils import load_parquets, load_parquets_in_batch
+    paths = [str(tmp_path/f"p{i}.parquet") for i in range(2)]
+    # a column all null in the first file, and one only in the second
+    pq.write_table(pa.table({"id":[0, 1], "text":pa.nulls(2)}), paths[0])
+    pq.write_table(pa.table({"id":[2, 3], "text":["c", "d"], "lang":["en", "fr"]}), paths[1])
+
+    table = load_parquets(paths, return_format="arrow")
+    assert table.schema.field("text").type==pa.string()
+    assert table.column("text").to_pylist()==[None, None, "c", "d"]
+    assert table.column("lang").to_pylist()==[None, None, "en", "fr"]
+    lang = [v for df in load_parquets_in_batch(paths, 4) for v in df["lang"]]
+    assert lang[2:]==["en", "fr"] and pd.isna(lang[:2]).all()
+
+def test_scan_pushdown(tmp_path):
+    import pyarrow as pa
+    import pyarrow.dataset as pds
+    import pyarrow.parquet as pq
+    from pygestor.utils import load_parquets, load_parquets_in_batch
+    path = str(tmp_path/"p.parquet")
+    pq.write_table(pa.table({"id":list(range(100)), "text":[str(i) for i in range(100)]}), path, row_group_size=10)
+
+    table = load_parquets([path], "arrow", columns=["text"], filter=[("id", ">=", 95)])
+    assert table.column_names==["text"] and table.column("text").to_pylist()==["95","96","97","98","99"]
+    table = load_parquets([path], "arrow", filter=pds.field("id")<3)
+    assert table.num_rows==3
+    batches = list(load_parquets_in_batch([path], 4, columns=["id"], filter=[[("id", "<", 2)], [("id", ">", 97)]]))
+    assert sum(len(b) for b in batches)==4 and list(batches[0].columns)==["id"]
+
+def test_stats_index(tmp_path):
+    import json
+    import pyarrow as pa
+    import pyarrow.dataset as pds
+    import pyarrow.parquet as pq
+    from pygestor.stats_index import partition_stats, prune, encode_schema, decode_schema
+    paths = []
+    for p in range(3):
+        paths.append(str(tmp_path/f"p{p}.parquet"))
+        ids = list(range(p*50, (p+1)*50))
+        pq.write_table(pa.table({"id":ids, "lang":["en" if p<2 else "fr"]*50, "score":[None if i%2 else float(i) for i in ids]}),
+                       paths[-1], row_group_size=10)
+    # stats are stored in the json metadata
+    stats = json.loads(json.dumps([partition_stats(path, ["id", "lang", "score", "missing"]) for path in paths]))
+    assert stats[1]["columns"]["id"]=={"min":50, "max":99, "null_count":0, "num_rows":50}
+    assert stats[0]["columns"]["score"]["null_count"]==25 and len(stats[0]["row_groups"])==5
+    schema = pq.read_schema(paths[0])
+    assert decode_schema(json.loads(json.dumps(encode_schema(schema))))==schema.remove_metadata()
+
+    assert prune(stats, [("id", ">", 120)], schema)==[2]
+    assert prune(stats, [[("lang", "=", "fr")], [("id", "<", 10)]], schema)==[0, 2]
+    assert prune(stats, pds.field("lang").isin(["de"]), schema)==[]
+    assert prune(stats+[None], [("id", "in", [5, 75])], schema, row_groups=True)=={0:[0], 1:[2], 3:None}
+    # bounds of columns with nulls do not hold for every row
+    assert prune(stats, [("score", "<", 3)], schema)==[0, 1, 2]
+    assert prune(stats, None, schema)==[0, 1, 2]
+
+def test_query_partitions(tmp_path, monkeypatch):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from pygestor import core_api
+    from pygestor.metastore import MetaStore
+    monkeypatch.setattr(core_api, "DATA_DIR", str(tmp_path/"data"))
+    monkeypatch.setattr(core_api, "CACHE_DIR", str(tmp_path/"cache"))
+    monkeypatch.setattr(core_api, "_metadata", dict(datasets=dict()))
+    monkeypatch.setattr(core_api, "_meta_store", MetaStore.get("json")(str(tmp_path/"metadata.json")))
+
+    meta = dataset_struct(path="a/x")
+    meta["subsets"]["s"] = subset_struct(path="a/x/s")
+    os.makedirs(tmp_path/"data"/"a/x/s")
+    for p in range(3):
+        part = f"p{p}.parquet"
+        pq.write_table(pa.table({"id":list(range(p*50, (p+1)*50)), "lang":["en" if p<2 else "fr"]*50}),
+                       tmp_path/"data"/"a/x/s"/part, row_group_size=10)
+        meta["subsets"]["s"]["partitions"][part] = partition_struct(path=f"a/x/s/{part}", downloaded=p<2)
+    core_api._metadata["datasets"]["a/x"] = meta
+    core_api.index_stats("a/x", "s", partitions=["p0.parquet", "p1.parquet"], columns=["id", "lang"])
+    # the schema is kept once for the subset
+    assert "stats_schema" in core_api.get_meta("a/x", "s") and "schema" not in core_api.get_meta("a/x", "s", "p0.parquet")["stats"]
+
+    # answered from the metadata alone, the files are neither opened nor needed
+    for part in ["p0.parquet", "p1.parquet"]:
+        os.remove(tmp_path/"data"/"a/x/s"/part)
+    monkeypatch.setattr(core_api, "read_schema", None)
+    # the partition that is not downloaded has no stats and stays a candidate
+    assert core_api.query_partitions("a/x", "s", [("id", ">=", 60)])==["p1.parquet", "p2.parquet"]
+    assert core_api.query_partitions("a/x", "s", [("lang", "=", "fr")])==["p2.parquet"]
+    assert core_api.query_partitions("a/x", "s", [("id", "in", [5, 75])], row_groups=True)=={"p0.parquet":[0], "p1.parquet":[2], "p2.parquet":None}
+
+def test_samples_to_columns():
+    import pandas as pd
+    import pyarrow as pa
+    from pygestor.utils import samples_to_columns
+    df = pd.DataFrame({"id":[1, 2, 3], "text":["a", "b", "c"], "2nd col":[0.5, 1.5, 2.5]})
+    data = samples_to_columns(df, decoders={"text":str.upper})
+    assert data.id==[1, 2, 3] and data.text==["A", "B", "C"] and data["2nd col"]==[0.5, 1.5, 2.5]
+    assert samples_to_columns(pa.Table.from_pandas(df, preserve_index=False), decoders={"text":str.upper})==data
+
+def test_table_to_numpy():
+    import numpy as np
+    import pyarrow as pa
+    from pygestor.utils import table_to_numpy
+    table = pa.table({"id":np.arange(10), "text":["a", "bb", None, "ccc", "d"]*2, "score":[0.5, None]*5}).slice(3, 5)
+    data = table_to_numpy(table)
+    assert np.shares_memory(data.id, np.frombuffer(table.column("id").chunk(0).buffers()[1], dtype=np.int64))
+    assert list(data.id)==[3, 4, 5, 6, 7]
+    assert list(data.text.valid)==[True, True, True, True, False]
+    assert bytes(data.text.data[data.text.offsets[0]:data.text.offsets[1]])==b"ccc"
+    assert list(data.score.valid)==[False, True, False, True, False] and data.score.values[1]==0.5
+
+    # unsigned integers with nulls keep their sign
+    table = pa.table({"u8":pa.array([200, None], pa.uint8()), "u64":pa.array([2**63+1, None], pa.uint64())})
+    data = table_to_numpy(table)
+    assert data.u8.values.dtype==np.uint8 and data.u8.values[0]==200 and int(data.u64.values[0])==2**63+1
+
+def test_loader_snippets():
+    import ast
+    import pytest
+    import pyarrow.dataset as pds
+    pytest.importorskip("nicegui")
+    from pygestor.webui.webui_utils import stream_load_code_snippet, full_load_code_snippet
+    code = full_load_code_snippet("a/x", "s", ["p0.parquet"], columns=("id", "text"), filter=[("lang", "=", "en")])
+    assert code.endswith('load_dataset("a/x", "s", ["p0.parquet"], columns=[\'id\', \'text\'], filter=[(\'lang\', \'=\', \'en\')])')
+    # expressions have no source form and are left out
+    code = stream_load_code_snippet("a/x", "s", columns=["id"], filter=pds.field("id")>3)
+    assert "columns=['id'])" in code and "filter" not in code
+    ast.parse(code+"\n    pass")